@@ -0,0 +1,69 @@
+"""
+Benchmark request payload encryption in payloads per second.
+
+    python -m benchmarks.bench_crypto [--seconds 1.0]
+"""
+import argparse
+import json
+import time
+
+from cryptography.hazmat import backends
+from cryptography.hazmat.primitives.ciphers import (
+    Cipher,
+    algorithms,
+    modes,
+)
+
+from mxget import crypto
+from mxget.provider import (
+    baidu,
+    netease,
+)
+
+_PAYLOAD = json.dumps({'c': json.dumps([{'id': i} for i in range(20)])}).encode('utf-8')
+
+
+def _legacy_cbc_encrypt(plain_text: bytes, key: bytes, iv: bytes) -> bytes:
+    padding = 16 - len(plain_text) % 16
+    plain_text = plain_text + bytearray([padding] * padding)
+    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=backends.default_backend())
+    encryptor = cipher.encryptor()
+    return cipher.encryptor().update(plain_text) + encryptor.finalize()
+
+
+def _rate(func, seconds: float, batch: int = 1) -> float:
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        func()
+        count += batch
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    key, iv = netease._PRESET_KEY, netease._IV
+    pool = netease._create_key_pool(16)
+    many = [_PAYLOAD] * 100
+    cases = [
+        ('aes-cbc legacy', lambda: _legacy_cbc_encrypt(_PAYLOAD, key, iv), 1),
+        ('aes-cbc cached cipher', lambda: crypto.aes_cbc_encrypt(_PAYLOAD, key, iv), 1),
+        ('aes-ecb cached cipher', lambda: crypto.aes_ecb_encrypt(_PAYLOAD, key), 1),
+        ('aes-ecb encrypt_many x100', lambda: crypto.encrypt_many(many, key), len(many)),
+        ('aes-cbc encrypt_many x100', lambda: crypto.encrypt_many(many, key, iv), len(many)),
+        ('netease weapi', lambda: netease._weapi({'ids': '[1, 2, 3]'}), 1),
+        ('netease weapi key pool', lambda: netease._weapi({'ids': '[1, 2, 3]'}, pool), 1),
+        ('netease linuxapi', lambda: netease._linuxapi({'method': 'POST', 'params': {'id': 1}}), 1),
+        ('baidu song params', lambda: baidu._aes_cbc_encrypt(1), 1),
+        ('baidu signed payload', lambda: baidu._sign_payload({'list_id': 1, 'withsong': 1}), 1),
+    ]
+    for name, func, batch in cases:
+        print('{:<28} {:>12,.0f} payloads/s'.format(name, _rate(func, args.seconds, batch)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark peak memory of buffered versus streamed downloads.
+
+A local stub streams files of the requested sizes; every file is downloaded
+concurrently into a temporary directory and peak Python memory is reported.
+With --throttle the stub caps every connection at that many KiB/s, like the
+CDNs that segmented downloads are meant for.
+
+    python -m benchmarks.bench_download [--sizes 4 32] [--concurrency 1 8] [--throttle 2048] [--segments 4]
+"""
+import argparse
+import asyncio
+import pathlib
+import tempfile
+import time
+import tracemalloc
+
+import aiofiles
+import aiohttp
+from aiohttp import web
+
+from mxget import (
+    download,
+    utils,
+)
+
+_BLOCK = b'\xff' * download.CHUNK_SIZE
+
+
+class _Client:
+    def __init__(self, session: aiohttp.ClientSession):
+        self._session = session
+
+    async def request(self, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
+        return await self._session.request(method, url, **kwargs)
+
+
+async def _file(request: web.Request):
+    size = int(request.match_info['size'])
+    throttle = request.app['throttle']
+    first, last = 0, size - 1
+    status = 200
+    headers = {'Accept-Ranges': 'bytes', 'ETag': '"{}"'.format(size)}
+    if 'Range' in request.headers:
+        start, _, end = request.headers['Range'][len('bytes='):].partition('-')
+        first, last = int(start), int(end or last)
+        status = 206
+        headers['Content-Range'] = 'bytes {}-{}/{}'.format(first, last, size)
+    headers['Content-Length'] = str(last - first + 1)
+
+    resp = web.StreamResponse(status=status, headers=headers)
+    await resp.prepare(request)
+    if request.method == 'HEAD':
+        return resp
+
+    sent = 0
+    while sent < last - first + 1:
+        block = _BLOCK[:last - first + 1 - sent]
+        await resp.write(block)
+        sent += len(block)
+        if throttle:
+            await asyncio.sleep(len(block) / throttle)
+    await resp.write_eof()
+    return resp
+
+
+async def _buffered(client: _Client, url: str, file_path: pathlib.Path):
+    resp = await client.request('GET', url)
+    f = await aiofiles.open(str(file_path), 'wb')
+    await f.write(await resp.read())
+    await f.close()
+
+
+async def _streamed(client: _Client, url: str, file_path: pathlib.Path):
+    await download.fetch(client, url, file_path)
+
+
+def _segmented(segments: int):
+    async def fetch(client: _Client, url: str, file_path: pathlib.Path):
+        await download.fetch(client, url, file_path, segments=segments, min_segment_size=1024 * 1024)
+
+    return fetch
+
+
+async def _measure(base: str, size: int, concurrency: int, func) -> tuple:
+    with tempfile.TemporaryDirectory() as tmp:
+        async with aiohttp.ClientSession() as session:
+            client = _Client(session)
+            url = '{}/file/{}'.format(base, size)
+            tracemalloc.start()
+            start = time.perf_counter()
+            await asyncio.gather(*[func(client, url, pathlib.Path(tmp, str(i))) for i in range(concurrency)])
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return elapsed, peak
+
+
+async def _run(sizes, concurrencies, throttle: int, segments: int) -> None:
+    app = web.Application()
+    app['throttle'] = throttle * 1024
+    app.router.add_get('/file/{size}', _file)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    base = 'http://127.0.0.1:{}'.format(site._server.sockets[0].getsockname()[1])
+
+    print('{:>10} {:>12} {:>10} {:>12} {:>10}'.format('mode', 'file size', 'files', 'peak memory', 'seconds'))
+    for size in sizes:
+        for concurrency in concurrencies:
+            modes = [('buffered', _buffered), ('streamed', _streamed)]
+            if segments > 1:
+                modes.append(('segmented', _segmented(segments)))
+            for name, func in modes:
+                elapsed, peak = await _measure(base, size * 1024 * 1024, concurrency, func)
+                print('{:>10} {:>12} {:>10} {:>12} {:>10.2f}'.format(
+                    name, utils.format_size(size * 1024 * 1024), concurrency, utils.format_size(peak), elapsed))
+
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[4, 32], help='file sizes in MiB')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--throttle', type=int, default=0, help='per-connection limit in KiB/s, 0 for none')
+    parser.add_argument('--segments', type=int, default=1, help='also run segmented downloads with this many ranges')
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(_run(args.sizes, args.concurrency, args.throttle, args.segments))
+
+
+if __name__ == '__main__':
+    main()
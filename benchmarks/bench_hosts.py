@@ -0,0 +1,130 @@
+"""
+Benchmark the old CPU-sized semaphore against the per-host download scheduler.
+
+A local stub serves each track after a per-host latency and streams the body at
+a per-connection rate, like a CDN that throttles single connections. It answers
+under four loopback addresses with different profiles, and the playlist mixes
+them in a shuffled order. Tracks are fetched through download.fetch, either all
+behind one Semaphore(min(cpus, 32)) as concurrent_download used to, or through
+a Scheduler with the default limits.
+
+    python -m benchmarks.bench_hosts [--tracks 200] [--size 512] [--cpus 8] [--host-limit 8]
+"""
+import argparse
+import asyncio
+import collections
+import pathlib
+import random
+import tempfile
+import time
+
+import aiohttp
+import yarl
+from aiohttp import web
+
+from mxget import (
+    download,
+    scheduler,
+)
+
+# host, latency in ms, per-connection rate in KiB/s, share of the playlist
+_HOSTS = (
+    ('127.0.0.1', 50, 8192, 0.4),
+    ('127.0.0.2', 150, 2048, 0.3),
+    ('127.0.0.3', 400, 1024, 0.2),
+    ('127.0.0.4', 800, 512, 0.1),
+)
+_CHUNK_SIZE = 16 * 1024
+
+
+class _Client:
+    def __init__(self, session: aiohttp.ClientSession):
+        self._session = session
+
+    async def request(self, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
+        return await self._session.request(method, url, **kwargs)
+
+
+async def _semaphore(client, urls, root, cpus, host_limit):
+    sem = asyncio.Semaphore(min(cpus, 32))
+
+    async def one(i, url):
+        async with sem:
+            await download.fetch(client, url, root.joinpath('{}.mp3'.format(i)))
+
+    await asyncio.gather(*[one(i, url) for i, url in enumerate(urls)])
+
+
+async def _scheduler(client, urls, root, cpus, host_limit):
+    sched = scheduler.Scheduler(per_host=host_limit)
+
+    async def one(i, url):
+        async with sched.slots(yarl.URL(url).host):
+            await download.fetch(client, url, root.joinpath('{}.mp3'.format(i)))
+
+    await asyncio.gather(*[one(i, url) for i, url in enumerate(urls)])
+
+
+def _handler(body: bytes, latency: float, rate: float):
+    async def handle(request: web.Request):
+        await asyncio.sleep(latency)
+        resp = web.StreamResponse(headers={'Content-Length': str(len(body))})
+        await resp.prepare(request)
+        for i in range(0, len(body), _CHUNK_SIZE):
+            await resp.write(body[i:i + _CHUNK_SIZE])
+            await asyncio.sleep(_CHUNK_SIZE / rate)
+        return resp
+
+    return handle
+
+
+async def _run(tracks: int, size: int, cpus: int, host_limit: int) -> None:
+    body = b'\xff\xfb\x90\x00' * (size * 1024 // 4)
+
+    runners = []
+    bases = []
+    for host, latency, rate, _ in _HOSTS:
+        app = web.Application()
+        app.router.add_get('/{n}', _handler(body, latency / 1000, rate * 1024))
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, host, 0)
+        await site.start()
+        runners.append(runner)
+        bases.append('http://{}:{}'.format(host, site._server.sockets[0].getsockname()[1]))
+
+    rnd = random.Random(0)
+    picks = rnd.choices(range(len(_HOSTS)), weights=[share for *_, share in _HOSTS], k=tracks)
+    urls = ['{}/{}'.format(bases[p], i) for i, p in enumerate(picks)]
+
+    counts = collections.Counter(picks)
+    print('{} tracks of {} KiB, semaphore sized for {} CPUs'.format(tracks, size, cpus))
+    for i, (host, latency, rate, _) in enumerate(_HOSTS):
+        print('  {:<10} {:>4} tracks, {:>4} ms latency, {:>5} KiB/s per connection'.format(
+            host, counts[i], latency, rate))
+    print('{:>10} {:>10}'.format('mode', 'seconds'))
+    async with aiohttp.ClientSession() as session:
+        client = _Client(session)
+        for name, func in (('semaphore', _semaphore), ('scheduler', _scheduler)):
+            with tempfile.TemporaryDirectory() as tmp:
+                start = time.perf_counter()
+                await func(client, urls, pathlib.Path(tmp), cpus, host_limit)
+                elapsed = time.perf_counter() - start
+            print('{:>10} {:>10.2f}'.format(name, elapsed))
+
+    for runner in runners:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tracks', type=int, default=200)
+    parser.add_argument('--size', type=int, default=512, help='track size in KiB')
+    parser.add_argument('--cpus', type=int, default=8, help='CPU count the old semaphore is sized for')
+    parser.add_argument('--host-limit', type=int, default=scheduler.PER_HOST)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(_run(args.tracks, args.size, args.cpus, args.host_limit))
+
+
+if __name__ == '__main__':
+    main()
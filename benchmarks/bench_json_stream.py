@@ -0,0 +1,104 @@
+"""
+Benchmark full versus incremental parsing of a large playlist response.
+
+Serves a NetEase-shaped playlist from a local stub and reports parse time and
+peak Python memory (in a separate traced run) for api.read_json and jsonstream.load.
+
+    python -m benchmarks.bench_json_stream [--tracks 100000]
+"""
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+import typing
+
+import aiohttp
+from aiohttp import web
+
+from mxget import (
+    api,
+    jsonstream,
+)
+from mxget.provider import netease
+
+
+def _payload(tracks: int) -> bytes:
+    return json.dumps({
+        'code': 200,
+        'playlist': {
+            'id': 1,
+            'name': 'stub',
+            'coverImgUrl': '',
+            'trackCount': tracks,
+            'description': 'x' * 1000,
+            'tracks': [{
+                'id': i,
+                'name': 'song {}'.format(i),
+                'ar': [{'id': i, 'name': 'artist', 'tns': [], 'alias': []}],
+                'al': {'id': i, 'name': 'album', 'picUrl': 'http://127.0.0.1/{}.jpg'.format(i), 'tns': []},
+                'dt': 240000,
+                'h': {'br': 320000, 'fid': 0, 'size': 9600000, 'vd': -2.0},
+                'm': {'br': 192000, 'fid': 0, 'size': 5760000, 'vd': -2.0},
+                'l': {'br': 128000, 'fid': 0, 'size': 3840000, 'vd': -2.0},
+                'privilege': {'fee': 8, 'maxbr': 999000, 'pl': 128000, 'dl': 0},
+            } for i in range(tracks)],
+            'trackIds': [{'id': i, 'v': 1, 'at': 0} for i in range(tracks)],
+        },
+    }).encode('utf-8')
+
+
+async def _parse(url: str, parse) -> typing.Any:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as resp:
+            return await parse(resp)
+
+
+async def _measure(url: str, parse) -> tuple:
+    start = time.perf_counter()
+    data = await _parse(url, parse)
+    elapsed = time.perf_counter() - start
+    del data
+
+    tracemalloc.start()
+    data = await _parse(url, parse)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, len(data['playlist']['tracks'])
+
+
+async def _run(tracks: int) -> None:
+    body = _payload(tracks)
+
+    async def playlist(request: web.Request):
+        return web.Response(body=body, content_type='application/json')
+
+    app = web.Application()
+    app.router.add_get('/playlist', playlist)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = 'http://127.0.0.1:{}/playlist'.format(site._server.sockets[0].getsockname()[1])
+
+    print('payload {:.1f} MiB, ijson C backend: {}'.format(len(body) / 1024 / 1024, jsonstream.available()))
+    cases = (
+        ('read_json', api.read_json),
+        ('jsonstream.load', lambda resp: jsonstream.load(resp, netease._PLAYLIST_PATHS)),
+    )
+    for name, parse in cases:
+        elapsed, peak, count = await _measure(url, parse)
+        print('{:<16} {:>8.3f} s {:>10.1f} MiB peak {:>8} tracks'.format(name, elapsed, peak / 1024 / 1024, count))
+
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tracks', type=int, default=100000)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(_run(args.tracks))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark NetEase playlist resolution against a local stub server.
+
+The stub decrypts weapi payloads (the benchmark pins the secret key), sleeps in
+proportion to the number of requested ids, and rejects URL batches larger than
+a threshold, the way upstream does for huge bodies.
+
+    python -m benchmarks.bench_netease_playlist [--tracks 10000]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import time
+import urllib.parse
+
+from aiohttp import web
+
+from mxget import crypto
+from mxget.provider import netease
+
+_SEC_KEY = b'0123456789abcdef'
+_URL_BATCH_REJECT = 1000
+
+
+def _decrypt_weapi(body: str) -> dict:
+    form = urllib.parse.parse_qs(body)
+    params = base64.b64decode(form['params'][0])
+    inner = base64.b64decode(crypto.aes_cbc_decrypt(params, _SEC_KEY, netease._IV))
+    return json.loads(crypto.aes_cbc_decrypt(inner, netease._PRESET_KEY, netease._IV))
+
+
+def _track(song_id: int) -> dict:
+    return {
+        'id': song_id,
+        'name': 'song {}'.format(song_id),
+        'ar': [{'name': 'artist'}],
+        'al': {'name': 'album', 'picUrl': 'http://127.0.0.1/pic.jpg'},
+    }
+
+
+def _make_app(total: int, per_id_delay: float) -> web.Application:
+    async def playlist(request: web.Request):
+        _decrypt_weapi(await request.text())
+        return web.json_response({
+            'code': 200,
+            'playlist': {
+                'id': 1,
+                'name': 'stub',
+                'coverImgUrl': '',
+                'trackCount': total,
+                'tracks': [_track(i) for i in range(min(total, netease._SONG_REQUEST_LIMIT))],
+                'trackIds': [{'id': i} for i in range(total)],
+            },
+        })
+
+    async def songs(request: web.Request):
+        data = _decrypt_weapi(await request.text())
+        ids = [c['id'] for c in json.loads(data['c'])]
+        await asyncio.sleep(0.005 + per_id_delay * len(ids))
+        return web.json_response({'code': 200, 'songs': [_track(i) for i in ids]})
+
+    async def songs_url(request: web.Request):
+        data = _decrypt_weapi(await request.text())
+        ids = json.loads(data['ids'])
+        await asyncio.sleep(0.005 + per_id_delay * len(ids))
+        if len(ids) > _URL_BATCH_REJECT:
+            return web.json_response({'code': 400, 'msg': 'request body too large'})
+        return web.json_response({
+            'code': 200,
+            'data': [{'id': i, 'code': 200, 'url': 'http://127.0.0.1/{}.mp3'.format(i)} for i in ids],
+        })
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post('/weapi/v3/playlist/detail', playlist)
+    app.router.add_post('/weapi/v3/song/detail', songs)
+    app.router.add_post('/weapi/song/enhance/player/url', songs_url)
+    return app
+
+
+async def _run(total: int, per_id_delay: float) -> None:
+    runner = web.AppRunner(_make_app(total, per_id_delay))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    base = 'http://127.0.0.1:{}'.format(port)
+
+    netease._create_secret_key = lambda size: _SEC_KEY
+    netease._API_GET_PLAYLIST = base + '/weapi/v3/playlist/detail'
+    netease._API_GET_SONGS = base + '/weapi/v3/song/detail'
+    netease._API_GET_SONGS_URL = base + '/weapi/song/enhance/player/url'
+
+    print('{:>12} {:>12} {:>10} {:>10}'.format('batch size', 'concurrency', 'seconds', 'playable'))
+    for batch_size, concurrency in ((total, 1), (500, 1), (500, 4), (200, 8)):
+        async with netease.NetEase(url_batch_size=batch_size, chunk_concurrency=concurrency) as client:
+            start = time.perf_counter()
+            playlist = await client.get_playlist(1)
+            elapsed = time.perf_counter() - start
+        playable = sum(1 for s in playlist.songs if s.playable)
+        print('{:>12} {:>12} {:>10.3f} {:>10}'.format(batch_size, concurrency, elapsed, playable))
+
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tracks', type=int, default=10000)
+    parser.add_argument('--per-id-delay', type=float, default=0.00005)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(_run(args.tracks, args.per_id_delay))
+
+
+if __name__ == '__main__':
+    main()
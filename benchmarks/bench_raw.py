@@ -0,0 +1,63 @@
+"""
+Benchmark building the server response for a large raw playlist payload.
+
+    python -m benchmarks.bench_raw [--tracks 100000]
+"""
+import argparse
+import json
+import time
+
+from mxget import (
+    api,
+    server,
+)
+
+
+class _Client:
+    def platform_id(self) -> api.PlatformId:
+        return api.PlatformId.NetEase
+
+
+def _payload(tracks: int) -> bytes:
+    return json.dumps({
+        'code': 200,
+        'playlist': {
+            'id': 1,
+            'tracks': [{'id': i, 'name': 'song {}'.format(i), 'ar': [{'id': i, 'name': 'artist'}]}
+                       for i in range(tracks)],
+            'trackIds': [{'id': i} for i in range(tracks)],
+        },
+    }).encode('utf-8')
+
+
+def _timed(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tracks', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    body = _payload(args.tracks)
+    client = _Client()
+    data = api.RawResponse(json.loads(body))
+    data.body = body
+
+    def reserialize():
+        server.success_response(client, json.loads(body))
+
+    def passthrough():
+        server.raw_response(client, data)
+
+    print('payload {:.1f} MiB'.format(len(body) / 1024 / 1024))
+    for name, func in (('loads + json_response', reserialize), ('raw pass-through', passthrough)):
+        print('{:<24} {:>10.1f} ms'.format(name, _timed(func, args.repeat) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark event-loop lag while tagging a playlist inline versus in the tag pool.
+
+Writes synthetic mp3 files, tags them all concurrently (title, artist, album,
+lyric and a cover, as `--tag` does) and samples how late a 1 ms timer fires
+on the event loop meanwhile.
+
+    python -m benchmarks.bench_tag_lag [--tracks 200] [--size 4] [--workers 4]
+"""
+import argparse
+import asyncio
+import os
+import pathlib
+import tempfile
+import time
+
+from mxget import (
+    api,
+    cover,
+    tag,
+)
+
+_INTERVAL = 0.001
+
+
+class _LagMonitor:
+    def __init__(self):
+        self.samples = []
+        self._running = True
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while self._running:
+            start = loop.time()
+            await asyncio.sleep(_INTERVAL)
+            self.samples.append(loop.time() - start - _INTERVAL)
+
+    def stop(self):
+        self._running = False
+
+    def percentile(self, p: float) -> float:
+        samples = sorted(self.samples)
+        return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+
+def _prepare(root: pathlib.Path, tracks: int, size: int) -> list:
+    audio = b'\xff\xfb\x90\x00' * (size // 4)
+    paths = []
+    for i in range(tracks):
+        path = root.joinpath('{}.mp3'.format(i))
+        path.write_bytes(audio)
+        paths.append(path)
+    return paths
+
+
+async def _inline(paths, songs, pic, workers):
+    async def one(path, song):
+        tag.apply(path, tag.song_frames(song, pic))
+        await asyncio.sleep(0)
+
+    await asyncio.gather(*[one(path, song) for path, song in zip(paths, songs)])
+
+
+async def _pooled(paths, songs, pic, workers):
+    with tag.Tagger(workers) as tagger:
+        await asyncio.gather(*[tagger.apply(path, tag.song_frames(song, pic)) for path, song in zip(paths, songs)])
+
+
+async def _measure(func, paths, songs, pic, workers) -> tuple:
+    monitor = _LagMonitor()
+    fut = asyncio.ensure_future(monitor.run())
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    await func(paths, songs, pic, workers)
+    elapsed = time.perf_counter() - start
+    monitor.stop()
+    await fut
+    return elapsed, monitor.percentile(0.5), monitor.percentile(0.99), max(monitor.samples)
+
+
+async def _run(tracks: int, size: int, workers: int) -> None:
+    songs = [api.Song(i, 'song {}'.format(i), 'artist', 'album', lyric='[00:00.00] la\n' * 50) for i in range(tracks)]
+    pic = cover.Cover(os.urandom(300 * 1024), 'image/jpeg')
+    print('{} tracks of {} MiB, {} pool workers'.format(tracks, size, workers))
+    print('{:>8} {:>10} {:>12} {:>12} {:>12}'.format('mode', 'seconds', 'lag p50 ms', 'lag p99 ms', 'lag max ms'))
+    for name, func in (('inline', _inline), ('pool', _pooled)):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = _prepare(pathlib.Path(tmp), tracks, size * 1024 * 1024)
+            elapsed, p50, p99, worst = await _measure(func, paths, songs, pic, workers)
+        print('{:>8} {:>10.2f} {:>12.1f} {:>12.1f} {:>12.1f}'.format(name, elapsed, p50 * 1000, p99 * 1000, worst * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tracks', type=int, default=200)
+    parser.add_argument('--size', type=int, default=4, help='file size in MiB')
+    parser.add_argument('--workers', type=int, default=tag.WORKERS)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(_run(args.tracks, args.size, args.workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark tagging after download versus writing the tag ahead of the audio.
+
+A local stub serves mp3 files that carry a small upstream ID3 tag; every file is
+downloaded and tagged (title, artist, album, lyric and a cover) either by a
+mutagen rewrite after the download or in one pass through download.fetch(prefix=...).
+Bytes written are read from /proc/self/io where available.
+
+    python -m benchmarks.bench_tag_pass [--tracks 50] [--size 8]
+"""
+import argparse
+import asyncio
+import functools
+import os
+import pathlib
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+from mutagen import (
+    id3,
+)
+
+from mxget import (
+    api,
+    cover,
+    download,
+    tag,
+    utils,
+)
+
+
+class _Client:
+    def __init__(self, session: aiohttp.ClientSession):
+        self._session = session
+
+    async def request(self, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
+        return await self._session.request(method, url, **kwargs)
+
+
+def _written() -> int:
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+async def _two_pass(client, url, file_path, frames):
+    await download.fetch(client, url, file_path)
+    await asyncio.get_event_loop().run_in_executor(None, tag.apply, file_path, frames)
+
+
+async def _single_pass(client, url, file_path, frames):
+    transfer = await download.fetch(client, url, file_path, prefix=functools.partial(tag.header, frames))
+    assert transfer.tagged
+
+
+async def _run(tracks: int, size: int) -> None:
+    body = tag.header([id3.TIT2(encoding=id3.Encoding.UTF8, text='upstream')]) + b'\xff\xfb\x90\x00' * (size // 4)
+
+    async def handle(request: web.Request):
+        return web.Response(body=body)
+
+    app = web.Application()
+    app.router.add_get('/{n}', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    base = 'http://127.0.0.1:{}'.format(site._server.sockets[0].getsockname()[1])
+
+    pic = cover.Cover(os.urandom(300 * 1024), 'image/jpeg')
+    song = api.Song(1, 'song', 'artist', 'album', lyric='[00:00.00] la\n' * 50)
+    frames = tag.song_frames(song, pic)
+
+    print('{} tracks of {}'.format(tracks, utils.format_size(len(body))))
+    print('{:>12} {:>10} {:>14}'.format('mode', 'seconds', 'bytes written'))
+    async with aiohttp.ClientSession() as session:
+        client = _Client(session)
+        for name, func in (('two-pass', _two_pass), ('single-pass', _single_pass)):
+            with tempfile.TemporaryDirectory() as tmp:
+                before = _written()
+                start = time.perf_counter()
+                await asyncio.gather(*[
+                    func(client, '{}/{}'.format(base, i), pathlib.Path(tmp, '{}.mp3'.format(i)), frames)
+                    for i in range(tracks)
+                ])
+                elapsed = time.perf_counter() - start
+                written = _written() - before
+            print('{:>12} {:>10.2f} {:>14}'.format(name, elapsed, utils.format_size(written)))
+
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tracks', type=int, default=50)
+    parser.add_argument('--size', type=int, default=8, help='file size in MiB')
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(_run(args.tracks, args.size * 1024 * 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,78 @@
 import abc
+import asyncio
+import codecs
 import enum
+import itertools
 import json
+import re
 import typing
 
 import aiohttp
 
+from mxget import (
+    cache,
+    exceptions,
+    jsonstream,
+    pager,
+)
+
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) ' \
              'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36'
 
+PAGE_SIZE = 50
+
+
+LyricLoader = typing.Callable[[], typing.Awaitable[typing.Optional[str]]]
+Page = typing.Tuple[typing.List[typing.Any], typing.Any]
+
+_lyric_cache = cache.TTLCache(maxsize=4096, ttl=3600)
+
+
+class RawResponse(dict):
+    """Parsed upstream JSON object that keeps the UTF-8 body it was parsed from."""
+    body = b''
+
+
+class _LazyResponse(RawResponse):
+    """``RawResponse`` that parses a top-level value out of ``body`` only when it is looked up."""
+
+    def __missing__(self, key):
+        value = self[key] = jsonstream.item(self.body, key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+_OBJECT_START = re.compile(rb'\s*{')
+
+
+async def read_json(resp: aiohttp.ClientResponse, keep_body: bool = False) -> typing.Any:
+    """
+    Parse a JSON response; with ``keep_body`` an object comes back as a ``RawResponse``.
+    Raw bodies are only passed through, so with a C-accelerated ijson their values
+    are parsed on lookup, which is usually just the status check.
+    """
+    body = await resp.read()
+    encoding = resp.get_encoding()
+    if keep_body and jsonstream.available() and codecs.lookup(encoding).name == 'utf-8' \
+            and _OBJECT_START.match(body):
+        data = _LazyResponse()
+        data.body = body
+        return data
+
+    text = body.decode(encoding)
+    value = json.loads(text)
+    if not keep_body or not isinstance(value, dict):
+        return value
+
+    data = RawResponse(value)
+    data.body = body if codecs.lookup(encoding).name == 'utf-8' else text.encode('utf-8')
+    return data
+
 
 class PlatformId(enum.IntEnum):
     NetEase = 1000
@@ -35,7 +100,7 @@ class SearchSongsData:
         }
 
     def __str__(self):
-        return json.dumps(self, default=lambda o: o.__dict__, indent=4, ensure_ascii=False)
+        return json.dumps(self.serialize(), indent=4, ensure_ascii=False)
 
 
 class SearchSongsResult:
@@ -54,21 +119,44 @@ class SearchSongsResult:
         }
 
     def __str__(self):
-        return json.dumps(self, default=lambda o: o.__dict__, indent=4, ensure_ascii=False)
+        return json.dumps(self.serialize(), indent=4, ensure_ascii=False)
 
 
 class Song:
     def __init__(self, song_id: typing.Union[int, str], name: str, artist: str, album: str = '',
-                 pic_url: str = None, lyric: str = None, url: str = None):
+                 pic_url: str = None, lyric: str = None, url: str = None, lyric_loader: LyricLoader = None):
         self.id = song_id
         self.name = name
         self.artist = artist
         self.album = album
         self.pic_url = pic_url if pic_url is not None else ''
-        self.lyric = lyric if lyric is not None else ''
+        self._lyric = lyric if lyric is not None else ''
+        self._lyric_loader = lyric_loader if lyric is None else None
         self.url = url if url is not None else ''
         self.playable = self.url != ''
 
+    @property
+    def lyric(self) -> str:
+        return self._lyric
+
+    @lyric.setter
+    def lyric(self, lyric: str):
+        self._lyric = lyric if lyric is not None else ''
+        self._lyric_loader = None
+
+    @property
+    def lyric_loaded(self) -> bool:
+        return self._lyric_loader is None
+
+    async def load_lyric(self) -> str:
+        """Fetch the lyric on first use when the provider deferred it."""
+        loader = self._lyric_loader
+        if loader is not None:
+            lyric = await loader()
+            if self._lyric_loader is loader:
+                self.lyric = lyric
+        return self._lyric
+
     def serialize(self):
         data = {
             'id': self.id,
@@ -85,7 +173,24 @@ class Song:
         return data
 
     def __str__(self):
-        return json.dumps(self, default=lambda o: o.__dict__, indent=4, ensure_ascii=False)
+        return json.dumps(self.serialize(), indent=4, ensure_ascii=False)
+
+
+def lyric_loader(platform_id: 'PlatformId', key: typing.Hashable,
+                 fetch: typing.Callable[..., typing.Awaitable[typing.Optional[str]]], *args) -> LyricLoader:
+    """Build a deferred lyric loader backed by the process-wide lyric cache."""
+
+    async def load() -> typing.Optional[str]:
+        try:
+            return await _lyric_cache.get_or_load((platform_id, key), lambda: fetch(*args))
+        except (exceptions.ClientError, aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+
+    return load
+
+
+async def load_lyrics(*songs: Song) -> None:
+    await asyncio.gather(*[song.load_lyric() for song in songs if not song.lyric_loaded])
 
 
 class Artist:
@@ -109,7 +214,7 @@ class Artist:
         }
 
     def __str__(self):
-        return json.dumps(self, default=lambda o: o.__dict__, indent=4, ensure_ascii=False)
+        return json.dumps(self.serialize(), indent=4, ensure_ascii=False)
 
 
 class Album:
@@ -133,7 +238,7 @@ class Album:
         }
 
     def __str__(self):
-        return json.dumps(self, default=lambda o: o.__dict__, indent=4, ensure_ascii=False)
+        return json.dumps(self.serialize(), indent=4, ensure_ascii=False)
 
 
 class Playlist:
@@ -157,10 +262,47 @@ class Playlist:
         }
 
     def __str__(self):
-        return json.dumps(self, default=lambda o: o.__dict__, indent=4, ensure_ascii=False)
+        return json.dumps(self.serialize(), indent=4, ensure_ascii=False)
+
+
+def _page_total(total: typing.Any) -> typing.Optional[int]:
+    try:
+        return int(total)
+    except (TypeError, ValueError):
+        return None
+
+
+async def _iter_paged(fetch: typing.Callable[[int], typing.Awaitable[Page]],
+                      page_size: int, lookahead: int) -> typing.AsyncIterator[typing.Any]:
+    # page_size is the size requested, not inferred: providers may filter songs out of a page
+    items, total = await fetch(1)
+    total = _page_total(total)
+    for item in items:
+        yield item
+
+    count = len(items)
+    if not items or (total is not None and count >= total):
+        return
+
+    if total is not None:
+        pages = range(2, (total + page_size - 1) // page_size + 1)
+    else:
+        pages = itertools.count(2)
+
+    async for items, _ in pager.iter_pages(fetch, pages, lookahead):
+        if not items:
+            return
+        for item in items:
+            yield item
+        count += len(items)
+        if total is not None and count >= total:
+            return
 
 
 class API(metaclass=abc.ABCMeta):
+    # set by the server's raw mode so that *_raw results carry the upstream bytes
+    keep_body = False
+
     @abc.abstractmethod
     async def __aenter__(self):
         pass
@@ -193,6 +335,34 @@ class API(metaclass=abc.ABCMeta):
     async def get_playlist(self, playlist_id: str) -> Playlist:
         """获取歌单"""
 
+    async def search_songs_page(self, keyword: str, page: int = 1, page_size: int = PAGE_SIZE) -> Page:
+        """搜索歌曲（分页），返回当页歌曲与总数"""
+        if page > 1:
+            return [], None
+        result = await self.search_songs(keyword)
+        return result.songs, result.count
+
+    async def get_artist_songs_page(self, artist_id: str, page: int = 1, page_size: int = PAGE_SIZE) -> Page:
+        """获取歌手歌曲（分页），返回当页歌曲与总数"""
+        if page > 1:
+            return [], None
+        artist = await self.get_artist(artist_id)
+        return artist.songs, artist.count
+
+    async def iter_search(self, keyword: str, page_size: int = PAGE_SIZE,
+                          lookahead: int = 2) -> typing.AsyncIterator[SearchSongsData]:
+        """逐页搜索歌曲，预取后续页面"""
+        async for song in _iter_paged(lambda page: self.search_songs_page(keyword, page, page_size),
+                                      page_size, lookahead):
+            yield song
+
+    async def iter_artist_songs(self, artist_id: str, page_size: int = PAGE_SIZE,
+                                lookahead: int = 2) -> typing.AsyncIterator[Song]:
+        """逐页获取歌手歌曲，预取后续页面"""
+        async for song in _iter_paged(lambda page: self.get_artist_songs_page(artist_id, page, page_size),
+                                      page_size, lookahead):
+            yield song
+
     @abc.abstractmethod
     async def request(self, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
         """网络请求"""
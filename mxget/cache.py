@@ -0,0 +1,83 @@
+import asyncio
+import collections
+import time
+import typing
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    LRU cache whose entries expire after a time-to-live. Concurrent loads of
+    the same key through get_or_load share a single in-flight request.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data = collections.OrderedDict()
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            return default
+
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: typing.Hashable, value: typing.Any, ttl: float = None) -> None:
+        if ttl is None:
+            ttl = self._ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        try:
+            return self._data.pop(key)[1]
+        except KeyError:
+            return default
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    async def get_or_load(self, key: typing.Hashable,
+                          loader: typing.Callable[[], typing.Awaitable[typing.Any]]) -> typing.Any:
+        """Return the cached value, or load it once; ``None`` results are not cached."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        fut = self._pending.get(key)
+        if fut is None:
+            self.misses += 1
+            fut = self._pending[key] = asyncio.ensure_future(self._load(key, loader))
+        else:
+            self.hits += 1
+        return await asyncio.shield(fut)
+
+    async def _load(self, key: typing.Hashable, loader: typing.Callable[[], typing.Awaitable[typing.Any]]):
+        try:
+            value = await loader()
+            if value is not None:
+                self.set(key, value)
+            return value
+        finally:
+            self._pending.pop(key, None)
@@ -1,32 +1,31 @@
 import asyncio
+import functools
 import logging
-import multiprocessing
 import pathlib
+import typing
 
 import aiofiles
 import aiohttp
 import mutagen
-from mutagen import (
-    id3,
-)
+import yarl
 
 from mxget import (
     api,
     conf,
+    cover,
+    download,
+    limiter,
+    manifest,
+    progress,
+    scheduler,
+    store,
+    tag,
     utils,
     exceptions,
 )
 
 
 async def concurrent_download(client: api.API, save_path: str, *songs: api.Song) -> None:
-    limit = conf.settings.get('limit')
-    if limit is None:
-        limit = multiprocessing.cpu_count()
-    if limit < 1:
-        limit = 1
-    if limit > 32:
-        limit = 32
-
     save_path = pathlib.Path(conf.settings['dir']).joinpath(
         utils.trim_invalid_file_path_chars(save_path))
 
@@ -36,49 +35,169 @@ async def concurrent_download(client: api.API, save_path: str, *songs: api.Song)
         except OSError as e:
             raise exceptions.ClientError("Can't make download dir: {}".format(e))
 
-    sem = asyncio.Semaphore(limit)
-
-    async def worker(song: api.Song):
-        async with sem:
+    try:
+        limiter.set_bandwidth(conf.settings.get('bandwidth'))
+    except ValueError as e:
+        raise exceptions.ClientError("Can't apply bandwidth limit: {}".format(e))
+
+    sched = scheduler.Scheduler(
+        conf.settings.get('limit') or scheduler.LIMIT,
+        conf.settings.get('host_limit') or scheduler.PER_HOST,
+        autotune=conf.settings.get('autotune', False),
+    )
+    segments = conf.settings.get('segments') or 1
+    min_segment_size = (conf.settings.get('segment_size') or 0) * 1024 * 1024 or download.MIN_SEGMENT_SIZE
+    force = conf.settings.get('force', False)
+    dedupe = conf.settings.get('dedupe', False)
+    loop = asyncio.get_event_loop()
+
+    root = pathlib.Path(conf.settings['dir'])
+    book = manifest.Manifest(root)
+    platform = manifest.platform_of(client)
+    known = {} if force else book.lookup(platform, (str(song.id) for song in songs))
+
+    cover_dir = conf.settings.get('user_dir')
+    covers = cover.CoverCache(
+        client,
+        cache_dir=cover_dir.joinpath('covers') if cover_dir is not None and conf.settings.get('cover_cache') else None,
+        max_dimension=conf.settings.get('cover_size'),
+    )
+    tagger = tag.Tagger(conf.settings.get('tag_workers') or tag.WORKERS)
+    monitor = progress.Progress()
+    view = None
+    if conf.settings.get('progress') == 'term':
+        view = progress.TerminalView()
+    elif conf.settings.get('progress') == 'json':
+        view = progress.JSONLines()
+    if view is not None:
+        monitor.add_listener(view)
+
+    def file_path_of(song: api.Song) -> pathlib.Path:
+        filename = utils.trim_invalid_file_path_chars('{} - {}'.format(song.artist, song.name))
+        return save_path.joinpath(filename + '.mp3')
+
+    async def index(song: api.Song, song_info: str, mp3_file_path: pathlib.Path, tagged: bool) -> None:
+        try:
+            entry = await loop.run_in_executor(None, book.entry_for, platform, song.id, mp3_file_path, tagged)
+            if dedupe:
+                entry.path = store.ingest(root, mp3_file_path, entry.hash).relative_to(root).as_posix()
+        except OSError as err:
+            logging.warning('Index [{}] failed: {}'.format(song_info, err))
+            return
+        book.record(entry)
+
+    async def worker(song: api.Song, entry: manifest.Entry = None):
+        slots = sched.slots(yarl.URL(song.url or '').host or '')
+        async with slots:
             song_info = '{} - {}'.format(song.artist, song.name)
+            handle = monitor.open(song_info)
+            ok = False
+            try:
+                ok = await process(song, song_info, entry, handle, slots)
+            finally:
+                monitor.close(handle, ok)
+                slots.record(handle.done - handle.offset)
+
+    async def process(song: api.Song, song_info: str, entry: manifest.Entry,
+                      handle: progress.FileProgress, slots: scheduler.HostSlots) -> bool:
+        if entry is not None:
+            mp3_file_path = file_path_of(song) if dedupe else book.locate(entry)
+            if dedupe:
+                await loop.run_in_executor(None, store.detach, mp3_file_path)
+            frames = []
+        else:
             if not song.playable:
                 logging.error('Download [{}] failed: song unavailable'.format(song_info))
-                return
+                return False
 
-            logging.info('Start download: [{}]'.format(song_info))
-            filename = utils.trim_invalid_file_path_chars(song_info)
-            mp3_file_path = save_path.joinpath(filename + '.mp3')
-            if mp3_file_path.is_file() and not conf.settings.get('force', False):
+            mp3_file_path = file_path_of(song)
+            if mp3_file_path.is_file() and not force:
                 logging.info('Song already downloaded: [{}]'.format(song_info))
-                return
-
+                # leave the file alone unless tagging was asked for, the id frame only helps a manifest rebuild
+                if conf.settings.get('tag'):
+                    try:
+                        await loop.run_in_executor(None, store.detach, mp3_file_path)
+                        await tagger.apply(mp3_file_path, [manifest.id_frame(platform, song.id)])
+                    except (mutagen.MutagenError, OSError) as err:
+                        logging.warning('Update music metadata [{}] failed: {}'.format(song_info, err))
+                await index(song, song_info, mp3_file_path, False)
+                return True
+            frames = [manifest.id_frame(platform, song.id)]
+
+        if conf.settings.get('tag') or conf.settings.get('lyric'):
+            await song.load_lyric()
+
+        if conf.settings.get('tag'):
+            logging.info('Update music metadata: [{}]'.format(song_info))
+            frames.extend(tag.song_frames(song, await covers.get(song.pic_url)))
+
+        # new songs get their tag written ahead of the audio in the same pass
+        written = False
+        if entry is None:
+            logging.info('Start download: [{}]'.format(song_info))
             try:
-                resp = await client.request('GET', song.url)
-                f = await aiofiles.open(mp3_file_path, 'wb')
-                await f.write(await resp.read())
-                await f.close()
-            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                transfer = await download.fetch(client, song.url, mp3_file_path, segments=segments,
+                                                min_segment_size=min_segment_size, slots=slots,
+                                                prefix=functools.partial(tag.header, frames), tracker=handle)
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as err:
+                # the partial file is kept so that the next run can resume it
                 logging.error('Download [{}] failed: {}'.format(song_info, err))
-                if mp3_file_path.is_file():
-                    try:
-                        mp3_file_path.unlink()
-                    except OSError:
-                        pass
-                return
-
-            logging.info('Download [{}] complete'.format(song_info))
+                return False
+            logging.info('Download [{}] complete: {}'.format(song_info, transfer))
+            # a resumed file carries the tag of the run that started it, which may lack this run's frames
+            written = transfer.tagged and not transfer.offset
 
-            if conf.settings.get('tag'):
-                logging.info('Update music metadata: [{}]'.format(song_info))
-                await _write_tag(client, mp3_file_path, song)
+        if not written:
+            try:
+                await tagger.apply(mp3_file_path, frames)
+                written = True
+            except (mutagen.MutagenError, OSError) as err:
+                logging.warning('Update music metadata [{}] failed: {}'.format(song_info, err))
+
+        if conf.settings.get('lyric'):
+            logging.info('Save lyric: [{}]'.format(song_info))
+            lrc_file_path = mp3_file_path.with_suffix('.lrc')
+            await _save_lyric(lrc_file_path, song.lyric)
+
+        tagged = (written and bool(conf.settings.get('tag'))) or (entry is not None and entry.tagged)
+        await index(song, song_info, mp3_file_path, tagged)
+        return True
+
+    # songs already in the manifest only need work when they still lack tags
+    tasks = []
+    for song in songs:
+        entry = known.get(str(song.id))
+        if entry is None or not book.exists(entry):
+            tasks.append(asyncio.ensure_future(worker(song)))
+            continue
+        logging.info('Song already downloaded: [{} - {}] -> {}'.format(song.artist, song.name, book.locate(entry)))
+        if dedupe:
+            try:
+                store.link(book.locate(entry), file_path_of(song))
+            except OSError as err:
+                logging.warning('Link [{} - {}] failed: {}'.format(song.artist, song.name, err))
+                continue
+        if conf.settings.get('tag') and not entry.tagged:
+            tasks.append(asyncio.ensure_future(worker(song, entry)))
+
+    # workers only start once we yield, so the queue size is complete here
+    monitor.queued = len(tasks)
+    ticker = asyncio.ensure_future(monitor.run()) if view is not None else None
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        if ticker is not None:
+            ticker.cancel()
+            await asyncio.gather(ticker, return_exceptions=True)
+        tagger.close()
+        book.close()
+    if covers.fetched or covers.reused:
+        logging.debug('Covers: {} fetched, {} reused'.format(covers.fetched, covers.reused))
 
-            if conf.settings.get('lyric'):
-                logging.info('Save lyric: [{}]'.format(song_info))
-                lrc_file_path = save_path.joinpath(filename + '.lrc')
-                await _save_lyric(lrc_file_path, song.lyric)
 
-    tasks = [asyncio.ensure_future(worker(song)) for song in songs]
-    await asyncio.gather(*tasks)
+def rebuild_manifest() -> typing.Tuple[int, int]:
+    with manifest.Manifest(pathlib.Path(conf.settings['dir'])) as book:
+        return book.rebuild()
 
 
 async def _save_lyric(file_path: pathlib.Path, lyric: str) -> None:
@@ -88,38 +207,3 @@ async def _save_lyric(file_path: pathlib.Path, lyric: str) -> None:
         await f.close()
     except OSError:
         pass
-
-
-async def _write_tag(client: api.API, file_path: pathlib.Path, song: api.Song) -> None:
-    audio = id3.ID3(file_path)
-    audio.add(id3.TIT2(encoding=id3.Encoding.UTF8, text=song.name))
-    audio.add(id3.TPE1(encoding=id3.Encoding.UTF8, text=song.artist))
-    audio.add(id3.TALB(encoding=id3.Encoding.UTF8, text=song.album))
-
-    if song.lyric:
-        audio.add(id3.ULT(
-            encoding=id3.Encoding.UTF8,
-            lang='eng',
-            desc=song.name,
-            text=song.lyric,
-        ))
-
-    if song.pic_url:
-        try:
-            resp = await client.request('GET', song.pic_url)
-            data = await resp.read()
-        except (aiohttp.ClientError, asyncio.TimeoutError):
-            pass
-        else:
-            audio.add(id3.APIC(
-                encoding=id3.Encoding.UTF8,
-                mime='image/jpeg',
-                type=id3.PictureType.COVER_FRONT,
-                desc='Front cover',
-                data=data,
-            ))
-
-    try:
-        audio.save()
-    except mutagen.MutagenError:
-        pass
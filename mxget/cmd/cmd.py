@@ -1,4 +1,5 @@
 import asyncio
+import json
 import logging
 import sys
 
@@ -9,7 +10,9 @@ from mxget import (
     cli,
     conf,
     exceptions,
+    scheduler,
     server,
+    utils,
 )
 
 _CONTEXT_SETTINGS = {
@@ -17,6 +20,25 @@ _CONTEXT_SETTINGS = {
 }
 
 
+def _parse_bandwidth(ctx: click.Context, param: click.Parameter, value: str):
+    if value is None:
+        return None
+    try:
+        return utils.parse_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def _parse_host_bandwidth(ctx: click.Context, param: click.Parameter, value: tuple) -> dict:
+    rates = {}
+    for item in value:
+        host, sep, rate = item.partition('=')
+        if not sep or not host:
+            raise click.BadParameter('expected HOST=RATE, got "{}"'.format(item))
+        rates[host.lower()] = _parse_bandwidth(ctx, param, rate)
+    return rates
+
+
 @click.group(context_settings=_CONTEXT_SETTINGS)
 @click.version_option(version=mxget.__version__)
 def root():
@@ -35,11 +57,18 @@ please visit https://github.com/winterssy/mxget for more detail."""
 @root.command(help='Specify the default behavior of mxget.')
 @click.option('--from', 'platform', help='Specify the default music platform')
 @click.option('--dir', 'cwd', help='Specify the default download directory')
+@click.option('--bandwidth', callback=_parse_bandwidth, metavar='RATE',
+              help='Specify the default download rate limit per second, e.g. 2M; 0 lifts it')
+@click.option('--host-bandwidth', multiple=True, callback=_parse_host_bandwidth, metavar='HOST=RATE',
+              help='Limit the download rate from a host and its subdomains; 0 lifts it')
+@click.option('--limit', type=click.IntRange(min=1), help='Specify the default concurrent downloads across all hosts')
+@click.option('--host-limit', type=click.IntRange(min=1), help='Specify the default concurrent downloads per host')
 @click.option('--show', is_flag=True, help='Show current settings')
 @click.option('--reset', is_flag=True, help='Reset default settings')
-def config(platform: str, cwd: str, show: bool, reset: bool) -> None:
+def config(platform: str, cwd: str, bandwidth: int, host_bandwidth: dict, limit: int, host_limit: int,
+           show: bool, reset: bool) -> None:
     ctx = click.get_current_context()
-    if not any(v for v in ctx.params.values()):
+    if not any(v for v in ctx.params.values()) and bandwidth is None:
         click.echo(ctx.get_help())
         ctx.exit()
 
@@ -49,6 +78,12 @@ def config(platform: str, cwd: str, show: bool, reset: bool) -> None:
     music platform -> {} [{}]
 """.format(conf.settings['dir'], conf.settings['platform'],
            conf.get_platform_desc(conf.settings['platform'])), end='')
+        print('    downloads      -> {} at once, {} per host'.format(
+            conf.settings.get('limit') or scheduler.LIMIT, conf.settings.get('host_limit') or scheduler.PER_HOST))
+        if conf.settings.get('bandwidth'):
+            print('    bandwidth      -> {}/s'.format(utils.format_size(conf.settings['bandwidth'])))
+        for host, rule in sorted((conf.settings.get('host_limits') or {}).items()):
+            print('    host limit     -> {} {}'.format(host, json.dumps(rule)))
         return
 
     if reset:
@@ -69,10 +104,48 @@ def config(platform: str, cwd: str, show: bool, reset: bool) -> None:
             sys.exit(1)
         conf.settings['dir'] = cwd
 
-    if platform is not None or cwd is not None:
+    if bandwidth is not None:
+        conf.settings['bandwidth'] = bandwidth
+
+    if limit is not None:
+        conf.settings['limit'] = limit
+
+    if host_limit is not None:
+        conf.settings['host_limit'] = host_limit
+
+    if host_bandwidth:
+        host_limits = dict(conf.settings.get('host_limits') or {})
+        for host, rate in host_bandwidth.items():
+            rule = dict(host_limits.get(host) or {})
+            rule.pop('bandwidth', None)
+            if rate:
+                rule['bandwidth'] = rate
+            if rule:
+                host_limits[host] = rule
+            else:
+                host_limits.pop(host, None)
+        conf.settings['host_limits'] = host_limits
+
+    if any(v is not None for v in (platform, cwd, bandwidth, limit, host_limit)) or host_bandwidth:
         conf.settings.save()
 
 
+@root.command(name='manifest', help='Maintain the index of downloaded songs.')
+@click.option('--rebuild', is_flag=True, help='Rebuild the index from the files in the download dir')
+def manifest_(rebuild: bool) -> None:
+    if not rebuild:
+        click.echo(click.get_current_context().get_help())
+        return
+
+    try:
+        indexed, skipped = cli.rebuild_manifest()
+    except exceptions.ClientError as e:
+        logging.critical(e)
+        sys.exit(1)
+    logging.info('Indexed {} files in [{}], skipped {} without an id'.format(
+        indexed, conf.settings['dir'], skipped))
+
+
 @root.command(help='Search songs from the specified music platform.')
 @click.option('--from', 'platform', help='Music platform')
 @click.option('--keyword', '-k', prompt=True, help='Search keyword')
@@ -106,7 +179,15 @@ def search(platform, keyword) -> None:
 @click.option('--id', 'song_id', prompt=True, help='Song id')
 @click.option('--tag', is_flag=True, help='Update music metadata')
 @click.option('--lyric', is_flag=True, help='Download lyric')
+@click.option('--cover-cache', is_flag=True, help='Keep fetched covers on disk across runs')
+@click.option('--cover-size', type=int, help='Scale covers down to this many pixels (requires Pillow)')
+@click.option('--tag-workers', type=int, help='Threads that write music metadata')
 @click.option('--force', is_flag=True, help='Overwrite already downloaded music')
+@click.option('--segments', type=int, help='Connections per file for servers that support byte ranges')
+@click.option('--segment-size', type=int, help='Minimum segment size in MiB')
+@click.option('--dedupe', is_flag=True, help='Store audio once under .objects and link it into each folder')
+@click.option('--progress', type=click.Choice(['term', 'json']), help='Live progress on stderr or as JSON lines')
+@click.option('--bandwidth', callback=_parse_bandwidth, metavar='RATE', help='Download rate limit per second, e.g. 2M')
 def song(platform: str, song_id: str, **kwargs) -> None:
     if platform is None:
         platform = conf.settings['platform']
@@ -116,7 +197,7 @@ def song(platform: str, song_id: str, **kwargs) -> None:
         logging.critical('Unexpected music platform: "{}"'.format(platform))
         sys.exit(1)
 
-    conf.settings.update(kwargs)
+    conf.settings.update((k, v) for k, v in kwargs.items() if v is not None)
     loop = asyncio.get_event_loop()
     try:
         logging.info('Fetch song [{}] from [{}]'.format(song_id, conf.get_platform_desc(platform)))
@@ -133,8 +214,18 @@ def song(platform: str, song_id: str, **kwargs) -> None:
 @click.option('--id', 'artist_id', prompt=True, help='Artist id')
 @click.option('--tag', is_flag=True, help='Update music metadata')
 @click.option('--lyric', is_flag=True, help='Download lyric')
+@click.option('--cover-cache', is_flag=True, help='Keep fetched covers on disk across runs')
+@click.option('--cover-size', type=int, help='Scale covers down to this many pixels (requires Pillow)')
+@click.option('--tag-workers', type=int, help='Threads that write music metadata')
 @click.option('--force', is_flag=True, help='Overwrite already downloaded music')
-@click.option('--limit', type=int, help='Concurrent download limit')
+@click.option('--segments', type=int, help='Connections per file for servers that support byte ranges')
+@click.option('--segment-size', type=int, help='Minimum segment size in MiB')
+@click.option('--dedupe', is_flag=True, help='Store audio once under .objects and link it into each folder')
+@click.option('--progress', type=click.Choice(['term', 'json']), help='Live progress on stderr or as JSON lines')
+@click.option('--bandwidth', callback=_parse_bandwidth, metavar='RATE', help='Download rate limit per second, e.g. 2M')
+@click.option('--limit', type=click.IntRange(min=1), help='Concurrent downloads across all hosts')
+@click.option('--host-limit', type=click.IntRange(min=1), help='Concurrent downloads per host')
+@click.option('--autotune', is_flag=True, help='Tune per-host concurrency to the observed throughput')
 def artist(platform: str, artist_id: str, **kwargs) -> None:
     if platform is None:
         platform = conf.settings['platform']
@@ -144,7 +235,7 @@ def artist(platform: str, artist_id: str, **kwargs) -> None:
         logging.critical('Unexpected music platform: "{}"'.format(platform))
         sys.exit(1)
 
-    conf.settings.update(kwargs)
+    conf.settings.update((k, v) for k, v in kwargs.items() if v is not None)
     loop = asyncio.get_event_loop()
     try:
         logging.info('Fetch artist [{}] from [{}]'.format(artist_id, conf.get_platform_desc(platform)))
@@ -161,8 +252,18 @@ def artist(platform: str, artist_id: str, **kwargs) -> None:
 @click.option('--id', 'album_id', prompt=True, help='Album id')
 @click.option('--tag', is_flag=True, help='Update music metadata')
 @click.option('--lyric', is_flag=True, help='Download lyric')
+@click.option('--cover-cache', is_flag=True, help='Keep fetched covers on disk across runs')
+@click.option('--cover-size', type=int, help='Scale covers down to this many pixels (requires Pillow)')
+@click.option('--tag-workers', type=int, help='Threads that write music metadata')
 @click.option('--force', is_flag=True, help='Overwrite already downloaded music')
-@click.option('--limit', type=int, help='Concurrent download limit')
+@click.option('--segments', type=int, help='Connections per file for servers that support byte ranges')
+@click.option('--segment-size', type=int, help='Minimum segment size in MiB')
+@click.option('--dedupe', is_flag=True, help='Store audio once under .objects and link it into each folder')
+@click.option('--progress', type=click.Choice(['term', 'json']), help='Live progress on stderr or as JSON lines')
+@click.option('--bandwidth', callback=_parse_bandwidth, metavar='RATE', help='Download rate limit per second, e.g. 2M')
+@click.option('--limit', type=click.IntRange(min=1), help='Concurrent downloads across all hosts')
+@click.option('--host-limit', type=click.IntRange(min=1), help='Concurrent downloads per host')
+@click.option('--autotune', is_flag=True, help='Tune per-host concurrency to the observed throughput')
 def album(platform: str, album_id: str, **kwargs) -> None:
     if platform is None:
         platform = conf.settings['platform']
@@ -172,7 +273,7 @@ def album(platform: str, album_id: str, **kwargs) -> None:
         logging.critical('Unexpected music platform: "{}"'.format(platform))
         sys.exit(1)
 
-    conf.settings.update(kwargs)
+    conf.settings.update((k, v) for k, v in kwargs.items() if v is not None)
     loop = asyncio.get_event_loop()
     try:
         logging.info('Fetch album [{}] from [{}]'.format(album_id, conf.get_platform_desc(platform)))
@@ -189,8 +290,18 @@ def album(platform: str, album_id: str, **kwargs) -> None:
 @click.option('--id', 'playlist_id', prompt=True, help='Playlist id')
 @click.option('--tag', is_flag=True, help='Update music metadata')
 @click.option('--lyric', is_flag=True, help='Download lyric')
+@click.option('--cover-cache', is_flag=True, help='Keep fetched covers on disk across runs')
+@click.option('--cover-size', type=int, help='Scale covers down to this many pixels (requires Pillow)')
+@click.option('--tag-workers', type=int, help='Threads that write music metadata')
 @click.option('--force', is_flag=True, help='Overwrite already downloaded music')
-@click.option('--limit', type=int, show_default=True, help='Concurrent download limit')
+@click.option('--segments', type=int, help='Connections per file for servers that support byte ranges')
+@click.option('--segment-size', type=int, help='Minimum segment size in MiB')
+@click.option('--dedupe', is_flag=True, help='Store audio once under .objects and link it into each folder')
+@click.option('--progress', type=click.Choice(['term', 'json']), help='Live progress on stderr or as JSON lines')
+@click.option('--bandwidth', callback=_parse_bandwidth, metavar='RATE', help='Download rate limit per second, e.g. 2M')
+@click.option('--limit', type=click.IntRange(min=1), help='Concurrent downloads across all hosts')
+@click.option('--host-limit', type=click.IntRange(min=1), help='Concurrent downloads per host')
+@click.option('--autotune', is_flag=True, help='Tune per-host concurrency to the observed throughput')
 def playlist(platform: str, playlist_id: str, **kwargs) -> None:
     if platform is None:
         platform = conf.settings['platform']
@@ -200,7 +311,7 @@ def playlist(platform: str, playlist_id: str, **kwargs) -> None:
         logging.critical('Unexpected music platform: "{}"'.format(platform))
         sys.exit(1)
 
-    conf.settings.update(kwargs)
+    conf.settings.update((k, v) for k, v in kwargs.items() if v is not None)
     loop = asyncio.get_event_loop()
     try:
         logging.info('Fetch playlist [{}] from [{}]'.format(playlist_id, conf.get_platform_desc(platform)))
@@ -6,6 +6,8 @@ import typing
 from mxget import (
     api,
     exceptions,
+    limiter,
+    scheduler,
 )
 from mxget.provider import (
     netease,
@@ -20,6 +22,10 @@ from mxget.provider import (
 _DEFAULT_SETTINGS = {
     'dir': './downloads',
     'platform': 'nc',
+    'host_limits': {},
+    'bandwidth': 0,
+    'limit': scheduler.LIMIT,
+    'host_limit': scheduler.PER_HOST,
 }
 
 _PLATFORM_CLIENTS = {
@@ -102,6 +108,18 @@ class Settings(dict):
             self['platform'] = _DEFAULT_SETTINGS['platform']
             raise exceptions.ClientError('unexpected music platform: "{}"'.format(platform))
 
+        try:
+            limiter.configure(self.get('host_limits'))
+        except ValueError as e:
+            self['host_limits'] = _DEFAULT_SETTINGS['host_limits']
+            raise exceptions.ClientError("can't apply host limits: {}".format(e))
+
+        try:
+            limiter.set_bandwidth(self.get('bandwidth'))
+        except ValueError as e:
+            self['bandwidth'] = _DEFAULT_SETTINGS['bandwidth']
+            raise exceptions.ClientError("can't apply bandwidth limit: {}".format(e))
+
         self.make_download_dir()
 
     def _init_settings_file(self) -> None:
@@ -137,6 +155,10 @@ class Settings(dict):
             cfg = {
                 'platform': self['platform'],
                 'dir': self['dir'],
+                'host_limits': self.get('host_limits', _DEFAULT_SETTINGS['host_limits']),
+                'bandwidth': self.get('bandwidth', _DEFAULT_SETTINGS['bandwidth']),
+                'limit': self.get('limit', _DEFAULT_SETTINGS['limit']),
+                'host_limit': self.get('host_limit', _DEFAULT_SETTINGS['host_limit']),
             }
         try:
             with self.settings_path.open(mode='w') as settings_file:
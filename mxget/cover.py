@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import pathlib
+import typing
+
+import aiofiles
+import aiohttp
+
+from mxget import (
+    api,
+    cache,
+)
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+__all__ = [
+    'Cover',
+    'CoverCache',
+]
+
+_MAXSIZE = 64
+_QUALITY = 90
+
+
+class Cover:
+    def __init__(self, data: bytes, mime: str = None):
+        self.data = data
+        self.mime = mime if mime is not None else _sniff(data)
+
+
+def _sniff(data: bytes) -> str:
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    return 'image/jpeg'
+
+
+def _shrink(data: bytes, max_dimension: int, quality: int) -> bytes:
+    """Scale the image down to fit ``max_dimension`` and re-encode it as JPEG, if that makes it smaller."""
+    if Image is None or not max_dimension:
+        return data
+    try:
+        img = Image.open(io.BytesIO(data))
+        if max(img.size) <= max_dimension:
+            return data
+        img.thumbnail((max_dimension, max_dimension))
+        out = io.BytesIO()
+        img.convert('RGB').save(out, 'JPEG', quality=quality, optimize=True)
+    except (OSError, ValueError) as e:
+        logging.debug('Shrink cover failed: {}'.format(e))
+        return data
+    return out.getvalue() if out.tell() < len(data) else data
+
+
+class CoverCache:
+    """
+    Cover art shared by the songs of a download run. Each URL is fetched once:
+    concurrent requests wait for the same fetch, results stay in an in-memory LRU
+    and, with ``cache_dir``, on disk across runs. With ``max_dimension`` (needs
+    Pillow) oversized covers are scaled down once, before they are cached.
+    """
+
+    def __init__(self, client: api.API, maxsize: int = _MAXSIZE, cache_dir: pathlib.Path = None,
+                 max_dimension: int = None, quality: int = _QUALITY):
+        self._client = client
+        self._memory = cache.TTLCache(maxsize)
+        self._cache_dir = cache_dir
+        self._max_dimension = max_dimension if Image is not None else None
+        self._quality = quality
+        self.fetched = 0
+        if max_dimension and Image is None:
+            logging.warning('Pillow is not installed, covers are kept at their original size')
+
+    @property
+    def reused(self) -> int:
+        return self._memory.hits
+
+    async def get(self, url: str) -> typing.Optional[Cover]:
+        if not url:
+            return None
+        return await self._memory.get_or_load(url, lambda: self._load(url))
+
+    def _disk_path(self, url: str) -> typing.Optional[pathlib.Path]:
+        if self._cache_dir is None:
+            return None
+        key = '{}|{}|{}'.format(url, self._max_dimension, self._quality)
+        return self._cache_dir.joinpath(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    async def _load(self, url: str) -> typing.Optional[Cover]:
+        disk_path = self._disk_path(url)
+        if disk_path is not None and disk_path.is_file():
+            try:
+                f = await aiofiles.open(str(disk_path), 'rb')
+                try:
+                    return Cover(await f.read())
+                finally:
+                    await f.close()
+            except OSError:
+                pass
+
+        try:
+            resp = await self._client.request('GET', url)
+            resp.raise_for_status()
+            data = await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.debug('Fetch cover [{}] failed: {}'.format(url, e))
+            return None
+        self.fetched += 1
+
+        if self._max_dimension:
+            data = await asyncio.get_event_loop().run_in_executor(
+                None, _shrink, data, self._max_dimension, self._quality)
+
+        if disk_path is not None:
+            tmp = disk_path.with_name(disk_path.name + '.tmp')
+            try:
+                disk_path.parent.mkdir(parents=True, exist_ok=True)
+                f = await aiofiles.open(str(tmp), 'wb')
+                try:
+                    await f.write(data)
+                finally:
+                    await f.close()
+                os.replace(str(tmp), str(disk_path))
+            except OSError as e:
+                logging.debug('Cache cover [{}] failed: {}'.format(url, e))
+        return Cover(data)
@@ -1,4 +1,6 @@
-import binascii
+import functools
+import itertools
+import typing
 
 from cryptography.hazmat import backends
 from cryptography.hazmat.primitives.ciphers import (
@@ -12,43 +14,113 @@ __all__ = [
     'aes_cbc_decrypt',
     'aes_ecb_encrypt',
     'aes_ecb_decrypt',
+    'encrypt_many',
+    'pkcs7_pad',
+    'pkcs7_unpad',
     'rsa_encrypt',
+    'RSAKeyPool',
 ]
 
+_BLOCK_SIZE = 16
+
+
+def pkcs7_pad(data: bytes, block_size: int = _BLOCK_SIZE) -> bytes:
+    padding = block_size - len(data) % block_size
+    return data + bytes((padding,)) * padding
+
+
+def pkcs7_unpad(data: bytes) -> bytes:
+    return data[:-data[-1]]
+
+
+@functools.lru_cache(maxsize=256)
+def _cipher(key: bytes, iv: typing.Optional[bytes]) -> Cipher:
+    mode = modes.CBC(iv) if iv is not None else modes.ECB()
+    return Cipher(algorithms.AES(key), mode, backend=backends.default_backend())
+
+
+def _encrypt(cipher: Cipher, plain_text: bytes) -> bytes:
+    encryptor = cipher.encryptor()
+    return encryptor.update(pkcs7_pad(plain_text)) + encryptor.finalize()
+
+
+def _decrypt(cipher: Cipher, cipher_text: bytes) -> bytes:
+    decryptor = cipher.decryptor()
+    return pkcs7_unpad(decryptor.update(cipher_text) + decryptor.finalize())
+
 
 def aes_cbc_encrypt(plain_text: bytes, key: bytes, iv: bytes) -> bytes:
-    return aes_encrypt(plain_text, key, modes.CBC(iv))
+    return _encrypt(_cipher(key, iv), plain_text)
 
 
 def aes_cbc_decrypt(cipher_text: bytes, key: bytes, iv: bytes) -> bytes:
-    return aes_decrypt(cipher_text, key, modes.CBC(iv))
+    return _decrypt(_cipher(key, iv), cipher_text)
 
 
 def aes_ecb_encrypt(plain_text: bytes, key: bytes) -> bytes:
-    return aes_encrypt(plain_text, key, modes.ECB())
+    return _encrypt(_cipher(key, None), plain_text)
 
 
 def aes_ecb_decrypt(cipher_text: bytes, key: bytes) -> bytes:
-    return aes_decrypt(cipher_text, key, modes.ECB())
+    return _decrypt(_cipher(key, None), cipher_text)
 
 
-def aes_encrypt(plain_text: bytes, key: bytes, mode: modes) -> bytes:
-    padding = 16 - len(plain_text) % 16
-    plain_text = plain_text + bytearray([padding] * padding)
-    backend = backends.default_backend()
-    cipher = Cipher(algorithms.AES(key), mode, backend=backend)
+def encrypt_many(plain_texts: typing.Iterable[bytes], key: bytes, iv: bytes = None) -> typing.List[bytes]:
+    """
+    Encrypt many payloads with one key, AES-CBC if an iv is given, AES-ECB otherwise.
+    ECB payloads are padded and pushed through a single encryptor in one call.
+    """
+    cipher = _cipher(key, iv)
+    if iv is not None:
+        return [_encrypt(cipher, plain_text) for plain_text in plain_texts]
+
+    padded = [pkcs7_pad(plain_text) for plain_text in plain_texts]
     encryptor = cipher.encryptor()
-    return cipher.encryptor().update(plain_text) + encryptor.finalize()
+    data = encryptor.update(b''.join(padded)) + encryptor.finalize()
+    result = []
+    offset = 0
+    for p in padded:
+        result.append(data[offset:offset + len(p)])
+        offset += len(p)
+    return result
+
+
+def aes_encrypt(plain_text: bytes, key: bytes, mode: modes) -> bytes:
+    cipher = Cipher(algorithms.AES(key), mode, backend=backends.default_backend())
+    return _encrypt(cipher, plain_text)
 
 
 def aes_decrypt(cipher_text: bytes, key: bytes, mode: modes) -> bytes:
-    backend = backends.default_backend()
-    cipher = Cipher(algorithms.AES(key), mode, backend=backend)
-    decryptor = cipher.decryptor()
-    plain_text = decryptor.update(cipher_text) + decryptor.finalize()
-    return plain_text[:-ord(plain_text[len(plain_text) - 1:])]
+    cipher = Cipher(algorithms.AES(key), mode, backend=backends.default_backend())
+    return _decrypt(cipher, cipher_text)
+
+
+@functools.lru_cache(maxsize=16)
+def _modulus(modulus: str) -> int:
+    return int(modulus, 16)
 
 
 def rsa_encrypt(plain_text: bytes, modulus: str, exponent: int) -> str:
-    rs = pow(int(binascii.hexlify(plain_text), 16), exponent, int(modulus, 16))
+    rs = pow(int.from_bytes(plain_text, 'big'), exponent, _modulus(modulus))
     return format(rs, "x").zfill(256)
+
+
+class RSAKeyPool:
+    """
+    Precomputed (secret key, RSA-encrypted secret key) pairs handed out round-robin,
+    so a session pays for the RSA step once per pair instead of once per request.
+    """
+
+    def __init__(self, modulus: str, exponent: int, key_factory: typing.Callable[[], bytes],
+                 size: int = 16, reverse: bool = False):
+        self._pairs = []
+        for _ in range(max(1, size)):
+            key = key_factory()
+            self._pairs.append((key, rsa_encrypt(key[::-1] if reverse else key, modulus, exponent)))
+        self._cycle = itertools.cycle(self._pairs)
+
+    def __len__(self) -> int:
+        return len(self._pairs)
+
+    def get(self) -> typing.Tuple[bytes, str]:
+        return next(self._cycle)
@@ -0,0 +1,397 @@
+import asyncio
+import collections
+import json
+import os
+import pathlib
+import time
+import typing
+
+import aiofiles
+import aiohttp
+
+from mxget import (
+    api,
+    limiter,
+    utils,
+)
+
+CHUNK_SIZE = 64 * 1024
+BUFFER_SIZE = 1024 * 1024
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+
+PART_SUFFIX = '.part'
+META_SUFFIX = '.part.json'
+
+_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+
+
+class _Changed(aiohttp.ClientPayloadError):
+    pass
+
+
+class Transfer:
+    def __init__(self, url: str, size: int = 0, elapsed: float = 0.0, offset: int = 0, connections: int = 1,
+                 tagged: bool = False):
+        self.url = url
+        self.size = size
+        self.elapsed = elapsed
+        self.offset = offset
+        self.connections = connections
+        self.tagged = tagged
+
+    @property
+    def rate(self) -> float:
+        return self.size / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        s = '{} in {:.1f}s, {}/s'.format(utils.format_size(self.size), self.elapsed, utils.format_size(self.rate))
+        if self.offset:
+            s += ', resumed at {}'.format(utils.format_size(self.offset))
+        if self.connections > 1:
+            s += ', {} connections'.format(self.connections)
+        return s
+
+
+def part_path(file_path: pathlib.Path) -> pathlib.Path:
+    return file_path.with_name(file_path.name + PART_SUFFIX)
+
+
+def meta_path(file_path: pathlib.Path) -> pathlib.Path:
+    return file_path.with_name(file_path.name + META_SUFFIX)
+
+
+def _load_meta(path: pathlib.Path) -> typing.Optional[dict]:
+    try:
+        with path.open('r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if isinstance(meta, dict) else None
+
+
+def _save_meta(path: pathlib.Path, meta: dict) -> None:
+    with path.open('w') as f:
+        json.dump(meta, f)
+
+
+def _response_meta(url: str, resp: aiohttp.ClientResponse, length: typing.Optional[int]) -> dict:
+    return {
+        'url': url,
+        'length': length,
+        'etag': resp.headers.get('ETag'),
+        'last_modified': resp.headers.get('Last-Modified'),
+    }
+
+
+def _validator(meta: dict) -> typing.Optional[str]:
+    etag = meta.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return meta.get('last_modified')
+
+
+def _content_range(resp: aiohttp.ClientResponse) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+    value = resp.headers.get('Content-Range', '')
+    try:
+        _, _, spec = value.partition(' ')
+        first, _, total = spec.partition('/')
+        start = int(first.partition('-')[0])
+        return start, (int(total) if total != '*' else None)
+    except ValueError:
+        return None, None
+
+
+def _resume_offset(part: pathlib.Path, meta: typing.Optional[dict], url: str) -> int:
+    if meta is None:
+        return 0
+    try:
+        size = part.stat().st_size
+    except OSError:
+        return 0
+    if _validator(meta) is None and meta.get('url') != url:
+        return 0
+    # the part file starts with our own tag of ``prefix`` bytes in place of ``skip`` upstream bytes
+    if size < meta.get('prefix', 0):
+        return 0
+    offset = size - meta.get('prefix', 0) + meta.get('skip', 0)
+    length = meta.get('length')
+    if length is not None and offset > length:
+        return 0
+    return offset
+
+
+def id3_size(head: bytes) -> int:
+    """Total size of the ID3v2 tag ``head`` starts with (header included), or 0 without one."""
+    if len(head) < 10 or head[:3] != b'ID3':
+        return 0
+    size = (head[6] & 0x7f) << 21 | (head[7] & 0x7f) << 14 | (head[8] & 0x7f) << 7 | (head[9] & 0x7f)
+    if head[5] & 0x10:
+        size += 10
+    return 10 + size
+
+
+async def _read_id3(content: aiohttp.StreamReader) -> typing.Tuple[bytes, bytes]:
+    """Read a leading ID3v2 tag off the stream. Returns the tag and any other bytes read."""
+    head = b''
+    while len(head) < 10:
+        chunk = await content.read(10 - len(head))
+        if not chunk:
+            break
+        head += chunk
+    size = id3_size(head)
+    if not size:
+        return b'', head
+
+    try:
+        return head + await content.readexactly(size - 10), b''
+    except asyncio.IncompleteReadError as e:
+        raise aiohttp.ClientPayloadError('truncated ID3 tag: {}'.format(e))
+
+
+def _split(length: int, segments: int, min_segment_size: int) -> typing.List[typing.List[int]]:
+    segments = max(1, min(segments, length // max(min_segment_size, 1)))
+    step = -(-length // segments)
+    return [[start, min(start + step, length) - 1] for start in range(0, length, step)]
+
+
+def _finish(part: pathlib.Path, sidecar: pathlib.Path, file_path: pathlib.Path) -> None:
+    os.replace(str(part), str(file_path))
+    try:
+        sidecar.unlink()
+    except OSError:
+        pass
+
+
+class _Copier:
+    def __init__(self, chunk_size: int, buffer_size: int, tracker=None):
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.tracker = tracker
+
+    def begin(self, total: typing.Optional[int], offset: int = 0) -> None:
+        if self.tracker is not None:
+            self.tracker.begin(total, offset)
+
+    def advance(self, n: int) -> None:
+        if self.tracker is not None and n:
+            self.tracker.advance(n)
+
+    async def copy(self, resp: aiohttp.ClientResponse, f) -> int:
+        # each chunk queues for the bandwidth it used, so concurrent transfers take turns
+        buckets = limiter.bandwidth_buckets(resp.url.host or '')
+        size = 0
+        buf = bytearray()
+        try:
+            async for chunk in resp.content.iter_chunked(self.chunk_size):
+                if buckets:
+                    await limiter.acquire_all(buckets, len(chunk))
+                buf += chunk
+                self.advance(len(chunk))
+                if len(buf) >= self.buffer_size:
+                    await f.write(buf)
+                    size += len(buf)
+                    buf = bytearray()
+        finally:
+            # keep what arrived before a broken or cancelled stream, a resume starts after it
+            if buf:
+                await f.write(buf)
+                size += len(buf)
+        return size
+
+
+async def _probe(client: api.API, url: str) -> typing.Optional[dict]:
+    try:
+        resp = await client.request('HEAD', url, timeout=_TIMEOUT)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None
+    resp.release()
+    if resp.status != 200 or resp.headers.get('Accept-Ranges', '').lower() != 'bytes' or not resp.content_length:
+        return None
+    return _response_meta(url, resp, resp.content_length)
+
+
+async def _fetch_segment(client: api.API, url: str, part: pathlib.Path, meta: dict,
+                         first: int, last: int, copier: _Copier) -> int:
+    headers = {'Range': 'bytes={}-{}'.format(first, last)}
+    validator = _validator(meta)
+    if validator is not None:
+        headers['If-Range'] = validator
+
+    resp = await client.request('GET', url, headers=headers, timeout=_TIMEOUT)
+    try:
+        resp.raise_for_status()
+        if resp.status == 200:
+            raise _Changed('resource changed since the download started')
+        if _content_range(resp) != (first, meta['length']):
+            raise aiohttp.ClientPayloadError('unexpected content range: {}'.format(
+                resp.headers.get('Content-Range')))
+
+        f = await aiofiles.open(str(part), 'r+b')
+        try:
+            await f.seek(first)
+            size = await copier.copy(resp, f)
+        finally:
+            await f.close()
+    except BaseException:
+        resp.close()
+        raise
+
+    resp.release()
+    if size != last - first + 1:
+        raise aiohttp.ClientPayloadError('incomplete segment {}-{}: {} bytes'.format(first, last, size))
+    return size
+
+
+async def _fetch_segmented(client: api.API, url: str, file_path: pathlib.Path, meta: dict,
+                           connections: int, slots, copier: _Copier) -> Transfer:
+    part = part_path(file_path)
+    sidecar = meta_path(file_path)
+    if not part.is_file():
+        with part.open('wb') as f:
+            f.truncate(meta['length'])
+    _save_meta(sidecar, meta)
+
+    pending = collections.deque(meta['segments'])
+    offset = meta['length'] - sum(last - first + 1 for first, last in pending)
+    size = 0
+    copier.begin(meta['length'], offset)
+
+    async def drain():
+        nonlocal size
+        while pending:
+            segment = pending.popleft()
+            n = await _fetch_segment(client, url, part, meta, segment[0], segment[1], copier)
+            size += n
+            meta['segments'].remove(segment)
+            _save_meta(sidecar, meta)
+
+    # the caller's own slot always works; extra connections only use slots that are idle right now
+    borrowed = 0
+    while slots is not None and borrowed < min(connections, len(pending)) - 1 and not slots.locked():
+        await slots.acquire()
+        borrowed += 1
+    workers = min(connections, len(pending)) if slots is None else borrowed + 1
+
+    start = time.monotonic()
+    futures = [asyncio.ensure_future(drain()) for _ in range(workers)]
+    try:
+        await asyncio.gather(*futures)
+    except BaseException as e:
+        for fut in futures:
+            fut.cancel()
+        await asyncio.gather(*futures, return_exceptions=True)
+        if isinstance(e, _Changed):
+            sidecar.unlink()
+        raise
+    finally:
+        for _ in range(borrowed):
+            slots.release()
+
+    if meta['segments'] or offset + size != meta['length']:
+        raise aiohttp.ClientPayloadError('incomplete download: {} of {} bytes'.format(offset + size, meta['length']))
+    _finish(part, sidecar, file_path)
+    return Transfer(url, size, time.monotonic() - start, offset, workers)
+
+
+async def fetch(client: api.API, url: str, file_path: pathlib.Path,
+                chunk_size: int = CHUNK_SIZE, buffer_size: int = BUFFER_SIZE,
+                segments: int = 1, min_segment_size: int = MIN_SEGMENT_SIZE,
+                slots=None,
+                prefix: typing.Callable[[bytes], bytes] = None, tracker=None) -> Transfer:
+    """
+    Stream ``url`` into ``file_path``. At most ``buffer_size`` bytes of the body
+    are held in memory before they are flushed to disk.
+
+    Bytes land in ``<file>.part`` next to a ``<file>.part.json`` sidecar that records
+    the url, expected length and validator (ETag or Last-Modified). An interrupted
+    transfer resumes from the partial file with ``Range``/``If-Range``, and the part
+    file is renamed into place once the expected length has been written.
+
+    With ``segments`` > 1 a server that advertises byte ranges is fetched over up
+    to that many connections, each covering a range of at least ``min_segment_size``
+    bytes of a preallocated part file. Extra connections are only taken from
+    ``slots`` (an ``asyncio.Semaphore`` or ``scheduler.HostSlots``) while it has
+    idle capacity, so a shared concurrency limit holds.
+
+    ``prefix`` is called with the upstream ID3v2 tag (or ``b''``) and returns the
+    tag to write in its place, so a single-stream download is tagged in the same
+    pass that writes the audio. ``Transfer.tagged`` tells whether that happened.
+
+    ``tracker`` (see ``progress.FileProgress``) is told the expected size and every
+    chunk received.
+    """
+    copier = _Copier(chunk_size, buffer_size, tracker)
+    part = part_path(file_path)
+    sidecar = meta_path(file_path)
+    meta = _load_meta(sidecar) if part.is_file() else None
+    if meta is not None and 'segments' in meta and (_validator(meta) is not None or meta.get('url') == url):
+        return await _fetch_segmented(client, url, file_path, meta, segments, slots, copier)
+
+    offset = _resume_offset(part, meta, url) if meta is None or 'segments' not in meta else 0
+    if not offset and segments > 1:
+        meta = await _probe(client, url)
+        if meta is not None and meta['length'] >= 2 * min_segment_size:
+            meta['segments'] = _split(meta['length'], segments, min_segment_size)
+            if part.is_file():
+                part.unlink()
+            return await _fetch_segmented(client, url, file_path, meta, segments, slots, copier)
+
+    headers = {}
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+        validator = _validator(meta)
+        if validator is not None:
+            headers['If-Range'] = validator
+
+    start = time.monotonic()
+    resp = await client.request('GET', url, headers=headers, timeout=_TIMEOUT)
+    try:
+        if offset and resp.status == 416 and meta.get('length') == offset:
+            resp.release()
+            _finish(part, sidecar, file_path)
+            return Transfer(url, 0, time.monotonic() - start, offset, tagged='prefix' in meta)
+
+        resp.raise_for_status()
+        if resp.status == 206:
+            first, length = _content_range(resp)
+            if first != offset or (meta.get('length') is not None and length != meta['length']):
+                raise aiohttp.ClientPayloadError('unexpected content range: {}'.format(
+                    resp.headers.get('Content-Range')))
+            mode = 'ab'
+            tagged = 'prefix' in meta
+        else:
+            offset = 0
+            length = resp.content_length
+            meta = _response_meta(url, resp, length)
+            mode = 'wb'
+            tagged = prefix is not None
+
+        # header: our own tag, upstream: the tag it replaces, pending: audio read while looking for that tag
+        header = upstream = pending = b''
+        if mode == 'wb' and tagged:
+            upstream, pending = await _read_id3(resp.content)
+            header = prefix(upstream)
+            meta['prefix'] = len(header)
+            meta['skip'] = len(upstream)
+        if mode == 'wb':
+            _save_meta(sidecar, meta)
+        copier.begin(length, offset)
+        copier.advance(len(upstream) + len(pending))
+
+        f = await aiofiles.open(str(part), mode)
+        try:
+            if header or pending:
+                await f.write(header + pending)
+            size = len(upstream) + len(pending) + await copier.copy(resp, f)
+        finally:
+            await f.close()
+    except BaseException:
+        resp.close()
+        raise
+
+    resp.release()
+    if length is not None and offset + size != length:
+        raise aiohttp.ClientPayloadError('incomplete download: {} of {} bytes'.format(offset + size, length))
+
+    _finish(part, sidecar, file_path)
+    return Transfer(url, size, time.monotonic() - start, offset, tagged=tagged)
@@ -0,0 +1,129 @@
+import codecs
+import json
+import typing
+
+import aiohttp
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+__all__ = [
+    'available',
+    'item',
+    'load',
+]
+
+_C_BACKENDS = ('yajl2_c', 'yajl2_cffi')
+_CHUNK_SIZE = 64 * 1024
+_DEPTH = {
+    'start_map': 1,
+    'start_array': 1,
+    'end_map': -1,
+    'end_array': -1,
+}
+
+
+def available() -> bool:
+    return ijson is not None and hasattr(ijson, 'basic_parse_coro') and ijson.backend in _C_BACKENDS
+
+
+class _Pruner:
+    """
+    Rebuild a JSON document from parser events, keeping only the given paths.
+    Paths are dotted, with ``item`` standing for any array element, the way ijson
+    names prefixes, e.g. ``playlist.tracks.item.name``. Everything below a kept
+    path is kept as a whole.
+    """
+
+    def __init__(self, paths: typing.Iterable[str]):
+        self._keep = frozenset(paths)
+        ancestors = {''}
+        for path in self._keep:
+            parts = path.split('.')
+            ancestors.update('.'.join(parts[:i]) for i in range(1, len(parts)))
+        self._ancestors = frozenset(ancestors)
+        self._stack = []
+        self._skip = 0
+        self.root = None
+
+    def feed(self, events: typing.Iterable[typing.Tuple[str, typing.Any]]) -> None:
+        stack = self._stack
+        keep = self._keep
+        ancestors = self._ancestors
+        skip = self._skip
+        for event, value in events:
+            if skip:
+                skip += _DEPTH.get(event, 0)
+                continue
+
+            if event == 'map_key':
+                stack[-1][3] = value
+                continue
+
+            depth = _DEPTH.get(event, 0)
+            if depth < 0:
+                stack.pop()
+                continue
+
+            if stack:
+                container, parent, parent_full, key = stack[-1]
+                path = (parent + '.' if parent else '') + (key if key is not None else 'item')
+                full = parent_full or path in keep
+            else:
+                container, path, full = None, '', '' in keep
+
+            if not full and path not in ancestors:
+                skip = depth
+                continue
+
+            if depth:
+                value = {} if event == 'start_map' else []
+            if container is None:
+                self.root = value
+            elif key is not None:
+                container[key] = value
+            else:
+                container.append(value)
+            if depth:
+                stack.append([value, path, full, None])
+        self._skip = skip
+
+
+async def load(resp: aiohttp.ClientResponse, paths: typing.Iterable[str]) -> typing.Any:
+    """
+    Parse a JSON response incrementally while it downloads, keeping only ``paths``.
+    Falls back to a full parse when no C-accelerated ijson is installed.
+    """
+    if not available() or codecs.lookup(resp.charset or 'utf-8').name != 'utf-8':
+        body = await resp.read()
+        return json.loads(body.decode(resp.get_encoding()))
+
+    pruner = _Pruner(paths)
+    events = ijson.sendable_list()
+    parser = ijson.basic_parse_coro(events, use_float=True)
+    try:
+        async for chunk in resp.content.iter_chunked(_CHUNK_SIZE):
+            parser.send(chunk)
+            pruner.feed(events)
+            del events[:]
+        parser.close()
+        pruner.feed(events)
+    except ijson.JSONError as e:
+        raise json.JSONDecodeError(str(e), '', 0)
+    return pruner.root
+
+
+def item(body: bytes, key: str) -> typing.Any:
+    """
+    Parse the value of ``key`` out of the JSON object in ``body`` without building
+    the rest of it; parsing stops as soon as the key has been read.
+    Raises ``KeyError`` when the object has no such key.
+    """
+    try:
+        for value in ijson.items(body, key, use_float=True):
+            return value
+    except ijson.JSONError as e:
+        raise json.JSONDecodeError(str(e), '', 0)
+    raise KeyError(key)
@@ -0,0 +1,315 @@
+import asyncio
+import collections
+import logging
+import time
+import typing
+
+import aiohttp
+import yarl
+
+_INITIAL_LIMIT = 32
+_MIN_LIMIT = 1
+_MAX_LIMIT = 256
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter, modeled after Netflix's concurrency-limits.
+
+    The limit grows by one for every successful sample while the limiter is
+    actually in use and the round-trip time stays close to the no-load
+    baseline, and shrinks multiplicatively on timeouts and overload responses.
+    """
+
+    def __init__(self, initial_limit: int = _INITIAL_LIMIT, min_limit: int = _MIN_LIMIT,
+                 max_limit: int = _MAX_LIMIT, backoff_ratio: float = 0.9, tolerance: float = 2.0,
+                 smoothing: float = 0.05):
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._backoff_ratio = backoff_ratio
+        self._tolerance = tolerance
+        self._smoothing = smoothing
+        self._rtt_noload = None
+        self._inflight = 0
+        self._waiters = collections.deque()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @limit.setter
+    def limit(self, value: int) -> None:
+        self._limit = float(max(self._min_limit, min(value, self._max_limit)))
+        self._wake()
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def locked(self) -> bool:
+        return bool(self._waiters) or self._inflight >= self.limit
+
+    async def acquire(self) -> None:
+        if not self._waiters and self._inflight < self.limit:
+            self._inflight += 1
+            return
+
+        fut = asyncio.get_event_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self._inflight -= 1
+        self._wake()
+
+    def on_success(self, rtt: float) -> None:
+        if self._rtt_noload is None or rtt < self._rtt_noload:
+            self._rtt_noload = rtt
+        else:
+            self._rtt_noload += (rtt - self._rtt_noload) * self._smoothing
+
+        if rtt > self._rtt_noload * self._tolerance:
+            return
+
+        if self._inflight * 2 >= self._limit and self._limit < self._max_limit:
+            self._limit = min(self._max_limit, self._limit + 1)
+            self._wake()
+
+    def on_dropped(self) -> None:
+        limit = max(self._min_limit, self._limit * self._backoff_ratio)
+        if int(limit) != self.limit:
+            logging.debug('Concurrency limit backoff: {} -> {}'.format(self.limit, int(limit)))
+        self._limit = limit
+
+    def _wake(self) -> None:
+        while self._waiters and self._inflight < self.limit:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self._inflight += 1
+                fut.set_result(None)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. Callers reserve tokens up front and sleep off any
+    deficit, so waiters are served in arrival order.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        if burst is None:
+            burst = max(rate, 1)
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def _reserve(self, tokens: float) -> float:
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        self._tokens -= tokens
+        return -self._tokens / self._rate if self._tokens < 0 else 0
+
+    async def acquire(self, tokens: float = 1) -> None:
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def acquire_all(buckets: typing.Sequence[TokenBucket], tokens: float) -> None:
+    """Charge ``tokens`` to every bucket at once and wait for the slowest of them."""
+    delay = max(bucket._reserve(tokens) for bucket in buckets)
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+class HostBudget:
+    """Request rate, concurrency and bandwidth budget shared by every host matching a rule."""
+
+    def __init__(self, rate: float = None, burst: float = None, concurrency: int = None,
+                 bandwidth: float = None, downloads: int = None):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.slots = AdaptiveLimiter(concurrency, concurrency, concurrency) if concurrency else None
+        self.bandwidth = TokenBucket(bandwidth) if bandwidth else None
+        self.downloads = downloads
+
+    async def acquire(self) -> None:
+        if self.slots is not None:
+            await self.slots.acquire()
+        if self.bucket is not None:
+            try:
+                await self.bucket.acquire()
+            except asyncio.CancelledError:
+                self.release()
+                raise
+
+    def release(self) -> None:
+        if self.slots is not None:
+            self.slots.release()
+
+
+_limiters = {}  # type: typing.Dict[str, AdaptiveLimiter]
+_budget_rules = {}  # type: typing.Dict[str, dict]
+_budgets = {}  # type: typing.Dict[str, HostBudget]
+_bandwidth = None  # type: typing.Optional[TokenBucket]
+
+
+def configure(host_limits: typing.Optional[typing.Dict[str, dict]]) -> None:
+    """
+    Install per-host budgets, e.g. ``{"music.163.com": {"rate": 10, "concurrency": 16}}``.
+    A rule applies to the host itself and all its subdomains, which share one budget;
+    ``"*"`` gives every other host a budget of its own.
+    ``bandwidth`` caps the bytes per second downloaded from the matching hosts,
+    ``downloads`` the files downloaded from them at once.
+    """
+    rules = {}
+    for host, rule in (host_limits or {}).items():
+        if not isinstance(rule, dict):
+            raise ValueError('invalid limit for host "{}": {}'.format(host, rule))
+        rate = rule.get('rate')
+        burst = rule.get('burst')
+        concurrency = rule.get('concurrency')
+        bandwidth = rule.get('bandwidth')
+        downloads = rule.get('downloads')
+        for v in (rate, burst, concurrency, bandwidth, downloads):
+            if v is not None and (not isinstance(v, (int, float)) or v < 0):
+                raise ValueError('invalid limit for host "{}": {}'.format(host, rule))
+        rules[host.lower()] = {
+            'rate': rate,
+            'burst': burst,
+            'concurrency': int(concurrency) if concurrency else None,
+            'bandwidth': bandwidth,
+            'downloads': int(downloads) if downloads else None,
+        }
+
+    _budget_rules.clear()
+    _budget_rules.update(rules)
+    _budgets.clear()
+
+
+def _match_rule(host: str) -> typing.Optional[str]:
+    host = host.lower()
+    while host:
+        if host in _budget_rules:
+            return host
+        _, _, host = host.partition('.')
+    return '*' if '*' in _budget_rules else None
+
+
+def get_budget(host: str) -> typing.Optional[HostBudget]:
+    rule = _match_rule(host)
+    if rule is None:
+        return None
+    # "*" is a template: every host it matches gets a budget of its own
+    key = host.lower() if rule == '*' else rule
+    budget = _budgets.get(key)
+    if budget is None:
+        budget = _budgets[key] = HostBudget(**_budget_rules[rule])
+    return budget
+
+
+def set_bandwidth(rate: typing.Optional[float]) -> None:
+    """Cap the bytes per second downloaded from all hosts together; ``None`` or 0 lifts the cap."""
+    global _bandwidth
+    if rate is not None and (not isinstance(rate, (int, float)) or rate < 0):
+        raise ValueError('invalid bandwidth: {}'.format(rate))
+    if not rate:
+        _bandwidth = None
+    elif _bandwidth is None or _bandwidth.rate != rate:
+        _bandwidth = TokenBucket(rate)
+
+
+def bandwidth_buckets(host: str) -> typing.List[TokenBucket]:
+    """The buckets that bytes downloaded from ``host`` are charged to, empty if unlimited."""
+    buckets = []
+    if _bandwidth is not None:
+        buckets.append(_bandwidth)
+    budget = get_budget(host)
+    if budget is not None and budget.bandwidth is not None:
+        buckets.append(budget.bandwidth)
+    return buckets
+
+
+def get_limiter(host: str) -> AdaptiveLimiter:
+    limiter = _limiters.get(host)
+    if limiter is None:
+        limiter = _limiters[host] = AdaptiveLimiter()
+    return limiter
+
+
+def limits() -> typing.Dict[str, int]:
+    """The current adaptive concurrency limit of every host seen so far."""
+    return {host: limiter.limit for host, limiter in _limiters.items()}
+
+
+def _is_overloaded(status: int) -> bool:
+    return status == 429 or status >= 500
+
+
+def _on_release(resp: aiohttp.ClientResponse, callback: typing.Callable[[], None]) -> None:
+    """Call ``callback`` once the body of ``resp`` has been read, or the response released or closed."""
+    if resp.connection is None:
+        callback()
+    else:
+        resp.connection.add_callback(callback)
+
+
+async def request(session: aiohttp.ClientSession, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
+    """
+    Send a request under the host's budget and adaptive limit. Both stay taken
+    until the response body has been read or the response is released, so the
+    time spent on the body counts against the limits and the round-trip samples.
+    """
+    host = yarl.URL(url).host or ''
+    budget = get_budget(host)
+    limiter = get_limiter(host)
+    if budget is not None:
+        await budget.acquire()
+    try:
+        await limiter.acquire()
+    except BaseException:
+        if budget is not None:
+            budget.release()
+        raise
+
+    start = time.monotonic()
+    failed = False
+
+    def done():
+        if not failed:
+            limiter.on_success(time.monotonic() - start)
+        limiter.release()
+        if budget is not None:
+            budget.release()
+
+    try:
+        resp = await session.request(method, url, **kwargs)
+    except BaseException as e:
+        failed = True
+        if isinstance(e, asyncio.TimeoutError):
+            limiter.on_dropped()
+        done()
+        raise
+
+    if _is_overloaded(resp.status):
+        failed = True
+        limiter.on_dropped()
+    _on_release(resp, done)
+    return resp
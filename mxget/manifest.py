@@ -0,0 +1,205 @@
+import hashlib
+import os
+import pathlib
+import sqlite3
+import time
+import typing
+
+import mutagen
+from mutagen import (
+    id3,
+)
+
+from mxget import (
+    api,
+    download,
+    exceptions,
+)
+
+FILENAME = '.mxget.db'
+ID_FRAME = 'MXGET_ID'
+
+_LOOKUP_BATCH = 500
+_HASH_CHUNK = 1024 * 1024
+_ID3V1_SIZE = 128
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS songs (
+    platform TEXT NOT NULL,
+    song_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,  -- audio_hash, also the object key under --dedupe
+    tagged INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    PRIMARY KEY (platform, song_id)
+)
+'''
+
+
+class Entry:
+    def __init__(self, platform: str, song_id: str, path: str, size: int, hash: str, tagged: bool = False,
+                 updated: float = None):
+        self.platform = platform
+        self.song_id = song_id
+        self.path = path
+        self.size = size
+        self.hash = hash
+        self.tagged = tagged
+        self.updated = updated if updated is not None else time.time()
+
+
+def platform_of(client: api.API) -> str:
+    return type(client).__name__.lower()
+
+
+def audio_hash(file_path: pathlib.Path) -> str:
+    """
+    SHA-256 of the audio in ``file_path``, leaving out a leading ID3v2 and a
+    trailing ID3v1 tag, so the same track tagged for different songs hashes alike.
+    """
+    h = hashlib.sha256()
+    with file_path.open('rb') as f:
+        start = download.id3_size(f.read(10))
+        end = f.seek(0, os.SEEK_END)
+        if end - start >= _ID3V1_SIZE:
+            f.seek(end - _ID3V1_SIZE)
+            if f.read(3) == b'TAG':
+                end -= _ID3V1_SIZE
+        f.seek(min(start, end))
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(_HASH_CHUNK, remaining))
+            if not chunk:
+                break
+            h.update(chunk)
+            remaining -= len(chunk)
+    return h.hexdigest()
+
+
+def _id_of(audio: id3.ID3) -> typing.Optional[typing.Tuple[str, str]]:
+    frame = audio.get('TXXX:' + ID_FRAME)
+    if frame is None or not frame.text:
+        return None
+    platform, sep, song_id = str(frame.text[0]).partition(':')
+    return (platform, song_id) if sep else None
+
+
+def read_id(file_path: pathlib.Path) -> typing.Optional[typing.Tuple[str, str]]:
+    try:
+        return _id_of(id3.ID3(str(file_path)))
+    except mutagen.MutagenError:
+        return None
+
+
+def id_frame(platform: str, song_id: str) -> id3.TXXX:
+    """The frame that embeds (platform, song id) in a file so the manifest can be rebuilt from disk."""
+    return id3.TXXX(encoding=id3.Encoding.UTF8, desc=ID_FRAME, text='{}:{}'.format(platform, song_id))
+
+
+def write_id(file_path: pathlib.Path, platform: str, song_id: str) -> None:
+    try:
+        audio = id3.ID3(str(file_path))
+    except id3.ID3NoHeaderError:
+        audio = id3.ID3()
+    audio.add(id_frame(platform, song_id))
+    audio.save(str(file_path))
+
+
+class Manifest:
+    """
+    SQLite index of downloaded songs keyed by (platform, song id), kept in the
+    download dir. Paths are stored relative to it.
+    """
+
+    def __init__(self, root: pathlib.Path):
+        self.root = root
+        self.path = root.joinpath(FILENAME)
+        try:
+            self._db = sqlite3.connect(str(self.path))
+            self._db.execute(_SCHEMA)
+        except sqlite3.Error as e:
+            raise exceptions.ClientError("can't open manifest: {}".format(e))
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def lookup(self, platform: str, song_ids: typing.Iterable[str]) -> typing.Dict[str, Entry]:
+        song_ids = list(song_ids)
+        entries = {}
+        for i in range(0, len(song_ids), _LOOKUP_BATCH):
+            batch = song_ids[i:i + _LOOKUP_BATCH]
+            rows = self._db.execute(
+                'SELECT platform, song_id, path, size, hash, tagged, updated FROM songs '
+                'WHERE platform = ? AND song_id IN ({})'.format(','.join('?' * len(batch))),
+                [platform] + batch,
+            )
+            for row in rows:
+                entries[row[1]] = Entry(*row)
+        return entries
+
+    def _insert(self, entries: typing.Iterable[Entry]) -> None:
+        self._db.executemany(
+            'INSERT OR REPLACE INTO songs (platform, song_id, path, size, hash, tagged, updated) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(e.platform, e.song_id, e.path, e.size, e.hash, int(e.tagged), e.updated) for e in entries],
+        )
+
+    def record(self, *entries: Entry) -> None:
+        with self._db:
+            self._insert(entries)
+
+    def remove(self, platform: str, song_id: str) -> None:
+        with self._db:
+            self._db.execute('DELETE FROM songs WHERE platform = ? AND song_id = ?', (platform, song_id))
+
+    def locate(self, entry: Entry) -> pathlib.Path:
+        return self.root.joinpath(entry.path)
+
+    def exists(self, entry: Entry) -> bool:
+        try:
+            return self.locate(entry).stat().st_size == entry.size
+        except OSError:
+            return False
+
+    def entry_for(self, platform: str, song_id: str, file_path: pathlib.Path, tagged: bool = False) -> Entry:
+        return Entry(platform, str(song_id), file_path.relative_to(self.root).as_posix(), file_path.stat().st_size,
+                     audio_hash(file_path), tagged)
+
+    def rebuild(self) -> typing.Tuple[int, int]:
+        """
+        Re-index every mp3 under the download dir that carries an id frame.
+        Returns the number of indexed and skipped files; unreadable files are
+        skipped too.
+        """
+        entries = []
+        skipped = 0
+        for dirpath, dirnames, filenames in os.walk(str(self.root)):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for filename in filenames:
+                if not filename.lower().endswith('.mp3'):
+                    continue
+                file_path = pathlib.Path(dirpath, filename)
+                try:
+                    audio = id3.ID3(str(file_path))
+                except mutagen.MutagenError:
+                    audio = None
+                key = _id_of(audio) if audio is not None else None
+                if key is None:
+                    skipped += 1
+                    continue
+                try:
+                    entries.append(self.entry_for(key[0], key[1], file_path, 'TIT2' in audio))
+                except OSError:
+                    skipped += 1
+
+        with self._db:
+            self._db.execute('DELETE FROM songs')
+            self._insert(entries)
+        return len(entries), skipped
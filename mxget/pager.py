@@ -0,0 +1,42 @@
+import asyncio
+import collections
+import typing
+
+__all__ = [
+    'iter_pages',
+]
+
+T = typing.TypeVar('T')
+R = typing.TypeVar('R')
+
+
+async def iter_pages(fetch: typing.Callable[[T], typing.Awaitable[R]], pages: typing.Iterable[T],
+                     lookahead: int = 4) -> typing.AsyncIterator[R]:
+    """
+    Fetch pages in order, keeping at most ``lookahead`` requests in flight, and
+    yield each result as soon as it and every page before it have arrived.
+    Requests still pending when the consumer stops iterating are cancelled.
+    """
+    if lookahead < 1:
+        raise ValueError('lookahead must be at least 1')
+
+    pages = iter(pages)
+    pending = collections.deque()
+
+    def fill():
+        while len(pending) < lookahead:
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+            pending.append(asyncio.ensure_future(fetch(page)))
+
+    try:
+        fill()
+        while pending:
+            result = await pending.popleft()
+            fill()
+            yield result
+    finally:
+        for fut in pending:
+            fut.cancel()
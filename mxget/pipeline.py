@@ -0,0 +1,67 @@
+import asyncio
+import typing
+
+from mxget import exceptions
+
+__all__ = [
+    'Step',
+    'Pipeline',
+]
+
+StepFunc = typing.Callable[[typing.Any], typing.Awaitable[None]]
+
+
+class Step:
+    def __init__(self, name: str, func: StepFunc, requires: typing.Sequence[str] = ()):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+
+
+class Pipeline:
+    """
+    Run a small dependency graph of enrichment steps for every item. Each item
+    advances through its own graph independently, so a slow step on one item
+    never holds back the others, and every step call shares one concurrency budget.
+
+    A step fails by raising ``exceptions.ClientError``; steps that require it are
+    then skipped for that item.
+    """
+
+    def __init__(self, *steps: Step, concurrency: int = 64):
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+
+        seen = set()
+        for step in steps:
+            if step.name in seen:
+                raise ValueError('duplicate step: {}'.format(step.name))
+            for name in step.requires:
+                if name not in seen:
+                    raise ValueError('step {} requires unknown or later step: {}'.format(step.name, name))
+            seen.add(step.name)
+
+        self._steps = steps
+        self._concurrency = concurrency
+
+    async def run(self, *items: typing.Any) -> None:
+        sem = asyncio.Semaphore(self._concurrency)
+
+        async def run_step(item: typing.Any, step: Step, deps: typing.List[asyncio.Future]) -> bool:
+            if deps and not all(await asyncio.gather(*deps)):
+                return False
+            async with sem:
+                try:
+                    await step.func(item)
+                except exceptions.ClientError:
+                    return False
+            return True
+
+        tasks = []
+        for item in items:
+            futures = {}
+            for step in self._steps:
+                deps = [futures[name] for name in step.requires]
+                futures[step.name] = asyncio.ensure_future(run_step(item, step, deps))
+            tasks.extend(futures.values())
+        await asyncio.gather(*tasks)
@@ -0,0 +1,227 @@
+import asyncio
+import collections
+import json
+import logging
+import shutil
+import sys
+import time
+import typing
+
+from mxget import utils
+
+__all__ = [
+    'FileProgress',
+    'Progress',
+    'JSONLines',
+    'TerminalView',
+]
+
+INTERVAL = 0.5
+
+_WINDOW = 5.0
+
+Listener = typing.Callable[[str, dict], None]
+
+
+class FileProgress:
+    def __init__(self, owner: 'Progress', name: str):
+        self._owner = owner
+        self.name = name
+        self.total = None
+        self.offset = 0
+        self.done = 0
+        self.started = time.monotonic()
+
+    def begin(self, total: typing.Optional[int], offset: int = 0) -> None:
+        """Called by the downloader once the size is known; ``offset`` bytes were already on disk."""
+        self.total = total
+        self.offset = self.done = offset
+        self._owner.emit('start', {'file': self.name, 'total': total, 'offset': offset})
+
+    def advance(self, n: int) -> None:
+        self.done += n
+        self._owner.advance(n)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self) -> float:
+        elapsed = self.elapsed
+        return (self.done - self.offset) / elapsed if elapsed > 0 else 0.0
+
+
+class Progress:
+    """
+    Byte and file counters for a download run. Rates are averaged over the last
+    few seconds; listeners receive ``start``/``finish`` events per file and a
+    ``progress`` snapshot on every tick of ``run``.
+    """
+
+    def __init__(self, queued: int = 0):
+        self.queued = queued
+        self.active = []
+        self.completed = 0
+        self.failed = 0
+        self.bytes = 0
+        self._sizes = 0
+        self._started = time.monotonic()
+        self._samples = collections.deque()
+        self._base = (self._started, 0)
+        self._listeners = []
+
+    def add_listener(self, listener: Listener) -> None:
+        self._listeners.append(listener)
+
+    def emit(self, event: str, data: dict) -> None:
+        for listener in self._listeners:
+            listener(event, data)
+
+    def open(self, name: str) -> FileProgress:
+        self.queued = max(self.queued - 1, 0)
+        handle = FileProgress(self, name)
+        self.active.append(handle)
+        return handle
+
+    def close(self, handle: FileProgress, ok: bool = True) -> None:
+        self.active.remove(handle)
+        if ok:
+            self.completed += 1
+            self._sizes += handle.total if handle.total is not None else handle.done
+        else:
+            self.failed += 1
+        self.emit('finish', {
+            'file': handle.name,
+            'ok': ok,
+            'bytes': handle.done - handle.offset,
+            'elapsed': round(handle.elapsed, 3),
+            'rate': round(handle.rate),
+        })
+
+    def _trim(self, now: float) -> None:
+        samples = self._samples
+        while samples and samples[0][0] < now - _WINDOW:
+            self._base = samples.popleft()
+
+    def advance(self, n: int) -> None:
+        now = time.monotonic()
+        self.bytes += n
+        self._samples.append((now, self.bytes))
+        self._trim(now)
+
+    @property
+    def rate(self) -> float:
+        now = time.monotonic()
+        self._trim(now)
+        since, base = self._base
+        return (self.bytes - base) / (now - since) if now > since else 0.0
+
+    def eta(self, rate: float = None) -> typing.Optional[float]:
+        """Seconds left, estimating queued files by the average size seen so far."""
+        if rate is None:
+            rate = self.rate
+        known = [h.total for h in self.active if h.total is not None]
+        if self.completed:
+            average = self._sizes / self.completed
+        elif known:
+            average = sum(known) / len(known)
+        else:
+            return None
+        remaining = sum(max(h.total - h.done, 0) if h.total is not None else average for h in self.active)
+        remaining += self.queued * average
+        return remaining / rate if rate > 0 else None
+
+    def snapshot(self) -> dict:
+        rate = self.rate
+        eta = self.eta(rate)
+        return {
+            'completed': self.completed,
+            'failed': self.failed,
+            'active': len(self.active),
+            'queued': self.queued,
+            'bytes': self.bytes,
+            'rate': round(rate),
+            'eta': round(eta, 1) if eta is not None else None,
+            'files': [{
+                'file': h.name,
+                'done': h.done,
+                'total': h.total,
+                'rate': round(h.rate),
+            } for h in self.active],
+        }
+
+    async def run(self, interval: float = INTERVAL) -> None:
+        """Emit a ``progress`` snapshot every ``interval`` seconds until cancelled."""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                self.emit('progress', self.snapshot())
+        finally:
+            summary = self.snapshot()
+            summary['elapsed'] = round(time.monotonic() - self._started, 3)
+            self.emit('summary', summary)
+
+
+class JSONLines:
+    """Writes every event as one JSON object per line, for automation."""
+
+    def __init__(self, stream: typing.TextIO = None):
+        self._stream = stream if stream is not None else sys.stdout
+
+    def __call__(self, event: str, data: dict) -> None:
+        record = {'event': event, 'time': round(time.time(), 3)}
+        record.update(data)
+        self._stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._stream.flush()
+
+
+def _format_eta(eta: typing.Optional[float]) -> str:
+    if eta is None:
+        return '--:--:--'
+    eta = int(eta)
+    return '{:02d}:{:02d}:{:02d}'.format(eta // 3600, eta // 60 % 60, eta % 60)
+
+
+class TerminalView:
+    """
+    A single status line on stderr, redrawn on every ``progress`` event. Log
+    records clear the line first so the two don't interleave.
+    """
+
+    def __init__(self, stream: typing.TextIO = None):
+        self._stream = stream if stream is not None else sys.stderr
+        self._drawn = False
+        for handler in logging.getLogger().handlers:
+            handler.addFilter(self._clear)
+
+    def _clear(self, record: logging.LogRecord) -> bool:
+        if self._drawn:
+            self._stream.write('\r\x1b[K')
+            self._drawn = False
+        return True
+
+    def __call__(self, event: str, data: dict) -> None:
+        if event not in ('progress', 'summary'):
+            return
+        done = data['completed'] + data['failed']
+        failed = ', {} failed'.format(data['failed']) if data['failed'] else ''
+        if event == 'summary':
+            self.close()
+            self._stream.write('[{}/{}] {} in {:.1f}s{}\n'.format(
+                data['completed'], done, utils.format_size(data['bytes']), data['elapsed'], failed))
+            self._stream.flush()
+            return
+
+        line = '[{}/{}] {} active, {}/s, {} total, ETA {}{}'.format(
+            done, done + data['active'] + data['queued'], data['active'], utils.format_size(data['rate']),
+            utils.format_size(data['bytes']), _format_eta(data['eta']), failed)
+        width = shutil.get_terminal_size().columns - 1
+        self._stream.write('\r\x1b[K' + line[:width])
+        self._stream.flush()
+        self._drawn = True
+
+    def close(self) -> None:
+        self._clear(None)
+        for handler in logging.getLogger().handlers:
+            handler.removeFilter(self._clear)
@@ -1,5 +1,6 @@
 import asyncio
 import base64
+import functools
 import hashlib
 import json
 import time
@@ -12,6 +13,7 @@ from mxget import (
     api,
     crypto,
     exceptions,
+    limiter,
 )
 
 _API_SEARCH = "http://musicapi.qianqian.com/v1/restserver/ting?method=baidu.ting.search.merge" \
@@ -28,10 +30,12 @@ _API_GET_ALBUM = "http://musicapi.qianqian.com/v1/restserver/ting?method=baidu.t
 _API_GET_PLAYLIST = "http://musicapi.qianqian.com/v1/restserver/ting?method=baidu.ting.ugcdiy.getBaseInfo" \
                     "&from=android&version=8.1.4.0"
 
+_SONG_REQUEST_LIMIT = 100
+
 _INPUT = '2012171402992850'
-_IV = '2012061402992850'
+_IV = b'2012061402992850'
 _HASH = hashlib.md5(_INPUT.encode('utf-8')).hexdigest().upper()
-_KEY = _HASH[len(_HASH) // 2:]
+_KEY = _HASH[len(_HASH) // 2:].encode('utf-8')
 
 
 def _aes_cbc_encrypt(song_id: typing.Union[int, str]) -> dict:
@@ -41,20 +45,25 @@ def _aes_cbc_encrypt(song_id: typing.Union[int, str]) -> dict:
     }
 
     q = urllib.parse.urlencode(params)
-    sec = crypto.aes_cbc_encrypt(q.encode('utf-8'), _KEY.encode('utf-8'), _IV.encode('utf-8'))
+    sec = crypto.aes_cbc_encrypt(q.encode('utf-8'), _KEY, _IV)
     e = base64.b64encode(sec).decode('utf-8')
 
     params['e'] = e
     return params
 
 
+@functools.lru_cache(maxsize=4)
+def _sign_key(ts: int) -> bytes:
+    r = 'baidu_taihe_music_secret_key{}'.format(ts)
+    return hashlib.md5(r.encode('utf-8')).hexdigest()[8:24].encode('utf-8')
+
+
 def _sign_payload(params: dict) -> dict:
     ts = int(time.time())
-    r = 'baidu_taihe_music_secret_key{}'.format(ts)
-    key = hashlib.md5(r.encode('utf-8')).hexdigest()[8:24]
+    key = _sign_key(ts)
 
     q = urllib.parse.urlencode(params)
-    sec = crypto.aes_cbc_encrypt(q.encode('utf-8'), key.encode('utf-8'), key.encode('utf-8'))
+    sec = crypto.aes_cbc_encrypt(q.encode('utf-8'), key, key)
     param = base64.b64encode(sec).decode('utf-8')
     sign = hashlib.md5('baidu_taihe_music{}{}'.format(param, ts).encode('utf-8')).hexdigest()
 
@@ -82,6 +91,7 @@ def _resolve(*songs: dict) -> typing.List[api.Song]:
             album=song.get('album_title', '').strip(),
             pic_url=song.get('pic_big', '').split('@', 1)[0],
             lyric=song.get('lyric'),
+            lyric_loader=song.get('lyric_loader'),
             url=song.get('url'),
         ) for song in songs
     ]
@@ -108,14 +118,22 @@ class BaiDu(api.API):
         return api.PlatformId.BaiDu
 
     async def search_songs(self, keyword: str) -> api.SearchSongsResult:
-        resp = await self.search_songs_raw(keyword)
+        songs, _ = await self.search_songs_page(keyword)
+        if not songs:
+            raise exceptions.DataError('search songs: no data')
+
+        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+
+    async def search_songs_page(self, keyword: str, page: int = 1, page_size: int = 50) -> api.Page:
+        resp = await self.search_songs_raw(keyword, page, page_size)
         try:
             _songs = resp['result']['song_info']['song_list']
-        except KeyError:
-            raise exceptions.DataError('search songs: no data')
+            total = resp['result']['song_info'].get('total')
+        except (KeyError, TypeError):
+            return [], None
 
         if not _songs:
-            raise exceptions.DataError('search songs: no data')
+            return [], total
 
         songs = [
             api.SearchSongsData(
@@ -125,7 +143,7 @@ class BaiDu(api.API):
                 album=_song['album_title'].strip(),
             ) for _song in _songs
         ]
-        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+        return songs, total
 
     async def search_songs_raw(self, keyword: str, page: int = 1, page_size: int = 50) -> dict:
         params = {
@@ -140,7 +158,7 @@ class BaiDu(api.API):
             raise exceptions.RequestError('search songs: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['error_code'] != 22000:
                 raise exceptions.ResponseError('search songs: {}'.format(resp.get('error_message', resp['error_code'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -156,7 +174,7 @@ class BaiDu(api.API):
             raise exceptions.DataError('get song: no data')
 
         _song['url'] = _song_url(resp['songurl']['url'])
-        await self._patch_song_lyric(_song)
+        self._defer_song_lyric(_song)
         songs = _resolve(_song)
         return songs[0]
 
@@ -167,7 +185,7 @@ class BaiDu(api.API):
             raise exceptions.RequestError('get song: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['error_code'] != 22000:
                 raise exceptions.ResponseError('get song: {}'.format(resp.get('error_message', resp['error_code'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -175,49 +193,87 @@ class BaiDu(api.API):
 
         return resp
 
-    async def _patch_song_url(self, *songs: dict) -> None:
-        sem = asyncio.Semaphore(32)
+    async def get_songs_raw(self, *song_ids: typing.Union[int, str]) -> dict:
+        if len(song_ids) > _SONG_REQUEST_LIMIT:
+            song_ids = song_ids[:_SONG_REQUEST_LIMIT]
 
-        async def worker(song: dict):
-            async with sem:
-                try:
-                    resp = await self.get_song_raw(song['song_id'])
-                except exceptions.ClientError:
-                    return
+        params = {
+            'songIds': ','.join(str(song_id) for song_id in song_ids),
+            'type': 'mp3',
+            'rate': 320,
+        }
 
-                try:
-                    urls = resp['songurl']['url']
-                except KeyError:
-                    pass
-                else:
-                    song['url'] = _song_url(urls)
+        try:
+            _resp = await self.request('GET', _API_GET_SONGS, params=params)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise exceptions.RequestError('get songs: {}'.format(e))
 
-                if not song.get('lrclink', ''):
-                    try:
-                        song['lrclink'] = resp['songinfo']['lrclink']
-                    except KeyError:
-                        pass
+        try:
+            resp = await api.read_json(_resp, self.keep_body)
+            if resp['errorCode'] != 22000:
+                raise exceptions.ResponseError('get songs: {}'.format(resp.get('errorMessage', resp['errorCode'])))
+        except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
+            raise exceptions.ResponseError('get songs: {}'.format(e))
 
-        tasks = [asyncio.ensure_future(worker(song)) for song in songs]
-        await asyncio.gather(*tasks)
+        return resp
 
-    async def _patch_song_lyric(self, *songs: dict) -> None:
-        sem = asyncio.Semaphore(32)
+    async def _patch_song_url(self, *songs: dict) -> None:
+        async def patch_batch(batch: typing.Sequence[dict]):
+            try:
+                resp = await self.get_songs_raw(*[s['song_id'] for s in batch])
+                items = resp['data']['songList'] or []
+            except (exceptions.ClientError, KeyError, TypeError):
+                return
+
+            song_map = {str(i.get('songId')): i for i in items}
+            for song in batch:
+                item = song_map.get(str(song['song_id']))
+                if item is None or not item.get('songLink'):
+                    continue
+                song['url'] = item['songLink']
+                if not song.get('lrclink', '') and item.get('lrcLink'):
+                    song['lrclink'] = item['lrcLink']
 
         async def worker(song: dict):
-            async with sem:
-                lrc_link = song.get('lrclink', '')
-                if not lrc_link:
-                    return
+            try:
+                resp = await self.get_song_raw(song['song_id'])
+            except exceptions.ClientError:
+                return
+
+            try:
+                urls = resp['songurl']['url']
+            except KeyError:
+                pass
+            else:
+                song['url'] = _song_url(urls)
+
+            if not song.get('lrclink', ''):
                 try:
-                    resp = await self.request('GET', lrc_link)
-                    song['lyric'] = await resp.text()
-                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    song['lrclink'] = resp['songinfo']['lrclink']
+                except KeyError:
                     pass
 
-        tasks = [asyncio.ensure_future(worker(song)) for song in songs]
+        batches = [songs[i:i + _SONG_REQUEST_LIMIT] for i in range(0, len(songs), _SONG_REQUEST_LIMIT)]
+        tasks = [asyncio.ensure_future(patch_batch(batch)) for batch in batches]
         await asyncio.gather(*tasks)
 
+        tasks = [asyncio.ensure_future(worker(song)) for song in songs if not song.get('url')]
+        await asyncio.gather(*tasks)
+
+    async def _fetch_lyric(self, lrc_link: str) -> typing.Optional[str]:
+        try:
+            resp = await self.request('GET', lrc_link)
+            lyric = await resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+        return lyric if lyric else None
+
+    def _defer_song_lyric(self, *songs: dict) -> None:
+        for song in songs:
+            lrc_link = song.get('lrclink', '')
+            if lrc_link:
+                song['lyric_loader'] = api.lyric_loader(self.platform_id(), lrc_link, self._fetch_lyric, lrc_link)
+
     async def get_artist(self, ting_uid: typing.Union[int, str]) -> api.Artist:
         resp = await self.get_artist_raw(ting_uid)
 
@@ -231,7 +287,7 @@ class BaiDu(api.API):
             raise exceptions.DataError('get artist: no data')
 
         await self._patch_song_url(*_songs)
-        await self._patch_song_lyric(*_songs)
+        self._defer_song_lyric(*_songs)
         songs = _resolve(*_songs)
         return api.Artist(
             artist_id=artist['ting_uid'],
@@ -255,7 +311,7 @@ class BaiDu(api.API):
             raise exceptions.RequestError('get artist: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['error_code'] != 22000:
                 raise exceptions.ResponseError('get artist: {}'.format(resp.get('error_message', resp['error_code'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -276,7 +332,7 @@ class BaiDu(api.API):
             raise exceptions.DataError('get album: no data')
 
         await self._patch_song_url(*_songs)
-        await self._patch_song_lyric(*_songs)
+        self._defer_song_lyric(*_songs)
         songs = _resolve(*_songs)
         return api.Album(
             album_id=album['album_id'],
@@ -297,7 +353,7 @@ class BaiDu(api.API):
             raise exceptions.RequestError('get album: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp.get('error_code') is not None and resp['error_code'] != 22000:
                 raise exceptions.ResponseError('get album: {}'.format(resp.get('error_message', resp['error_code'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -318,7 +374,7 @@ class BaiDu(api.API):
             raise exceptions.DataError('get playlist: no data')
 
         await self._patch_song_url(*_songs)
-        await self._patch_song_lyric(*_songs)
+        self._defer_song_lyric(*_songs)
         songs = _resolve(*_songs)
         return api.Playlist(
             playlist_id=playlist['list_id'],
@@ -341,7 +397,7 @@ class BaiDu(api.API):
             raise exceptions.RequestError('get playlist: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['error_code'] != 22000:
                 raise exceptions.ResponseError('get playlist: {}'.format(resp.get('error_message', resp['error_code'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -355,8 +411,9 @@ class BaiDu(api.API):
             'Referer': 'http://music.taihe.com',
             'User-Agent': api.USER_AGENT,
         }
+        headers.update(kwargs.get('headers') or {})
         kwargs.update({
             'headers': headers,
         })
 
-        return await self._session.request(method, url, **kwargs)
+        return await limiter.request(self._session, method, url, **kwargs)
@@ -1,6 +1,7 @@
 import asyncio
 import hashlib
 import json
+import logging
 import random
 import typing
 
@@ -8,7 +9,10 @@ import aiohttp
 
 from mxget import (
     api,
+    cache,
     exceptions,
+    limiter,
+    pipeline,
 )
 
 _API_SEARCH = 'http://mobilecdn.kugou.com/api/v3/search/song'
@@ -22,6 +26,11 @@ _API_GET_ALBUM_SONGS = 'http://mobilecdn.kugou.com/api/v3/album/song'
 _API_GET_PLAYLIST_INFO = 'http://mobilecdn.kugou.com/api/v3/special/info'
 _API_GET_PLAYLIST_SONGS = 'http://mobilecdn.kugou.com/api/v3/special/song'
 
+_ALBUM_NAME_TTL = 24 * 3600
+_ENRICH_CONCURRENCY = 64
+
+_album_name_cache = cache.TTLCache(4096, _ALBUM_NAME_TTL)
+
 
 def _resolve(*songs: dict) -> typing.List[api.Song]:
     return [
@@ -32,18 +41,28 @@ def _resolve(*songs: dict) -> typing.List[api.Song]:
             album=song.get('album_name', '').strip(),
             pic_url=song['album_img'].replace('{size}', '480'),
             lyric=song.get('lyric'),
+            lyric_loader=song.get('lyric_loader'),
             url=song.get('url'),
         ) for song in songs if song.get('songName') is not None
     ]
 
 
+def _album_calls_saved(songs: typing.Sequence[dict], fetched: typing.Set[str]) -> int:
+    count = sum(1 for song in songs if song.get('albumid', 0) != 0)
+    saved = count - len(fetched)
+    if count:
+        logging.debug('Album info: {} songs, {} upstream calls, {} saved'.format(count, len(fetched), saved))
+    return saved
+
+
 class KuGou(api.API):
-    def __init__(self, session: aiohttp.ClientSession = None):
+    def __init__(self, session: aiohttp.ClientSession = None, enrich_concurrency: int = _ENRICH_CONCURRENCY):
         if session is None:
             session = aiohttp.ClientSession(
                 timeout=aiohttp.ClientTimeout(total=120),
             )
         self._session = session
+        self._enrich_concurrency = enrich_concurrency
 
     async def close(self):
         await self._session.close()
@@ -58,14 +77,22 @@ class KuGou(api.API):
         return api.PlatformId.KuGou
 
     async def search_songs(self, keyword: str) -> api.SearchSongsResult:
-        resp = await self.search_songs_raw(keyword)
+        songs, _ = await self.search_songs_page(keyword)
+        if not songs:
+            raise exceptions.DataError('search songs: no data')
+
+        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+
+    async def search_songs_page(self, keyword: str, page: int = 1, page_size: int = 50) -> api.Page:
+        resp = await self.search_songs_raw(keyword, page, page_size)
         try:
             _songs = resp['data']['info']
-        except KeyError:
-            raise exceptions.DataError('search songs: no data')
+            total = resp['data'].get('total')
+        except (KeyError, TypeError):
+            return [], None
 
         if not _songs:
-            raise exceptions.DataError('search songs: no data')
+            return [], total
 
         songs = [
             api.SearchSongsData(
@@ -75,7 +102,7 @@ class KuGou(api.API):
                 album=_song['album_name'].strip(),
             ) for _song in _songs
         ]
-        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+        return songs, total
 
     async def search_songs_raw(self, keyword: str, page: int = 1, page_size: int = 50) -> dict:
         params = {
@@ -90,7 +117,7 @@ class KuGou(api.API):
             raise exceptions.RequestError('search songs: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['errcode'] != 0:
                 raise exceptions.ResponseError('search songs: {}'.format(resp.get('error', resp['errcode'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -101,7 +128,7 @@ class KuGou(api.API):
     async def get_song(self, file_hash: str) -> api.Song:
         resp = await self.get_song_raw(file_hash)
         await self._patch_album_info(resp)
-        await self._patch_song_lyric(resp)
+        self._defer_song_lyric(resp)
         songs = _resolve(resp)
         return songs[0]
 
@@ -116,7 +143,7 @@ class KuGou(api.API):
             raise exceptions.RequestError('get song: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['errcode'] != 0:
                 raise exceptions.ResponseError('get song: {}'.format(resp.get('error', resp['errcode'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -151,7 +178,7 @@ class KuGou(api.API):
             raise exceptions.RequestError('get song url: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['status'] != 1:
                 raise exceptions.ResponseError('get song url: {}'.format(resp.get('error', 'copyright protection')))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -172,60 +199,64 @@ class KuGou(api.API):
 
         return lyric if lyric else None
 
-    async def _patch_song_info(self, *songs: dict) -> None:
-        sem = asyncio.Semaphore(32)
+    async def _fetch_song_info(self, song: dict) -> None:
+        resp = await self.get_song_raw(song['hash'])
+        song['songName'] = resp['songName']
+        song['singerId'] = resp['singerId']
+        song['singerName'] = resp['singerName']
+        song['choricSinger'] = resp['choricSinger']
+        song['albumid'] = resp['albumid']
+        song['album_img'] = resp['album_img']
+        song['extra'] = resp['extra']
+        song['url'] = resp['url']
 
+    async def _patch_song_url(self, *songs: dict) -> None:
         async def worker(song: dict):
-            async with sem:
-                try:
-                    resp = await self.get_song_raw(song['hash'])
-                except (exceptions.RequestError, exceptions.ResponseError):
-                    return
-                song['songName'] = resp['songName']
-                song['singerId'] = resp['singerId']
-                song['singerName'] = resp['singerName']
-                song['choricSinger'] = resp['choricSinger']
-                song['albumid'] = resp['albumid']
-                song['album_img'] = resp['album_img']
-                song['extra'] = resp['extra']
-                song['url'] = resp['url']
+            song['url'] = await self.get_song_url(song['hash'])
 
         tasks = [asyncio.ensure_future(worker(song)) for song in songs]
         await asyncio.gather(*tasks)
 
-    async def _patch_song_url(self, *songs: dict) -> None:
-        sem = asyncio.Semaphore(32)
-
-        async def worker(song: dict):
-            async with sem:
-                song['url'] = await self.get_song_url(song['hash'])
+    def _defer_song_lyric(self, *songs: dict) -> None:
+        for song in songs:
+            song['lyric_loader'] = api.lyric_loader(self.platform_id(), song['hash'], self.get_song_lyric, song['hash'])
 
-        tasks = [asyncio.ensure_future(worker(song)) for song in songs]
-        await asyncio.gather(*tasks)
+    async def get_album_name(self, album_id: typing.Union[int, str]) -> typing.Optional[str]:
+        try:
+            resp = await self.get_album_info_raw(album_id)
+            return resp['data']['albumname']
+        except (exceptions.RequestError, exceptions.ResponseError, KeyError, TypeError):
+            return None
 
-    async def _patch_song_lyric(self, *songs: dict) -> None:
-        sem = asyncio.Semaphore(32)
+    async def _fetch_album_name(self, song: dict, fetched: typing.Set[str]) -> None:
+        if song.get('albumid', 0) == 0:
+            return
 
-        async def worker(song: dict):
-            async with sem:
-                song['lyric'] = await self.get_song_lyric(song['hash'])
+        album_id = str(song['albumid'])
 
-        tasks = [asyncio.ensure_future(worker(song)) for song in songs]
-        await asyncio.gather(*tasks)
+        async def load():
+            fetched.add(album_id)
+            return await self.get_album_name(album_id)
 
-    async def _patch_album_info(self, *songs: dict) -> None:
-        sem = asyncio.Semaphore(32)
+        album_name = await _album_name_cache.get_or_load(album_id, load)
+        if album_name is not None:
+            song['album_name'] = album_name
 
-        async def worker(song: dict):
-            async with sem:
-                try:
-                    resp = await self.get_album_info_raw(song['albumid'])
-                    song['album_name'] = resp['data']['albumname']
-                except (exceptions.RequestError, exceptions.ResponseError, KeyError):
-                    pass
-
-        tasks = [asyncio.ensure_future(worker(song)) for song in songs if song.get('albumid', 0) != 0]
+    async def _patch_album_info(self, *songs: dict) -> int:
+        fetched = set()
+        tasks = [asyncio.ensure_future(self._fetch_album_name(song, fetched)) for song in songs]
         await asyncio.gather(*tasks)
+        return _album_calls_saved(songs, fetched)
+
+    async def _enrich_songs(self, *songs: dict) -> None:
+        fetched = set()
+        p = pipeline.Pipeline(
+            pipeline.Step('info', self._fetch_song_info),
+            pipeline.Step('album', lambda song: self._fetch_album_name(song, fetched), requires=('info',)),
+            concurrency=self._enrich_concurrency,
+        )
+        await p.run(*songs)
+        _album_calls_saved(songs, fetched)
 
     async def get_artist(self, singer_id: typing.Union[int, str]) -> api.Artist:
         artist_info = await self.get_artist_info_raw(singer_id)
@@ -239,10 +270,7 @@ class KuGou(api.API):
         if not _songs:
             raise exceptions.DataError('get artist: no data')
 
-        await self._patch_song_info(*_songs)
-        await self._patch_album_info(*_songs)
-        await self._patch_song_lyric(*_songs)
-        songs = _resolve(*_songs)
+        songs = await self._resolve_artist_songs(*_songs)
         return api.Artist(
             artist_id=artist_info['data']['singerid'],
             name=artist_info['data']['singername'].strip(),
@@ -251,6 +279,26 @@ class KuGou(api.API):
             songs=songs,
         )
 
+    async def _resolve_artist_songs(self, *songs: dict) -> typing.List[api.Song]:
+        await self._enrich_songs(*songs)
+        self._defer_song_lyric(*songs)
+        return _resolve(*songs)
+
+    async def get_artist_songs_page(self, singer_id: typing.Union[int, str],
+                                    page: int = 1, page_size: int = 50) -> api.Page:
+        page_data = await self.get_artist_songs_raw(singer_id, page, page_size)
+        try:
+            _songs = page_data['data']['info']
+            total = page_data['data'].get('total')
+        except (KeyError, TypeError):
+            return [], None
+
+        if not _songs:
+            return [], total
+
+        songs = await self._resolve_artist_songs(*_songs)
+        return songs, total
+
     async def get_artist_info_raw(self, singer_id: typing.Union[int, str]) -> dict:
         params = {
             'singerid': singer_id,
@@ -262,7 +310,7 @@ class KuGou(api.API):
             raise exceptions.RequestError('get artist info: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['errcode'] != 0:
                 raise exceptions.ResponseError('get artist info: {}'.format(resp.get('error', resp['errcode'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -284,7 +332,7 @@ class KuGou(api.API):
             raise exceptions.RequestError('get artist songs: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['errcode'] != 0:
                 raise exceptions.ResponseError('get artist songs: {}'.format(resp.get('error', resp['errcode'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -304,9 +352,13 @@ class KuGou(api.API):
         if not _songs:
             raise exceptions.DataError('get album: no data')
 
-        await self._patch_song_info(*_songs)
-        await self._patch_album_info(*_songs)
-        await self._patch_song_lyric(*_songs)
+        try:
+            _album_name_cache.set(str(album_info['data']['albumid']), album_info['data']['albumname'])
+        except (KeyError, TypeError):
+            pass
+
+        await self._enrich_songs(*_songs)
+        self._defer_song_lyric(*_songs)
         songs = _resolve(*_songs)
         return api.Album(
             album_id=album_info['data']['albumid'],
@@ -327,7 +379,7 @@ class KuGou(api.API):
             raise exceptions.RequestError('get album info: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['errcode'] != 0:
                 raise exceptions.ResponseError('get album info: {}'.format(resp.get('error', resp['errcode'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -349,7 +401,7 @@ class KuGou(api.API):
             raise exceptions.RequestError('get album songs: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['errcode'] != 0:
                 raise exceptions.ResponseError('get album songs: {}'.format(resp.get('error', resp['errcode'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -369,9 +421,8 @@ class KuGou(api.API):
         if not _songs:
             raise exceptions.DataError('get playlist: no data')
 
-        await self._patch_song_info(*_songs)
-        await self._patch_album_info(*_songs)
-        await self._patch_song_lyric(*_songs)
+        await self._enrich_songs(*_songs)
+        self._defer_song_lyric(*_songs)
         songs = _resolve(*_songs)
         return api.Playlist(
             playlist_id=playlist_info['data']['specialid'],
@@ -392,7 +443,7 @@ class KuGou(api.API):
             raise exceptions.RequestError('get playlist info: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['errcode'] != 0:
                 raise exceptions.ResponseError('get playlist info: {}'.format(resp.get('error', resp['errcode'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -414,7 +465,7 @@ class KuGou(api.API):
             raise exceptions.RequestError('get playlist songs: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['errcode'] != 0:
                 raise exceptions.ResponseError('get playlist songs: {}'.format(resp.get('error', resp['errcode'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -428,7 +479,8 @@ class KuGou(api.API):
             'Referer': 'https://www.kugou.com',
             'User-Agent': api.USER_AGENT,
         }
+        headers.update(kwargs.get('headers') or {})
         kwargs.update({
             'headers': headers,
         })
-        return await self._session.request(method, url, **kwargs)
+        return await limiter.request(self._session, method, url, **kwargs)
@@ -8,6 +8,8 @@ import yarl
 from mxget import (
     api,
     exceptions,
+    jsonstream,
+    limiter,
 )
 
 _API_SEARCH = 'http://www.kuwo.cn/api/www/search/searchMusicBykeyWord'
@@ -19,6 +21,19 @@ _API_GET_ARTIST_SONGS = 'http://www.kuwo.cn/api/www/artist/artistMusic'
 _API_GET_ALBUM = 'http://www.kuwo.cn/api/www/album/albumInfo'
 _API_GET_PLAYLIST = 'http://www.kuwo.cn/api/www/playlist/playListInfo'
 
+_PLAYLIST_PATHS = (
+    'code',
+    'msg',
+    'data.id',
+    'data.name',
+    'data.img700',
+    'data.musicList.item.rid',
+    'data.musicList.item.name',
+    'data.musicList.item.artist',
+    'data.musicList.item.album',
+    'data.musicList.item.albumpic',
+)
+
 
 def _bit_rate(br: int) -> int:
     return {
@@ -37,6 +52,7 @@ def _resolve(*songs: dict) -> typing.List[api.Song]:
             album=song.get('album', '').strip(),
             pic_url=song.get('albumpic'),
             lyric=song.get('lyric'),
+            lyric_loader=song.get('lyric_loader'),
             url=song.get('url'),
         ) for song in songs
     ]
@@ -63,14 +79,22 @@ class KuWo(api.API):
         return api.PlatformId.KuWo
 
     async def search_songs(self, keyword: str) -> api.SearchSongsResult:
-        resp = await self.search_songs_raw(keyword)
+        songs, _ = await self.search_songs_page(keyword)
+        if not songs:
+            raise exceptions.DataError('search songs: no data')
+
+        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+
+    async def search_songs_page(self, keyword: str, page: int = 1, page_size: int = 50) -> api.Page:
+        resp = await self.search_songs_raw(keyword, page, page_size)
         try:
             _songs = resp['data']['list']
-        except KeyError:
-            raise exceptions.DataError('search songs: no data')
+            total = resp['data'].get('total')
+        except (KeyError, TypeError):
+            return [], None
 
         if not _songs:
-            raise exceptions.DataError('search songs: no data')
+            return [], total
 
         songs = [
             api.SearchSongsData(
@@ -80,7 +104,7 @@ class KuWo(api.API):
                 album=_song['album'].strip(),
             ) for _song in _songs
         ]
-        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+        return songs, total
 
     async def search_songs_raw(self, keyword: str, page: int = 1, page_size: int = 50) -> dict:
         params = {
@@ -95,7 +119,7 @@ class KuWo(api.API):
             raise exceptions.RequestError('search songs: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('search songs: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -111,7 +135,7 @@ class KuWo(api.API):
             raise exceptions.DataError('get song: no data')
 
         await self._patch_song_url(_song)
-        await self._patch_song_lyric(_song)
+        self._defer_song_lyric(_song)
         songs = _resolve(_song)
         return songs[0]
 
@@ -126,7 +150,7 @@ class KuWo(api.API):
             raise exceptions.RequestError('get song: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('get song: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -159,7 +183,7 @@ class KuWo(api.API):
             raise exceptions.RequestError('get song url: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('get song url: {}'.format(resp.get('msg', 'copyright protection')))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -200,7 +224,7 @@ class KuWo(api.API):
             raise exceptions.RequestError('get song lyric: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['status'] != 200:
                 raise exceptions.ResponseError('get song lyric: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -209,24 +233,15 @@ class KuWo(api.API):
         return resp
 
     async def _patch_song_url(self, *songs: dict) -> None:
-        sem = asyncio.Semaphore(32)
-
         async def worker(song: dict):
-            async with sem:
-                song['url'] = await self.get_song_url(song['rid'])
+            song['url'] = await self.get_song_url(song['rid'])
 
         tasks = [asyncio.ensure_future(worker(song)) for song in songs]
         await asyncio.gather(*tasks)
 
-    async def _patch_song_lyric(self, *songs: dict) -> None:
-        sem = asyncio.Semaphore(32)
-
-        async def worker(song: dict):
-            async with sem:
-                song['lyric'] = await self.get_song_lyric(song['rid'])
-
-        tasks = [asyncio.ensure_future(worker(song)) for song in songs]
-        await asyncio.gather(*tasks)
+    def _defer_song_lyric(self, *songs: dict) -> None:
+        for song in songs:
+            song['lyric_loader'] = api.lyric_loader(self.platform_id(), song['rid'], self.get_song_lyric, song['rid'])
 
     async def get_artist(self, singer_id: typing.Union[int, str]) -> api.Artist:
         artist_info = await self.get_artist_info_raw(singer_id)
@@ -241,9 +256,7 @@ class KuWo(api.API):
         if not _songs:
             raise exceptions.DataError('get artist: no data')
 
-        await self._patch_song_url(*_songs)
-        await self._patch_song_lyric(*_songs)
-        songs = _resolve(*_songs)
+        songs = await self._resolve_artist_songs(*_songs)
         return api.Artist(
             artist_id=artist['id'],
             name=artist['name'].strip(),
@@ -252,6 +265,26 @@ class KuWo(api.API):
             songs=songs,
         )
 
+    async def _resolve_artist_songs(self, *songs: dict) -> typing.List[api.Song]:
+        await self._patch_song_url(*songs)
+        self._defer_song_lyric(*songs)
+        return _resolve(*songs)
+
+    async def get_artist_songs_page(self, singer_id: typing.Union[int, str],
+                                    page: int = 1, page_size: int = 50) -> api.Page:
+        page_data = await self.get_artist_songs_raw(singer_id, page, page_size)
+        try:
+            _songs = page_data['data']['list']
+            total = page_data['data'].get('total')
+        except (KeyError, TypeError):
+            return [], None
+
+        if not _songs:
+            return [], total
+
+        songs = await self._resolve_artist_songs(*_songs)
+        return songs, total
+
     async def get_artist_info_raw(self, artist_id: typing.Union[int, str]) -> dict:
         params = {
             'artistid': artist_id,
@@ -263,7 +296,7 @@ class KuWo(api.API):
             raise exceptions.RequestError('get artist info: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('get artist info: {}'.format(resp.get('msg', 'no data')))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -285,7 +318,7 @@ class KuWo(api.API):
             raise exceptions.RequestError('get artist songs: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('get artist songs: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -306,7 +339,7 @@ class KuWo(api.API):
             raise exceptions.DataError('get album: no data')
 
         await self._patch_song_url(*_songs)
-        await self._patch_song_lyric(*_songs)
+        self._defer_song_lyric(*_songs)
         songs = _resolve(*_songs)
         return api.Album(
             album_id=album['albumId'],
@@ -330,7 +363,7 @@ class KuWo(api.API):
             raise exceptions.RequestError('get album: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('get album: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -339,7 +372,7 @@ class KuWo(api.API):
         return resp
 
     async def get_playlist(self, playlist_id: typing.Union[int, str]) -> api.Playlist:
-        resp = await self.get_playlist_raw(playlist_id)
+        resp = await self.get_playlist_raw(playlist_id, paths=_PLAYLIST_PATHS)
 
         try:
             playlist = resp['data']
@@ -351,7 +384,7 @@ class KuWo(api.API):
             raise exceptions.DataError('get playlist: no data')
 
         await self._patch_song_url(*_songs)
-        await self._patch_song_lyric(*_songs)
+        self._defer_song_lyric(*_songs)
         songs = _resolve(*_songs)
         return api.Playlist(
             playlist_id=playlist['id'],
@@ -361,8 +394,8 @@ class KuWo(api.API):
             songs=songs,
         )
 
-    async def get_playlist_raw(self, playlist_id: typing.Union[int, str],
-                               page: int = 1, page_size: int = 9999) -> dict:
+    async def get_playlist_raw(self, playlist_id: typing.Union[int, str], page: int = 1, page_size: int = 9999,
+                               paths: typing.Collection[str] = None) -> dict:
         params = {
             'pid': playlist_id,
             'pn': page,
@@ -375,7 +408,7 @@ class KuWo(api.API):
             raise exceptions.RequestError('get playlist: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body) if paths is None else await jsonstream.load(_resp, paths)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('get playlist: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -401,8 +434,9 @@ class KuWo(api.API):
             'Referer': 'http://www.kuwo.cn',
             'User-Agent': api.USER_AGENT,
         }
+        headers.update(kwargs.get('headers') or {})
         kwargs.update({
             'headers': headers,
         })
 
-        return await self._session.request(method, url, **kwargs)
+        return await limiter.request(self._session, method, url, **kwargs)
@@ -7,6 +7,7 @@ import aiohttp
 from mxget import (
     api,
     exceptions,
+    limiter,
 )
 
 _API_SEARCH = 'https://app.c.nf.migu.cn/MIGUM2.0/v1.0/content/search_all.do?isCopyright=1&isCorrect=1'
@@ -67,6 +68,7 @@ def _resolve(*songs: dict) -> typing.List[api.Song]:
             album=song.get('album', '').strip(),
             pic_url=song.get('pic_url'),
             lyric=song.get('lyric'),
+            lyric_loader=song.get('lyric_loader'),
             url=song.get('url'),
         ) for song in songs
     ]
@@ -93,14 +95,22 @@ class MiGu(api.API):
         return api.PlatformId.MiGu
 
     async def search_songs(self, keyword: str) -> api.SearchSongsResult:
-        resp = await self.search_songs_raw(keyword)
+        songs, _ = await self.search_songs_page(keyword)
+        if not songs:
+            raise exceptions.DataError('search songs: no data')
+
+        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+
+    async def search_songs_page(self, keyword: str, page: int = 1, page_size: int = 50) -> api.Page:
+        resp = await self.search_songs_raw(keyword, page, page_size)
         try:
             _songs = resp['songResultData']['result']
-        except KeyError:
-            raise exceptions.DataError('search songs: no data')
+            total = resp['songResultData'].get('totalCount')
+        except (KeyError, TypeError):
+            return [], None
 
         if not _songs:
-            raise exceptions.DataError('search songs: no data')
+            return [], total
 
         songs = [
             api.SearchSongsData(
@@ -110,7 +120,7 @@ class MiGu(api.API):
                 album='/'.join([a['name'].strip() for a in _song['albums']]) if _song.get('album') is not None else '',
             ) for _song in _songs
         ]
-        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+        return songs, total
 
     async def search_songs_raw(self, keyword: str, page: int = 1, page_size: int = 50) -> dict:
         switch_option = {
@@ -135,7 +145,7 @@ class MiGu(api.API):
             raise exceptions.RequestError('search songs: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != '000000':
                 raise exceptions.ResponseError('search songs: {}'.format(resp['info']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -162,7 +172,7 @@ class MiGu(api.API):
             raise exceptions.RequestError('get song id: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['returnCode'] != '000000':
                 raise exceptions.ResponseError('get song id: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -186,7 +196,7 @@ class MiGu(api.API):
         except (KeyError, IndexError):
             raise exceptions.DataError('get song: no data')
 
-        await self._patch_song_lyric(_song)
+        self._defer_song_lyric(_song)
         _patch_song_url(_song)
         _patch_song_info(_song)
         songs = _resolve(_song)
@@ -203,7 +213,7 @@ class MiGu(api.API):
             raise exceptions.RequestError('get song: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != '000000':
                 raise exceptions.ResponseError('get song: {}'.format(resp.get('error', resp['info'])))
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
@@ -224,7 +234,7 @@ class MiGu(api.API):
             raise exceptions.RequestError('get song url: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != '000000':
                 raise exceptions.ResponseError('get song url: {}'.format(resp['info']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -254,7 +264,7 @@ class MiGu(api.API):
             raise exceptions.RequestError('get song pic: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['returnCode'] != '000000':
                 raise exceptions.ResponseError('get song pic: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -281,7 +291,7 @@ class MiGu(api.API):
             raise exceptions.RequestError('get song lyric: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['returnCode'] != '000000':
                 raise exceptions.ResponseError('get song lyric: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -289,22 +299,19 @@ class MiGu(api.API):
 
         return resp
 
-    async def _patch_song_lyric(self, *songs: dict) -> None:
-        sem = asyncio.Semaphore(32)
-
-        async def worker(song: dict):
-            async with sem:
-                lrc_url = song.get('lrcUrl', '')
-                if not lrc_url:
-                    return
-                try:
-                    resp = await self.request('GET', lrc_url)
-                    song['lyric'] = await resp.text()
-                except (aiohttp.ClientError, asyncio.TimeoutError):
-                    pass
+    async def _fetch_lyric(self, lrc_url: str) -> typing.Optional[str]:
+        try:
+            resp = await self.request('GET', lrc_url)
+            lyric = await resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+        return lyric if lyric else None
 
-        tasks = [asyncio.ensure_future(worker(song)) for song in songs]
-        await asyncio.gather(*tasks)
+    def _defer_song_lyric(self, *songs: dict) -> None:
+        for song in songs:
+            lrc_url = song.get('lrcUrl', '')
+            if lrc_url:
+                song['lyric_loader'] = api.lyric_loader(self.platform_id(), lrc_url, self._fetch_lyric, lrc_url)
 
     async def get_artist(self, singer_id: typing.Union[int, str]) -> api.Artist:
         artist_info = await self.get_artist_info_raw(singer_id)
@@ -319,11 +326,7 @@ class MiGu(api.API):
         if not item_list:
             raise exceptions.DataError('get artist: no data')
 
-        _songs = [v['song'] for i, v in enumerate(item_list) if i % 2 == 0]
-        await self._patch_song_lyric(*_songs)
-        _patch_song_url(*_songs)
-        _patch_song_info(*_songs)
-        songs = _resolve(*_songs)
+        songs = self._resolve_artist_songs(*item_list)
         return api.Artist(
             artist_id=artist['singerId'],
             name=artist['singer'].strip(),
@@ -332,6 +335,34 @@ class MiGu(api.API):
             songs=songs,
         )
 
+    def _resolve_artist_songs(self, *item_list: dict) -> typing.List[api.Song]:
+        songs = [v['song'] for i, v in enumerate(item_list) if i % 2 == 0]
+        self._defer_song_lyric(*songs)
+        _patch_song_url(*songs)
+        _patch_song_info(*songs)
+        return _resolve(*songs)
+
+    async def get_artist_songs_page(self, singer_id: typing.Union[int, str],
+                                    page: int = 1, page_size: int = 20) -> api.Page:
+        try:
+            page_data = await self.get_artist_songs_raw(singer_id, page, page_size)
+        except exceptions.ResponseError:
+            # past the last page MiGu answers with an error code instead of an empty list
+            if page > 1:
+                return [], None
+            raise
+
+        try:
+            data = page_data['data']
+            item_list = data['contentItemList'][0]['itemList']
+        except (KeyError, IndexError, TypeError):
+            return [], None
+
+        if not item_list:
+            return [], None
+
+        return self._resolve_artist_songs(*item_list), data.get('totalCount')
+
     async def get_artist_info_raw(self, singer_id: typing.Union[int, str]) -> dict:
         params = {
             'resourceId': singer_id,
@@ -343,7 +374,7 @@ class MiGu(api.API):
             raise exceptions.RequestError('get artist info: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != '000000':
                 raise exceptions.ResponseError('get artist info: {}'.format(resp['info']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -365,7 +396,7 @@ class MiGu(api.API):
             raise exceptions.RequestError('get artist songs: {}'.format(e))
 
         try:
-            resp = await resp.json(content_type=None)
+            resp = await api.read_json(resp, self.keep_body)
             if resp['code'] != '000000':
                 raise exceptions.ResponseError('get artist songs: {}'.format(resp['info']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -385,7 +416,7 @@ class MiGu(api.API):
         if not _songs:
             raise exceptions.DataError('get album: no data')
 
-        await self._patch_song_lyric(*_songs)
+        self._defer_song_lyric(*_songs)
         _patch_song_url(*_songs)
         _patch_song_info(*_songs)
         songs = _resolve(*_songs)
@@ -408,7 +439,7 @@ class MiGu(api.API):
             raise exceptions.RequestError('get album: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != '000000':
                 raise exceptions.ResponseError('get album: {}'.format(resp.get('error', resp['errcode'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -428,7 +459,7 @@ class MiGu(api.API):
         if not _songs:
             raise exceptions.DataError('get playlist: no data')
 
-        await self._patch_song_lyric(*_songs)
+        self._defer_song_lyric(*_songs)
         _patch_song_url(*_songs)
         _patch_song_info(*_songs)
         songs = _resolve(*_songs)
@@ -451,7 +482,7 @@ class MiGu(api.API):
             raise exceptions.RequestError('get playlist: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != '000000':
                 raise exceptions.ResponseError('get playlist: {}'.format(resp['info']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -466,7 +497,8 @@ class MiGu(api.API):
             'Referer': 'http://music.migu.cn/v3',
             'User-Agent': api.USER_AGENT,
         }
+        headers.update(kwargs.get('headers') or {})
         kwargs.update({
             'headers': headers,
         })
-        return await self._session.request(method, url, **kwargs)
+        return await limiter.request(self._session, method, url, **kwargs)
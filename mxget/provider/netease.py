@@ -3,6 +3,7 @@ import base64
 import binascii
 import hashlib
 import json
+import logging
 import os
 import typing
 
@@ -13,6 +14,8 @@ from mxget import (
     crypto,
     api,
     exceptions,
+    jsonstream,
+    limiter,
 )
 
 _PRESET_KEY = b'0CoJUm6Qyw8W8jud'
@@ -34,6 +37,23 @@ _API_GET_ALBUM = 'https://music.163.com/weapi/v1/album/{album_id}'
 _API_GET_PLAYLIST = 'https://music.163.com/weapi/v3/playlist/detail'
 
 _SONG_REQUEST_LIMIT = 1000
+_SONG_URL_REQUEST_LIMIT = 500
+_CHUNK_CONCURRENCY = 4
+
+_PLAYLIST_PATHS = (
+    'code',
+    'msg',
+    'playlist.id',
+    'playlist.name',
+    'playlist.coverImgUrl',
+    'playlist.trackCount',
+    'playlist.trackIds.item.id',
+    'playlist.tracks.item.id',
+    'playlist.tracks.item.name',
+    'playlist.tracks.item.ar.item.name',
+    'playlist.tracks.item.al.name',
+    'playlist.tracks.item.al.picUrl',
+)
 
 
 def _create_secret_key(size: int) -> bytes:
@@ -46,17 +66,26 @@ def _create_cookies() -> dict:
     }
 
 
-def _weapi(orig_data: dict = None) -> dict:
+def _create_key_pool(size: int) -> crypto.RSAKeyPool:
+    return crypto.RSAKeyPool(_DEFAULT_RSA_PUBLIC_KEY_MODULES, _DEFAULT_RSA_PUBLIC_KEY_EXPONENT,
+                             lambda: _create_secret_key(16), size=size, reverse=True)
+
+
+def _weapi(orig_data: dict = None, key_pool: crypto.RSAKeyPool = None) -> dict:
     if orig_data is None:
         orig_data = {}
     plain_text = json.dumps(orig_data)
     params = base64.b64encode(crypto.aes_cbc_encrypt(plain_text.encode('utf-8'), _PRESET_KEY, _IV))
-    sec_key = _create_secret_key(16)
+    if key_pool is not None:
+        sec_key, enc_sec_key = key_pool.get()
+    else:
+        sec_key = _create_secret_key(16)
+        enc_sec_key = crypto.rsa_encrypt(sec_key[::-1], _DEFAULT_RSA_PUBLIC_KEY_MODULES,
+                                         _DEFAULT_RSA_PUBLIC_KEY_EXPONENT)
     params = base64.b64encode(crypto.aes_cbc_encrypt(params, sec_key, _IV))
     return {
         'params': params.decode('utf-8'),
-        'encSecKey': crypto.rsa_encrypt(sec_key[::-1], _DEFAULT_RSA_PUBLIC_KEY_MODULES,
-                                        _DEFAULT_RSA_PUBLIC_KEY_EXPONENT),
+        'encSecKey': enc_sec_key,
     }
 
 
@@ -81,6 +110,22 @@ def _eapi(url: str, orig_data: dict = None) -> dict:
     }
 
 
+def _chunks(items: typing.Sequence, size: int) -> typing.List[typing.Sequence]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+async def _gather(*coros: typing.Awaitable) -> None:
+    """Like ``asyncio.gather``, but cancels the rest once one of them fails."""
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
 def _bit_rate(br: int) -> int:
     br = {
         128: 128,
@@ -101,19 +146,24 @@ def _resolve(*songs: dict) -> typing.List[api.Song]:
             album=song['al']['name'].strip(),
             pic_url=song['al']['picUrl'],
             lyric=song.get('lyric'),
+            lyric_loader=song.get('lyric_loader'),
             url=song.get('url'),
         ) for song in songs
     ]
 
 
 class NetEase(api.API):
-    def __init__(self, session: aiohttp.ClientSession = None):
+    def __init__(self, session: aiohttp.ClientSession = None, url_batch_size: int = _SONG_URL_REQUEST_LIMIT,
+                 chunk_concurrency: int = _CHUNK_CONCURRENCY, key_pool_size: int = 0):
         if session is None:
             session = aiohttp.ClientSession(
                 timeout=aiohttp.ClientTimeout(total=120),
             )
         self._session = session
         self._cookies = _create_cookies()
+        self._url_batch_size = max(1, url_batch_size)
+        self._chunk_concurrency = max(1, chunk_concurrency)
+        self._key_pool = _create_key_pool(key_pool_size) if key_pool_size > 0 else None
 
     async def close(self):
         await self._session.close()
@@ -128,14 +178,22 @@ class NetEase(api.API):
         return api.PlatformId.NetEase
 
     async def search_songs(self, keyword: str) -> api.SearchSongsResult:
-        resp = await self.search_songs_raw(keyword)
+        songs, _ = await self.search_songs_page(keyword)
+        if not songs:
+            raise exceptions.DataError('search songs: no data')
+
+        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+
+    async def search_songs_page(self, keyword: str, page: int = 1, page_size: int = 50) -> api.Page:
+        resp = await self.search_songs_raw(keyword, (page - 1) * page_size, page_size)
         try:
             songs = resp['result']['songs']
-        except KeyError:
-            raise exceptions.DataError('search songs: no data')
+            total = resp['result'].get('songCount')
+        except (KeyError, TypeError):
+            return [], None
 
         if not songs:
-            raise exceptions.DataError('search songs: no data')
+            return [], total
 
         songs = [
             api.SearchSongsData(
@@ -145,7 +203,7 @@ class NetEase(api.API):
                 album=song['album']['name'].strip(),
             ) for song in songs
         ]
-        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+        return songs, total
 
     async def search_songs_raw(self, keyword: str, offset: int = 0, limit: int = 50) -> dict:
         data = {
@@ -156,12 +214,12 @@ class NetEase(api.API):
         }
 
         try:
-            _resp = await self.request('POST', _API_SEARCH, data=_weapi(data))
+            _resp = await self.request('POST', _API_SEARCH, data=_weapi(data, self._key_pool))
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             raise exceptions.RequestError('search songs: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('search songs: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -177,7 +235,7 @@ class NetEase(api.API):
             raise exceptions.DataError('get song: no data')
 
         await self._patch_song_url(_song)
-        await self._patch_song_lyric(_song)
+        self._defer_song_lyric(_song)
         songs = _resolve(_song)
         return songs[0]
 
@@ -191,12 +249,12 @@ class NetEase(api.API):
         }
 
         try:
-            _resp = await self.request('POST', _API_GET_SONGS, data=_weapi(data))
+            _resp = await self.request('POST', _API_GET_SONGS, data=_weapi(data, self._key_pool))
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             raise exceptions.RequestError('get songs: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('get songs: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -220,12 +278,12 @@ class NetEase(api.API):
         }
 
         try:
-            _resp = await self.request('POST', _API_GET_SONGS_URL, data=_weapi(data))
+            _resp = await self.request('POST', _API_GET_SONGS_URL, data=_weapi(data, self._key_pool))
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             raise exceptions.RequestError('get songs url: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('get songs url: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -256,7 +314,7 @@ class NetEase(api.API):
             raise exceptions.RequestError('get song lyric: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('get song lyric: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -264,29 +322,30 @@ class NetEase(api.API):
 
         return resp
 
-    async def _patch_song_url(self, *songs: dict) -> None:
-        song_ids = [s['id'] for s in songs]
-        resp = await self.get_songs_url_raw(*song_ids)
-        if resp.get('data') is None:
-            return
+    async def _patch_song_url(self, *songs: dict, sem: asyncio.Semaphore = None) -> None:
+        """
+        Look up song URLs in batches of ``url_batch_size``, at most ``chunk_concurrency``
+        requests at a time; pass ``sem`` to share that bound with other requests.
+        """
+        if sem is None:
+            sem = asyncio.Semaphore(self._chunk_concurrency)
 
-        url_map = dict()
-        for i in resp['data']:
-            if i.get('code') == 200:
-                url_map[i['id']] = i['url']
+        async def patch(chunk: typing.Sequence[dict]):
+            async with sem:
+                resp = await self.get_songs_url_raw(*[s['id'] for s in chunk])
+            url_map = dict()
+            for i in resp.get('data') or []:
+                if i.get('code') == 200:
+                    url_map[i['id']] = i['url']
 
-        for s in songs:
-            s['url'] = url_map.get(s['id'])
+            for s in chunk:
+                s['url'] = url_map.get(s['id'])
 
-    async def _patch_song_lyric(self, *songs: dict) -> None:
-        sem = asyncio.Semaphore(32)
+        await _gather(*[patch(chunk) for chunk in _chunks(songs, self._url_batch_size)])
 
-        async def worker(song: dict):
-            async with sem:
-                song['lyric'] = await self.get_song_lyric(song['id'])
-
-        tasks = [asyncio.ensure_future(worker(song)) for song in songs]
-        await asyncio.gather(*tasks)
+    def _defer_song_lyric(self, *songs: dict) -> None:
+        for song in songs:
+            song['lyric_loader'] = api.lyric_loader(self.platform_id(), song['id'], self.get_song_lyric, song['id'])
 
     async def get_artist(self, artist_id: typing.Union[int, str]) -> api.Artist:
         resp = await self.get_artist_raw(artist_id)
@@ -299,7 +358,7 @@ class NetEase(api.API):
             raise exceptions.DataError('get artist: no data')
 
         await self._patch_song_url(*_songs)
-        await self._patch_song_lyric(*_songs)
+        self._defer_song_lyric(*_songs)
         songs = _resolve(*_songs)
         return api.Artist(
             artist_id=resp['artist']['id'],
@@ -311,12 +370,13 @@ class NetEase(api.API):
 
     async def get_artist_raw(self, artist_id: typing.Union[int, str]) -> dict:
         try:
-            _resp = await self.request('POST', _API_GET_ARTIST.format(artist_id=artist_id), data=_weapi())
+            _resp = await self.request('POST', _API_GET_ARTIST.format(artist_id=artist_id),
+                                       data=_weapi(key_pool=self._key_pool))
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             raise exceptions.RequestError('get artist: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('get artist: {}'.format(resp.get('msg', resp['code'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -335,7 +395,7 @@ class NetEase(api.API):
             raise exceptions.DataError('get album: no data')
 
         await self._patch_song_url(*_songs)
-        await self._patch_song_lyric(*_songs)
+        self._defer_song_lyric(*_songs)
         songs = _resolve(*_songs)
         return api.Album(
             album_id=resp['album']['id'],
@@ -347,12 +407,13 @@ class NetEase(api.API):
 
     async def get_album_raw(self, album_id: typing.Union[int, str]) -> dict:
         try:
-            _resp = await self.request('POST', _API_GET_ALBUM.format(album_id=album_id), data=_weapi())
+            _resp = await self.request('POST', _API_GET_ALBUM.format(album_id=album_id),
+                                       data=_weapi(key_pool=self._key_pool))
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             raise exceptions.RequestError('get album: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('get album: {}'.format(resp.get('msg', resp['code'])))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -361,7 +422,7 @@ class NetEase(api.API):
         return resp
 
     async def get_playlist(self, playlist_id: typing.Union[int, str]) -> api.Playlist:
-        resp = await self.get_playlist_raw(playlist_id)
+        resp = await self.get_playlist_raw(playlist_id, _PLAYLIST_PATHS)
         try:
             total = resp['playlist']['trackCount']
             tracks = resp['playlist']['tracks']
@@ -372,25 +433,27 @@ class NetEase(api.API):
         if total == 0:
             raise exceptions.DataError('get playlist: no data')
 
-        if total > _SONG_REQUEST_LIMIT:
-            song_ids = [track_ids[i]['id'] for i in range(_SONG_REQUEST_LIMIT, total)]
+        extra_ids = [t['id'] for t in track_ids[_SONG_REQUEST_LIMIT:total]]
+        chunks = _chunks(extra_ids, _SONG_REQUEST_LIMIT)
+        pages = [tracks] + [[] for _ in chunks]
 
-            async def patch_tracks(*ids: typing.Union[int, str]):
-                return await self.get_songs_raw(*ids)
+        # song details and URL lookups of all pages share one bound; a failed page is skipped
+        sem = asyncio.Semaphore(self._chunk_concurrency)
 
-            extra = total - _SONG_REQUEST_LIMIT
-            tasks = []
-            for i in range(0, extra, _SONG_REQUEST_LIMIT):
-                _ids = song_ids[i:min(i + _SONG_REQUEST_LIMIT, extra)]
-                tasks.append(asyncio.ensure_future(patch_tracks(*_ids)))
+        async def patch_page(i: int):
+            try:
+                if i > 0:
+                    async with sem:
+                        data = await self.get_songs_raw(*chunks[i - 1])
+                    pages[i] = data.get('songs', [])
+                await self._patch_song_url(*pages[i], sem=sem)
+            except exceptions.ClientError as e:
+                logging.warning('get playlist: page {} incomplete: {}'.format(i, e))
 
-            await asyncio.gather(*tasks)
-            for task in tasks:
-                if not task.exception():
-                    tracks.extend(task.result().get('songs', []))
+        await asyncio.gather(*[patch_page(i) for i in range(len(pages))])
+        tracks = [track for page in pages for track in page]
 
-        await self._patch_song_url(*tracks)
-        await self._patch_song_lyric(*tracks)
+        self._defer_song_lyric(*tracks)
         songs = _resolve(*tracks)
         return api.Playlist(
             playlist_id=resp['playlist']['id'],
@@ -400,19 +463,20 @@ class NetEase(api.API):
             songs=songs,
         )
 
-    async def get_playlist_raw(self, playlist_id: typing.Union[int, str]) -> dict:
+    async def get_playlist_raw(self, playlist_id: typing.Union[int, str],
+                               paths: typing.Collection[str] = None) -> dict:
         data = {
             'id': playlist_id,
             'n': 100000,
         }
 
         try:
-            _resp = await self.request('POST', _API_GET_PLAYLIST, data=_weapi(data), ssl=False)
+            _resp = await self.request('POST', _API_GET_PLAYLIST, data=_weapi(data, self._key_pool), ssl=False)
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             raise exceptions.RequestError('get playlist: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body) if paths is None else await jsonstream.load(_resp, paths)
             if resp['code'] != 200:
                 raise exceptions.ResponseError('get playlist: {}'.format(resp['msg']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -426,6 +490,7 @@ class NetEase(api.API):
             'Referer': 'https://music.163.com',
             'User-Agent': api.USER_AGENT,
         }
+        headers.update(kwargs.get('headers') or {})
         kwargs.update({
             "headers": headers,
         })
@@ -436,4 +501,4 @@ class NetEase(api.API):
                 'cookies': self._cookies
             })
 
-        return await self._session.request(method, url, **kwargs)
+        return await limiter.request(self._session, method, url, **kwargs)
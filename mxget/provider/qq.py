@@ -6,13 +6,16 @@ import aiohttp
 
 from mxget import (
     api,
+    cache,
     exceptions,
+    limiter,
 )
 
 _API_SEARCH = 'https://c.y.qq.com/soso/fcgi-bin/client_search_cp?format=json&platform=yqq&new_json=1'
 _API_GET_SONG = 'https://c.y.qq.com/v8/fcg-bin/fcg_play_single_song.fcg?format=json&platform=yqq'
 _API_GET_SONG_URL = 'http://c.y.qq.com/base/fcgi-bin/fcg_music_express_mobile3.fcg?' \
                     'format=json&platform=yqq&needNewCode=0&cid=205361747&uin=0&guid=0'
+_API_GET_SONGS_URL = 'https://u.y.qq.com/cgi-bin/musicu.fcg'
 _API_GET_SONG_LYRIC = 'https://c.y.qq.com/lyric/fcgi-bin/fcg_query_lyric_new.fcg?format=json&platform=yqq&nobase64=1'
 _API_GET_ARTIST = 'https://c.y.qq.com/v8/fcg-bin/fcg_v8_singer_track_cp.fcg?' \
                   'format=json&platform=yqq&newsong=1&order=listen'
@@ -23,6 +26,16 @@ _SONG_URL = 'http://mobileoc.music.tc.qq.com/{filename}?guid=0&uin=0&vkey={vkey}
 _ARTIST_PIC_URL = 'https://y.gtimg.cn/music/photo_new/T001R800x800M000{singer_mid}.jpg'
 _ALBUM_PIC_URL = 'https://y.gtimg.cn/music/photo_new/T002R800x800M000{album_mid}.jpg'
 
+_SONG_URL_REQUEST_LIMIT = 100
+_VKEY_TTL = 3600
+_VKEY_EXPIRY_MARGIN = 300
+
+_url_cache = cache.TTLCache(maxsize=4096)
+
+
+def _song_filename(media_mid: str) -> str:
+    return 'M500' + media_mid + '.mp3'
+
 
 def _resolve(*songs: dict) -> typing.List[api.Song]:
     return [
@@ -33,6 +46,7 @@ def _resolve(*songs: dict) -> typing.List[api.Song]:
             album=song['album']['name'].strip(),
             pic_url=_ALBUM_PIC_URL.format(album_mid=song['album']['mid']),
             lyric=song.get('lyric'),
+            lyric_loader=song.get('lyric_loader'),
             url=song.get('url'),
         ) for song in songs
     ]
@@ -59,14 +73,22 @@ class QQ(api.API):
         return api.PlatformId.QQ
 
     async def search_songs(self, keyword: str) -> api.SearchSongsResult:
-        resp = await self.search_songs_raw(keyword)
+        songs, _ = await self.search_songs_page(keyword)
+        if not songs:
+            raise exceptions.DataError('search songs: no data')
+
+        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+
+    async def search_songs_page(self, keyword: str, page: int = 1, page_size: int = 50) -> api.Page:
+        resp = await self.search_songs_raw(keyword, page, page_size)
         try:
             _songs = resp['data']['song']['list']
-        except KeyError:
-            raise exceptions.DataError('search songs: no data')
+            total = resp['data']['song'].get('totalnum')
+        except (KeyError, TypeError):
+            return [], None
 
         if not _songs:
-            raise exceptions.DataError('search songs: no data')
+            return [], total
 
         songs = [
             api.SearchSongsData(
@@ -76,7 +98,7 @@ class QQ(api.API):
                 album=_song['album']['name'].strip(),
             ) for _song in _songs
         ]
-        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+        return songs, total
 
     async def search_songs_raw(self, keyword: str, page: int = 1, page_size: int = 50) -> dict:
         params = {
@@ -91,7 +113,7 @@ class QQ(api.API):
             raise exceptions.RequestError('search songs: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 0:
                 raise exceptions.ResponseError('search songs: {}'.format(resp['code']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -107,7 +129,7 @@ class QQ(api.API):
             raise exceptions.DataError('get song: no data')
 
         await self._patch_song_url(_song)
-        await self._patch_song_lyric(_song)
+        self._defer_song_lyric(_song)
         songs = _resolve(_song)
         return songs[0]
 
@@ -122,7 +144,7 @@ class QQ(api.API):
             raise exceptions.RequestError('get song: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 0:
                 raise exceptions.ResponseError('get song: {}'.format(resp['code']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -145,7 +167,7 @@ class QQ(api.API):
     async def get_song_url_raw(self, song_mid: str, media_mid: str) -> dict:
         params = {
             'songmid': song_mid,
-            'filename': 'M500' + media_mid + '.mp3',
+            'filename': _song_filename(media_mid),
         }
 
         try:
@@ -154,7 +176,7 @@ class QQ(api.API):
             raise exceptions.RequestError('get song url: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 0:
                 raise exceptions.ResponseError('get song url: {}'.format(resp.get('errinfo', 'copyright protection')))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -182,7 +204,7 @@ class QQ(api.API):
             raise exceptions.RequestError('get song lyric: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 0:
                 raise exceptions.ResponseError('get song lyric: {}'.format(resp['code']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -190,26 +212,101 @@ class QQ(api.API):
 
         return resp
 
-    async def _patch_song_url(self, *songs: dict) -> None:
-        sem = asyncio.Semaphore(32)
+    async def get_songs_url(self, song_mids: typing.Sequence[str],
+                            media_mids: typing.Sequence[str]) -> typing.Dict[str, str]:
+        try:
+            resp = await self.get_songs_url_raw(song_mids, media_mids)
+            data = resp['req_0']['data']
+            items = data['midurlinfo']
+        except (exceptions.RequestError, exceptions.ResponseError, KeyError):
+            return {}
 
-        async def worker(song: dict):
-            async with sem:
-                song['url'] = await self.get_song_url(song['mid'], song['file']['media_mid'])
+        try:
+            ttl = max(0, int(data['expiration']) - _VKEY_EXPIRY_MARGIN)
+        except (KeyError, TypeError, ValueError):
+            ttl = _VKEY_TTL
+
+        urls = {}
+        for item in items:
+            if not item.get('purl') or not item.get('vkey'):
+                continue
+            filename = item.get('filename') or _song_filename(item.get('songmid', ''))
+            url = _SONG_URL.format(filename=filename, vkey=item['vkey'])
+            _url_cache.set(filename, url, ttl=ttl)
+            urls[item['songmid']] = url
+        return urls
+
+    async def get_songs_url_raw(self, song_mids: typing.Sequence[str], media_mids: typing.Sequence[str]) -> dict:
+        data = {
+            'req_0': {
+                'module': 'vkey.GetVkeyServer',
+                'method': 'CgiGetVkey',
+                'param': {
+                    'guid': '0',
+                    'songmid': list(song_mids),
+                    'songtype': [0] * len(song_mids),
+                    'filename': [_song_filename(media_mid) for media_mid in media_mids],
+                    'uin': '0',
+                    'loginflag': 1,
+                    'platform': '20',
+                },
+            },
+            'comm': {
+                'uin': 0,
+                'format': 'json',
+                'ct': 24,
+                'cv': 0,
+            },
+        }
 
-        tasks = [asyncio.ensure_future(worker(song)) for song in songs]
-        await asyncio.gather(*tasks)
+        try:
+            _resp = await self.request('POST', _API_GET_SONGS_URL, data=json.dumps(data))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise exceptions.RequestError('get songs url: {}'.format(e))
+
+        try:
+            resp = await api.read_json(_resp, self.keep_body)
+            if resp['code'] != 0 or resp['req_0']['code'] != 0:
+                raise exceptions.ResponseError('get songs url: {}'.format(resp['req_0']['code']))
+        except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
+            raise exceptions.ResponseError('get songs url: {}'.format(e))
 
-    async def _patch_song_lyric(self, *songs: dict) -> None:
-        sem = asyncio.Semaphore(32)
+        return resp
 
-        async def worker(song: dict):
-            async with sem:
-                song['lyric'] = await self.get_song_lyric(song['mid'])
+    async def _patch_song_url(self, *songs: dict) -> None:
+        pending = []
+        for song in songs:
+            media_mid = song.get('file', {}).get('media_mid')
+            if not media_mid:
+                continue
+            url = _url_cache.get(_song_filename(media_mid))
+            if url is not None:
+                song['url'] = url
+            else:
+                pending.append(song)
+
+        async def patch_batch(batch: typing.List[dict]):
+            urls = await self.get_songs_url([s['mid'] for s in batch], [s['file']['media_mid'] for s in batch])
+            for song in batch:
+                song['url'] = urls.get(song['mid'])
+
+        async def patch_song(song: dict):
+            media_mid = song['file']['media_mid']
+            song['url'] = await self.get_song_url(song['mid'], media_mid)
+            if song['url'] is not None:
+                _url_cache.set(_song_filename(media_mid), song['url'], ttl=_VKEY_TTL)
+
+        batches = [pending[i:i + _SONG_URL_REQUEST_LIMIT] for i in range(0, len(pending), _SONG_URL_REQUEST_LIMIT)]
+        tasks = [asyncio.ensure_future(patch_batch(batch)) for batch in batches]
+        await asyncio.gather(*tasks)
 
-        tasks = [asyncio.ensure_future(worker(song)) for song in songs]
+        tasks = [asyncio.ensure_future(patch_song(song)) for song in pending if song.get('url') is None]
         await asyncio.gather(*tasks)
 
+    def _defer_song_lyric(self, *songs: dict) -> None:
+        for song in songs:
+            song['lyric_loader'] = api.lyric_loader(self.platform_id(), song['mid'], self.get_song_lyric, song['mid'])
+
     async def get_artist(self, singer_mid: str) -> api.Artist:
         resp = await self.get_artist_raw(singer_mid)
         try:
@@ -223,7 +320,7 @@ class QQ(api.API):
 
         _songs = [i['musicData'] for i in items]
         await self._patch_song_url(*_songs)
-        await self._patch_song_lyric(*_songs)
+        self._defer_song_lyric(*_songs)
         songs = _resolve(*_songs)
         return api.Artist(
             artist_id=artist['singer_mid'],
@@ -246,7 +343,7 @@ class QQ(api.API):
             raise exceptions.RequestError('get artist: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 0:
                 raise exceptions.ResponseError('get artist: {}'.format(resp['code']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -266,7 +363,7 @@ class QQ(api.API):
             raise exceptions.DataError('get album: no data')
 
         await self._patch_song_url(*_songs)
-        await self._patch_song_lyric(*_songs)
+        self._defer_song_lyric(*_songs)
         songs = _resolve(*_songs)
         return api.Album(
             album_id=album['Falbum_mid'],
@@ -287,7 +384,7 @@ class QQ(api.API):
             raise exceptions.RequestError('get album: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 0:
                 raise exceptions.ResponseError('get album: {}'.format(resp['code']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -307,7 +404,8 @@ class QQ(api.API):
         if not _songs:
             raise exceptions.DataError('get playlist: no data')
 
-        await self._patch_song_lyric(*_songs)
+        await self._patch_song_url(*_songs)
+        self._defer_song_lyric(*_songs)
         songs = _resolve(*_songs)
         return api.Playlist(
             playlist_id=playlist['disstid'],
@@ -328,7 +426,7 @@ class QQ(api.API):
             raise exceptions.RequestError('get playlist: {}'.format(e))
 
         try:
-            resp = await _resp.json(content_type=None)
+            resp = await api.read_json(_resp, self.keep_body)
             if resp['code'] != 0:
                 raise exceptions.ResponseError('get playlist: {}'.format(resp['code']))
         except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
@@ -342,7 +440,8 @@ class QQ(api.API):
             'Referer': 'https://c.y.qq.com',
             'User-Agent': api.USER_AGENT,
         }
+        headers.update(kwargs.get('headers') or {})
         kwargs.update({
             'headers': headers,
         })
-        return await self._session.request(method, url, **kwargs)
+        return await limiter.request(self._session, method, url, **kwargs)
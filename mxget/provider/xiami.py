@@ -10,6 +10,8 @@ import yarl
 from mxget import (
     api,
     exceptions,
+    limiter,
+    pager,
 )
 
 _API_SEARCH = "https://acs.m.xiami.com/h5/mtop.alimusic.search.searchservice.searchsongs" \
@@ -38,6 +40,12 @@ _REQ_HEADER = {
 _APP_KEY = '23649156'
 
 _SONG_REQUEST_LIMIT = 200
+_PAGE_LOOKAHEAD = 4
+
+_TOKEN_COOKIE = '_m_h5_tk'
+_TOKEN_DEFAULT_TTL = 3600
+_TOKEN_REFRESH_MARGIN = 60
+_TOKEN_ERRORS = ('FAIL_SYS_TOKEN_EXOIRED', 'FAIL_SYS_TOKEN_EMPTY', 'FAIL_SYS_TOKEN_ILLEGAL')
 
 
 def _sign_payload(token: str, model: typing.Any) -> dict:
@@ -65,6 +73,94 @@ def _check(ret: typing.List[str], msg: str):
             raise exceptions.ResponseError('{}: {}'.format(msg, s))
 
 
+def _token_rejected(ret: typing.List[str]) -> bool:
+    return any(s.startswith(_TOKEN_ERRORS) for s in ret)
+
+
+def _parse_token(value: str) -> typing.Tuple[str, float]:
+    token, _, expiry = value.partition('_')
+    try:
+        expires = int(expiry) / 1000
+    except ValueError:
+        expires = time.time() + _TOKEN_DEFAULT_TTL
+    return token, expires
+
+
+class _TokenManager:
+    """
+    Keeps the mtop ``_m_h5_tk`` token of one session. Concurrent callers share a
+    single bootstrap request, and the token is refreshed in the background shortly
+    before the expiry embedded in the cookie value.
+    """
+
+    def __init__(self, client: 'XiaMi'):
+        self._client = client
+        self._token = None
+        self._expires = 0.0
+        self._refresh_after = 0.0
+        self._pending = None
+        self._bootstrapped = False
+
+    def update(self, value: str) -> None:
+        token, expires = _parse_token(value)
+        if token:
+            self._token = token
+            self._expires = expires
+            self._refresh_after = expires - _TOKEN_REFRESH_MARGIN
+
+    def observe(self, resp: aiohttp.ClientResponse) -> None:
+        cookie = resp.cookies.get(_TOKEN_COOKIE)
+        if cookie is not None and cookie.value:
+            self.update(cookie.value)
+
+    def invalidate(self, token: str) -> None:
+        if token == self._token:
+            self._token = None
+
+    def _valid(self) -> bool:
+        return self._token is not None and time.time() < self._expires
+
+    async def get(self, url: str) -> typing.Optional[str]:
+        if self._valid() and time.time() < self._refresh_after:
+            return self._token
+
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._refresh(url))
+        if self._valid():
+            return self._token
+        return await asyncio.shield(self._pending)
+
+    async def _refresh(self, url: str) -> typing.Optional[str]:
+        try:
+            if not self._bootstrapped:
+                self._bootstrapped = True
+                cookie = self._client._session.cookie_jar.filter_cookies(yarl.URL(url)).get(_TOKEN_COOKIE)
+                if cookie is not None and cookie.value:
+                    self.update(cookie.value)
+                if self._valid() and time.time() < self._refresh_after:
+                    return self._token
+
+            token = self._token
+            try:
+                resp = await self._client.request('GET', url)
+                self.observe(resp)
+                resp.release()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+
+            if self._token is not None and self._token == token:
+                # upstream kept the current token, use it until it really expires
+                self._refresh_after = self._expires
+            return self._token if self._valid() else None
+        finally:
+            self._pending = None
+
+    def close(self) -> None:
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+
+
 def _song_url(listen_files: typing.List[dict]) -> typing.Optional[str]:
     for i in listen_files:
         if i.get('quality') == 'l':
@@ -82,6 +178,7 @@ def _resolve(*songs: dict) -> typing.List[api.Song]:
             album=song.get('albumName', '').strip(),
             pic_url=song.get('albumLogo'),
             lyric=song.get('lyric'),
+            lyric_loader=song.get('lyric_loader'),
             url=_song_url(song['listenFiles']),
         ) for song in songs
     ]
@@ -94,8 +191,10 @@ class XiaMi(api.API):
                 timeout=aiohttp.ClientTimeout(total=120),
             )
         self._session = session
+        self._tokens = _TokenManager(self)
 
     async def close(self):
+        self._tokens.close()
         await self._session.close()
 
     async def __aenter__(self):
@@ -107,22 +206,48 @@ class XiaMi(api.API):
     def platform_id(self) -> api.PlatformId:
         return api.PlatformId.XiaMi
 
-    async def _get_token(self, url: str) -> str:
-        xm_tk = self._session.cookie_jar.filter_cookies(yarl.URL(url)).get('_m_h5_tk')
-        if xm_tk is None:
-            resp = await self.request('GET', url)
-            xm_tk = resp.cookies.get('_m_h5_tk')
-        return xm_tk.value.split('_')[0] if xm_tk is not None else None
+    async def _mtop(self, url: str, model: typing.Any, msg: str) -> dict:
+        for attempt in range(2):
+            token = await self._tokens.get(url)
+            if token is None:
+                raise exceptions.ClientError("{}: can't get token".format(msg))
+
+            try:
+                _resp = await self.request('GET', url, params=_sign_payload(token, model))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise exceptions.RequestError('{}: {}'.format(msg, e))
+
+            self._tokens.observe(_resp)
+            try:
+                resp = await api.read_json(_resp, self.keep_body)
+                ret = resp['ret']
+            except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
+                raise exceptions.ResponseError('{}: {}'.format(msg, e))
+
+            if attempt == 0 and _token_rejected(ret):
+                self._tokens.invalidate(token)
+                continue
+
+            _check(ret, msg)
+            return resp
 
     async def search_songs(self, keyword: str) -> api.SearchSongsResult:
-        resp = await self.search_songs_raw(keyword)
+        songs, _ = await self.search_songs_page(keyword)
+        if not songs:
+            raise exceptions.DataError('search songs: no data')
+
+        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+
+    async def search_songs_page(self, keyword: str, page: int = 1, page_size: int = 50) -> api.Page:
+        resp = await self.search_songs_raw(keyword, page, page_size)
         try:
             _songs = resp['data']['data']['songs']
-        except KeyError:
-            raise exceptions.DataError('search songs: no data')
+            total = resp['data']['data'].get('pagingVO', {}).get('count')
+        except (KeyError, TypeError):
+            return [], None
 
         if not _songs:
-            raise exceptions.DataError('search songs: no data')
+            return [], total
 
         songs = [
             api.SearchSongsData(
@@ -132,13 +257,9 @@ class XiaMi(api.API):
                 album=_song['albumName'].strip(),
             ) for _song in _songs
         ]
-        return api.SearchSongsResult(keyword=keyword, count=len(songs), songs=songs)
+        return songs, total
 
     async def search_songs_raw(self, keyword: str, page: int = 1, page_size: int = 50) -> dict:
-        token = await self._get_token(_API_SEARCH)
-        if token is None:
-            raise exceptions.ClientError("search songs: can't get token")
-
         model = {
             'key': keyword,
             'pagingVO': {
@@ -147,18 +268,7 @@ class XiaMi(api.API):
             },
         }
 
-        try:
-            _resp = await self.request('GET', _API_SEARCH, params=_sign_payload(token, model))
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            raise exceptions.RequestError('search songs: {}'.format(e))
-
-        try:
-            resp = await _resp.json(content_type=None)
-            _check(resp['ret'], 'search songs')
-        except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
-            raise exceptions.ResponseError('search songs: {}'.format(e))
-
-        return resp
+        return await self._mtop(_API_SEARCH, model, 'search songs')
 
     async def get_song(self, song_id: typing.Union[int, str]) -> api.Song:
         resp = await self.get_song_detail_raw(song_id)
@@ -167,39 +277,20 @@ class XiaMi(api.API):
         except KeyError:
             raise exceptions.DataError('get song: no data')
 
-        await self._patch_song_lyric(_song)
+        self._defer_song_lyric(_song)
         songs = _resolve(_song)
         return songs[0]
 
     async def get_song_detail_raw(self, song_id: typing.Union[int, str]) -> dict:
-        token = await self._get_token(_API_GET_SONG_DETAIL)
-        if token is None:
-            raise exceptions.ClientError("get song detail: can't get token")
-
         model = {}
         if song_id.isdigit():
             model['songId'] = song_id
         else:
             model['songStringId'] = song_id
 
-        try:
-            _resp = await self.request('GET', _API_GET_SONG_DETAIL, params=_sign_payload(token, model))
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            raise exceptions.RequestError('get song detail: {}'.format(e))
-
-        try:
-            resp = await _resp.json(content_type=None)
-            _check(resp['ret'], 'get song detail')
-        except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
-            raise exceptions.ResponseError('get song detail: {}'.format(e))
-
-        return resp
+        return await self._mtop(_API_GET_SONG_DETAIL, model, 'get song detail')
 
     async def get_songs_raw(self, *song_ids: typing.Union[int, str]) -> dict:
-        token = await self._get_token(_API_GET_SONGS)
-        if token is None:
-            raise exceptions.ClientError("get songs: can't get token")
-
         if len(song_ids) > _SONG_REQUEST_LIMIT:
             song_ids = song_ids[:_SONG_REQUEST_LIMIT]
 
@@ -207,18 +298,7 @@ class XiaMi(api.API):
             'songIds': song_ids,
         }
 
-        try:
-            _resp = await self.request('GET', _API_GET_SONGS, params=_sign_payload(token, model))
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            raise exceptions.RequestError('get songs: {}'.format(e))
-
-        try:
-            resp = await _resp.json(content_type=None)
-            _check(resp['ret'], 'get songs')
-        except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
-            raise exceptions.ResponseError('get songs: {}'.format(e))
-
-        return resp
+        return await self._mtop(_API_GET_SONGS, model, 'get songs')
 
     async def get_song_lyric(self, mid: typing.Union[int, str]) -> typing.Optional[str]:
         resp = await self.get_song_lyric_raw(mid)
@@ -237,38 +317,18 @@ class XiaMi(api.API):
         return None
 
     async def get_song_lyric_raw(self, song_id: typing.Union[int, str]) -> dict:
-        token = await self._get_token(_API_GET_SONG_LYRIC)
-        if token is None:
-            raise exceptions.ClientError("get song lyric: can't get token")
-
         model = {}
         if song_id.isdigit():
             model['songId'] = song_id
         else:
             model['songStringId'] = song_id
 
-        try:
-            _resp = await self.request('GET', _API_GET_SONG_LYRIC, params=_sign_payload(token, model))
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            raise exceptions.RequestError('get song lyric: {}'.format(e))
-
-        try:
-            resp = await _resp.json(content_type=None)
-            _check(resp['ret'], 'get song lyric')
-        except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
-            raise exceptions.ResponseError('get song lyric: {}'.format(e))
-
-        return resp
-
-    async def _patch_song_lyric(self, *songs: dict) -> None:
-        sem = asyncio.Semaphore(32)
-
-        async def worker(song: dict):
-            async with sem:
-                song['lyric'] = await self.get_song_lyric(song['songId'])
+        return await self._mtop(_API_GET_SONG_LYRIC, model, 'get song lyric')
 
-        tasks = [asyncio.ensure_future(worker(song)) for song in songs]
-        await asyncio.gather(*tasks)
+    def _defer_song_lyric(self, *songs: dict) -> None:
+        for song in songs:
+            song_id = str(song['songId'])
+            song['lyric_loader'] = api.lyric_loader(self.platform_id(), song_id, self.get_song_lyric, song_id)
 
     async def get_artist(self, artist_id: typing.Union[int, str]) -> api.Artist:
         artist_info = await self.get_artist_info_raw(artist_id)
@@ -283,8 +343,7 @@ class XiaMi(api.API):
         if not _songs:
             raise exceptions.DataError('get artist: no data')
 
-        await self._patch_song_lyric(*_songs)
-        songs = _resolve(*_songs)
+        songs = await self._resolve_artist_songs(*_songs)
         return api.Artist(
             artist_id=artist['artistId'],
             name=artist['artistName'].strip(),
@@ -293,36 +352,36 @@ class XiaMi(api.API):
             songs=songs,
         )
 
-    async def get_artist_info_raw(self, artist_id: typing.Union[int, str]) -> dict:
-        token = await self._get_token(_API_SEARCH)
-        if token is None:
-            raise exceptions.ClientError("get artist info: can't get token")
+    async def _resolve_artist_songs(self, *songs: dict) -> typing.List[api.Song]:
+        self._defer_song_lyric(*songs)
+        return _resolve(*songs)
+
+    async def get_artist_songs_page(self, artist_id: typing.Union[int, str],
+                                    page: int = 1, page_size: int = 50) -> api.Page:
+        page_data = await self.get_artist_songs_raw(artist_id, page, page_size)
+        try:
+            _songs = page_data['data']['data']['songs']
+            total = page_data['data']['data'].get('pagingVO', {}).get('count')
+        except (KeyError, TypeError):
+            return [], None
+
+        if not _songs:
+            return [], total
+
+        songs = await self._resolve_artist_songs(*_songs)
+        return songs, total
 
+    async def get_artist_info_raw(self, artist_id: typing.Union[int, str]) -> dict:
         model = {}
         if artist_id.isdigit():
             model['artistId'] = artist_id
         else:
             model['artistStringId'] = artist_id
 
-        try:
-            _resp = await self.request('GET', _API_GET_ARTIST_INFO, params=_sign_payload(token, model))
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            raise exceptions.RequestError('get artist info: {}'.format(e))
-
-        try:
-            resp = await _resp.json(content_type=None)
-            _check(resp['ret'], 'get artist info')
-        except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
-            raise exceptions.ResponseError('get artist info: {}'.format(e))
-
-        return resp
+        return await self._mtop(_API_GET_ARTIST_INFO, model, 'get artist info')
 
     async def get_artist_songs_raw(self, artist_id: typing.Union[int, str],
                                    page: int = 1, page_size: int = 50) -> dict:
-        token = await self._get_token(_API_SEARCH)
-        if token is None:
-            raise exceptions.ClientError("get artist songs: can't get token")
-
         model = {
             'pagingVO': {
                 'page': page,
@@ -334,18 +393,7 @@ class XiaMi(api.API):
         else:
             model['artistStringId'] = artist_id
 
-        try:
-            _resp = await self.request('GET', _API_GET_ARTIST_SONGS, params=_sign_payload(token, model))
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            raise exceptions.RequestError('get artist songs: {}'.format(e))
-
-        try:
-            resp = await _resp.json(content_type=None)
-            _check(resp['ret'], 'get artist songs')
-        except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
-            raise exceptions.ResponseError('get artist songs: {}'.format(e))
-
-        return resp
+        return await self._mtop(_API_GET_ARTIST_SONGS, model, 'get artist songs')
 
     async def get_album(self, album_id: typing.Union[int, str]) -> api.Album:
         resp = await self.get_album_raw(album_id)
@@ -359,7 +407,7 @@ class XiaMi(api.API):
         if not _songs:
             raise exceptions.DataError('get album: no data')
 
-        await self._patch_song_lyric(*_songs)
+        self._defer_song_lyric(*_songs)
         songs = _resolve(*_songs)
         return api.Album(
             album_id=album['albumId'],
@@ -370,64 +418,65 @@ class XiaMi(api.API):
         )
 
     async def get_album_raw(self, album_id: typing.Union[int, str]) -> dict:
-        token = await self._get_token(_API_SEARCH)
-        if token is None:
-            raise exceptions.ClientError("get album: can't get token")
-
         model = {}
         if album_id.isdigit():
             model['albumId'] = album_id
         else:
             model['albumStringId'] = album_id
 
-        try:
-            _resp = await self.request('GET', _API_GET_ALBUM, params=_sign_payload(token, model))
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            raise exceptions.RequestError('get album: {}'.format(e))
+        return await self._mtop(_API_GET_ALBUM, model, 'get album')
 
-        try:
-            resp = await _resp.json(content_type=None)
-            _check(resp['ret'], 'get album')
-        except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
-            raise exceptions.ResponseError('get album: {}'.format(e))
-
-        return resp
-
-    async def get_playlist(self, playlist_id: typing.Union[int, str]) -> api.Playlist:
+    async def _get_playlist_detail(self, playlist_id: typing.Union[int, str]) -> dict:
         resp = await self.get_playlist_detail_raw(playlist_id)
 
         try:
             playlist = resp['data']['data']['collectDetail']
             total = int(playlist['songCount'])
-            tracks = playlist['songs']
-            track_ids = playlist['allSongs']
         except (KeyError, ValueError):
             raise exceptions.DataError('get playlist: no data')
 
-        if total == 0:
+        if total == 0 or 'songs' not in playlist or 'allSongs' not in playlist:
             raise exceptions.DataError('get playlist: no data')
 
-        if total > _SONG_REQUEST_LIMIT:
-            async def patch_tracks(*ids: typing.Union[int, str]):
-                return await self.get_songs_raw(*ids)
-
-            tasks = []
-            for i in range(_SONG_REQUEST_LIMIT, total, _SONG_REQUEST_LIMIT):
-                song_ids = track_ids[i:min(i + _SONG_REQUEST_LIMIT, total)]
-                tasks.append(asyncio.ensure_future(patch_tracks(*song_ids)))
-
-            await asyncio.gather(*tasks)
-            for task in tasks:
-                if not task.exception():
-                    try:
-                        data = task.result()['data']['data']
-                        _songs = data.get('songs', [])
-                        tracks.extend(_songs)
-                    except KeyError:
-                        continue
-
-        await self._patch_song_lyric(*tracks)
-        songs = _resolve(*tracks)
+        return playlist
+
+    async def _iter_playlist_tracks(self, playlist: dict,
+                                    lookahead: int) -> typing.AsyncIterator[typing.List[dict]]:
+        total = int(playlist['songCount'])
+        track_ids = playlist['allSongs']
+
+        async def fetch_tracks(offset: int) -> typing.List[dict]:
+            song_ids = track_ids[offset:min(offset + _SONG_REQUEST_LIMIT, total)]
+            try:
+                resp = await self.get_songs_raw(*song_ids)
+                return resp['data']['data'].get('songs', [])
+            except (exceptions.ClientError, KeyError):
+                return []
+
+        yield playlist['songs']
+        offsets = range(_SONG_REQUEST_LIMIT, total, _SONG_REQUEST_LIMIT)
+        async for tracks in pager.iter_pages(fetch_tracks, offsets, lookahead):
+            yield tracks
+
+    async def _iter_playlist_songs(self, playlist: dict, lookahead: int) -> typing.AsyncIterator[api.Song]:
+        async for tracks in self._iter_playlist_tracks(playlist, lookahead):
+            self._defer_song_lyric(*tracks)
+            for song in _resolve(*tracks):
+                yield song
+
+    async def iter_playlist_songs(self, playlist_id: typing.Union[int, str],
+                                  lookahead: int = _PAGE_LOOKAHEAD) -> typing.AsyncIterator[api.Song]:
+        playlist = await self._get_playlist_detail(playlist_id)
+        async for song in self._iter_playlist_songs(playlist, lookahead):
+            yield song
+
+    async def get_playlist(self, playlist_id: typing.Union[int, str]) -> api.Playlist:
+        playlist = await self._get_playlist_detail(playlist_id)
+
+        songs = []
+        async for song in self._iter_playlist_songs(playlist, _PAGE_LOOKAHEAD):
+            songs.append(song)
+
         return api.Playlist(
             playlist_id=playlist['listId'],
             name=playlist['collectName'].strip(),
@@ -438,10 +487,6 @@ class XiaMi(api.API):
 
     async def get_playlist_detail_raw(self, playlist_id: typing.Union[int, str],
                                       page: int = 1, page_size: int = _SONG_REQUEST_LIMIT) -> dict:
-        token = await self._get_token(_API_GET_PLAYLIST_DETAIL)
-        if token is None:
-            raise exceptions.ClientError("get playlist detail: can't get token")
-
         model = {
             'listid': playlist_id,
             'pagingVO': {
@@ -450,25 +495,10 @@ class XiaMi(api.API):
             },
         }
 
-        try:
-            _resp = await self.request('GET', _API_GET_PLAYLIST_DETAIL, params=_sign_payload(token, model))
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            raise exceptions.RequestError('get playlist detail: {}'.format(e))
-
-        try:
-            resp = await _resp.json(content_type=None)
-            _check(resp['ret'], 'get playlist detail')
-        except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
-            raise exceptions.ResponseError('get playlist detail: {}'.format(e))
-
-        return resp
+        return await self._mtop(_API_GET_PLAYLIST_DETAIL, model, 'get playlist detail')
 
     async def get_playlist_songs_raw(self, playlist_id: typing.Union[int, str],
                                      page: int = 1, page_size: int = 200) -> dict:
-        token = await self._get_token(_API_GET_PLAYLIST_SONGS)
-        if token is None:
-            raise exceptions.ClientError("get playlist songs: can't get token")
-
         model = {
             'listid': playlist_id,
             'pagingVO': {
@@ -477,18 +507,7 @@ class XiaMi(api.API):
             },
         }
 
-        try:
-            _resp = await self.request('GET', _API_GET_PLAYLIST_DETAIL, params=_sign_payload(token, model))
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            raise exceptions.RequestError('get playlist songs: {}'.format(e))
-
-        try:
-            resp = await _resp.json(content_type=None)
-            _check(resp['ret'], 'get playlist songs')
-        except (aiohttp.ClientResponseError, json.JSONDecodeError, KeyError) as e:
-            raise exceptions.ResponseError('get playlist songs: {}'.format(e))
-
-        return resp
+        return await self._mtop(_API_GET_PLAYLIST_DETAIL, model, 'get playlist songs')
 
     async def request(self, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
         headers = {
@@ -496,8 +515,9 @@ class XiaMi(api.API):
             'Referer': 'https://h.xiami.com',
             'User-Agent': api.USER_AGENT,
         }
+        headers.update(kwargs.get('headers') or {})
         kwargs.update({
             'headers': headers,
         })
 
-        return await self._session.request(method, url, **kwargs)
+        return await limiter.request(self._session, method, url, **kwargs)
@@ -0,0 +1,127 @@
+import time
+import typing
+
+from mxget import (
+    limiter,
+)
+
+__all__ = [
+    'HostSlots',
+    'Scheduler',
+]
+
+LIMIT = 64
+PER_HOST = 8
+
+_WINDOW = 2.0
+_STEP = 0.25
+_GAIN = 0.05
+
+
+class HostSlots:
+    """
+    Download slots for one host, drawn from the scheduler's global pool. A task
+    waits for its host first and only then for a global slot, so a host at its
+    limit never holds global slots that downloads from other hosts could use.
+
+    Quacks like ``asyncio.Semaphore`` (``acquire``/``release``/``locked``) so
+    segmented downloads can borrow idle slots from it.
+    """
+
+    def __init__(self, pool: limiter.AdaptiveLimiter, limit: int, ceiling: int, autotune: bool = False):
+        self._pool = pool
+        self._slots = limiter.AdaptiveLimiter(limit, 1, ceiling)
+        self._autotune = autotune
+        self._bytes = 0
+        self._started = time.monotonic()
+        self._saturated = False
+        self._last_rate = None
+        self._direction = 1
+
+    @property
+    def limit(self) -> int:
+        return self._slots.limit
+
+    @property
+    def inflight(self) -> int:
+        return self._slots.inflight
+
+    def locked(self) -> bool:
+        return self._slots.locked() or self._pool.locked()
+
+    async def acquire(self) -> None:
+        if self._slots.locked():
+            self._saturated = True
+        await self._slots.acquire()
+        try:
+            await self._pool.acquire()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self) -> None:
+        self._pool.release()
+        self._slots.release()
+
+    def record(self, nbytes: int) -> None:
+        """
+        Account for ``nbytes`` downloaded. With auto-tuning, every few seconds
+        in which the host had more work than slots the limit takes a step: on
+        in the same direction while throughput keeps up, back once it drops.
+        """
+        if not self._autotune:
+            return
+        self._bytes += nbytes
+        now = time.monotonic()
+        if now - self._started < _WINDOW:
+            return
+
+        rate = self._bytes / (now - self._started)
+        if not self._saturated:
+            self._last_rate = None
+            self._direction = 1
+        else:
+            if self._last_rate is not None:
+                expected = self._last_rate * (1 + _GAIN * self._direction)
+                if rate < expected:
+                    self._direction = -self._direction
+            self._slots.limit = self.limit + max(int(self.limit * _STEP), 1) * self._direction
+            self._last_rate = rate
+        self._bytes = 0
+        self._started = now
+        self._saturated = False
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class Scheduler:
+    """
+    Bounds concurrent downloads by ``limit`` overall and ``per_host`` for each
+    upstream host; a ``downloads`` host rule (see ``limiter.configure``) sets a
+    fixed limit shared by the hosts it matches instead. With ``autotune`` the
+    other hosts' limits follow their observed throughput, up to ``limit``.
+    """
+
+    def __init__(self, limit: int = LIMIT, per_host: int = PER_HOST, autotune: bool = False):
+        self.limit = max(limit, 1)
+        self.per_host = max(min(per_host, self.limit), 1)
+        self.autotune = autotune
+        self._pool = limiter.AdaptiveLimiter(self.limit, self.limit, self.limit)
+        self._hosts = {}  # type: typing.Dict[typing.Any, HostSlots]
+
+    def slots(self, host: str) -> HostSlots:
+        budget = limiter.get_budget(host)
+        if budget is not None and budget.downloads:
+            key, limit, autotune = budget, min(budget.downloads, self.limit), False
+        else:
+            key, limit, autotune = host.lower(), self.per_host, self.autotune
+
+        slots = self._hosts.get(key)
+        if slots is None:
+            slots = self._hosts[key] = HostSlots(self._pool, limit, self.limit, autotune)
+        return slots
@@ -1,8 +1,11 @@
+import json
+
 from aiohttp import web
 
 from mxget import (
     api,
     exceptions,
+    limiter,
 )
 from mxget.provider import (
     netease,
@@ -16,6 +19,14 @@ from mxget.provider import (
 
 routes = web.RouteTableDef()
 
+_RAW_METHODS = {
+    'search': ('search_songs_raw',),
+    'song': ('get_song_raw', 'get_song_detail_raw', 'get_songs_raw'),
+    'artist': ('get_artist_raw', 'get_artist_songs_raw'),
+    'album': ('get_album_raw', 'get_album_songs_raw'),
+    'playlist': ('get_playlist_raw', 'get_playlist_detail_raw', 'get_playlist_songs_raw'),
+}
+
 
 def success_response(client: api.API, data: dict):
     return web.json_response(data={
@@ -33,7 +44,43 @@ def error_response(client: api.API, e: exceptions.ClientError):
     }, status=500)
 
 
-async def search_songs(client: api.API, keyword: str):
+def raw_response(client: api.API, data: dict):
+    body = getattr(data, 'body', None)
+    if not body:
+        body = json.dumps(data).encode('utf-8')
+    return web.Response(body=b''.join((
+        b'{"code": 200, "data": ',
+        body,
+        ', "platform": {}}}'.format(int(client.platform_id())).encode('utf-8'),
+    )), status=200, content_type='application/json')
+
+
+def _with_lyric(request: web.Request) -> bool:
+    # lyrics are included unless the client opts out with ?lyric=0
+    return request.query.get('lyric', '').lower() not in ('0', 'false')
+
+
+def _with_raw(request: web.Request) -> bool:
+    return request.query.get('raw', '').lower() in ('1', 'true')
+
+
+async def get_raw(client: api.API, kind: str, key: str):
+    client.keep_body = True
+    method = next(getattr(client, name) for name in _RAW_METHODS[kind] if hasattr(client, name))
+    try:
+        resp = await method(key)
+    except exceptions.ClientError as e:
+        await client.close()
+        return error_response(client, e)
+
+    await client.close()
+    return raw_response(client, resp)
+
+
+async def search_songs(client: api.API, keyword: str, raw: bool = False):
+    if raw:
+        return await get_raw(client, 'search', keyword)
+
     try:
         resp = await client.search_songs(keyword)
     except exceptions.ClientError as e:
@@ -44,9 +91,14 @@ async def search_songs(client: api.API, keyword: str):
     return success_response(client, resp.serialize())
 
 
-async def get_song(client: api.API, song_id: str):
+async def get_song(client: api.API, song_id: str, with_lyric: bool = False, raw: bool = False):
+    if raw:
+        return await get_raw(client, 'song', song_id)
+
     try:
         resp = await client.get_song(song_id)
+        if with_lyric:
+            await resp.load_lyric()
     except exceptions.ClientError as e:
         await client.close()
         return error_response(client, e)
@@ -55,9 +107,14 @@ async def get_song(client: api.API, song_id: str):
     return success_response(client, resp.serialize())
 
 
-async def get_artist(client: api.API, artist_id: str):
+async def get_artist(client: api.API, artist_id: str, with_lyric: bool = False, raw: bool = False):
+    if raw:
+        return await get_raw(client, 'artist', artist_id)
+
     try:
         resp = await client.get_artist(artist_id)
+        if with_lyric:
+            await api.load_lyrics(*resp.songs)
     except exceptions.ClientError as e:
         await client.close()
         return error_response(client, e)
@@ -66,9 +123,14 @@ async def get_artist(client: api.API, artist_id: str):
     return success_response(client, resp.serialize())
 
 
-async def get_album(client: api.API, album_id: str):
+async def get_album(client: api.API, album_id: str, with_lyric: bool = False, raw: bool = False):
+    if raw:
+        return await get_raw(client, 'album', album_id)
+
     try:
         resp = await client.get_album(album_id)
+        if with_lyric:
+            await api.load_lyrics(*resp.songs)
     except exceptions.ClientError as e:
         await client.close()
         return error_response(client, e)
@@ -77,9 +139,14 @@ async def get_album(client: api.API, album_id: str):
     return success_response(client, resp.serialize())
 
 
-async def get_playlist(client: api.API, playlist_id: str):
+async def get_playlist(client: api.API, playlist_id: str, with_lyric: bool = False, raw: bool = False):
+    if raw:
+        return await get_raw(client, 'playlist', playlist_id)
+
     try:
         resp = await client.get_playlist(playlist_id)
+        if with_lyric:
+            await api.load_lyrics(*resp.songs)
     except exceptions.ClientError as e:
         await client.close()
         return error_response(client, e)
@@ -88,179 +155,192 @@ async def get_playlist(client: api.API, playlist_id: str):
     return success_response(client, resp.serialize())
 
 
+@routes.get('/api/limits')
+async def get_limits(request: web.Request):
+    return web.json_response(data={
+        'code': 200,
+        'data': limiter.limits(),
+    }, status=200)
+
+
 @routes.get('/api/netease/search/{keyword}')
 async def search_songs_from_netease(request: web.Request):
-    return await search_songs(netease.NetEase(), request.match_info['keyword'])
+    return await search_songs(netease.NetEase(), request.match_info['keyword'], _with_raw(request))
 
 
 @routes.get('/api/netease/song/{song_id}')
 async def get_song_from_netease(request: web.Request):
-    return await get_song(netease.NetEase(), request.match_info['song_id'])
+    return await get_song(netease.NetEase(), request.match_info['song_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/netease/artist/{artist_id}')
 async def get_artist_from_netease(request: web.Request):
-    return await get_artist(netease.NetEase(), request.match_info['artist_id'])
+    return await get_artist(netease.NetEase(), request.match_info['artist_id'],
+                            _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/netease/album/{album_id}')
 async def get_album_from_netease(request: web.Request):
-    return await get_album(netease.NetEase(), request.match_info['album_id'])
+    return await get_album(netease.NetEase(), request.match_info['album_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/netease/playlist/{playlist_id}')
 async def get_playlist_from_netease(request: web.Request):
-    return await get_playlist(netease.NetEase(), request.match_info['playlist_id'])
+    return await get_playlist(netease.NetEase(), request.match_info['playlist_id'],
+                              _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/qq/search/{keyword}')
 async def search_songs_from_qq(request: web.Request):
-    return await search_songs(qq.QQ(), request.match_info['keyword'])
+    return await search_songs(qq.QQ(), request.match_info['keyword'], _with_raw(request))
 
 
 @routes.get('/api/qq/song/{song_id}')
 async def get_song_from_qq(request: web.Request):
-    return await get_song(qq.QQ(), request.match_info['song_id'])
+    return await get_song(qq.QQ(), request.match_info['song_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/qq/artist/{artist_id}')
 async def get_artist_from_qq(request: web.Request):
-    return await get_artist(qq.QQ(), request.match_info['artist_id'])
+    return await get_artist(qq.QQ(), request.match_info['artist_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/qq/album/{album_id}')
 async def get_album_from_qq(request: web.Request):
-    return await get_album(qq.QQ(), request.match_info['album_id'])
+    return await get_album(qq.QQ(), request.match_info['album_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/qq/playlist/{playlist_id}')
 async def get_playlist_from_qq(request: web.Request):
-    return await get_playlist(qq.QQ(), request.match_info['playlist_id'])
+    return await get_playlist(qq.QQ(), request.match_info['playlist_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/migu/search/{keyword}')
 async def search_songs_from_migu(request: web.Request):
-    return await search_songs(migu.MiGu(), request.match_info['keyword'])
+    return await search_songs(migu.MiGu(), request.match_info['keyword'], _with_raw(request))
 
 
 @routes.get('/api/migu/song/{song_id}')
 async def get_song_from_migu(request: web.Request):
-    return await get_song(migu.MiGu(), request.match_info['song_id'])
+    return await get_song(migu.MiGu(), request.match_info['song_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/migu/artist/{artist_id}')
 async def get_artist_from_migu(request: web.Request):
-    return await get_artist(migu.MiGu(), request.match_info['artist_id'])
+    return await get_artist(migu.MiGu(), request.match_info['artist_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/migu/album/{album_id}')
 async def get_album_from_migu(request: web.Request):
-    return await get_album(migu.MiGu(), request.match_info['album_id'])
+    return await get_album(migu.MiGu(), request.match_info['album_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/migu/playlist/{playlist_id}')
 async def get_playlist_from_migu(request: web.Request):
-    return await get_playlist(migu.MiGu(), request.match_info['playlist_id'])
+    return await get_playlist(migu.MiGu(), request.match_info['playlist_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/kugou/search/{keyword}')
 async def search_songs_from_kugou(request: web.Request):
-    return await search_songs(kugou.KuGou(), request.match_info['keyword'])
+    return await search_songs(kugou.KuGou(), request.match_info['keyword'], _with_raw(request))
 
 
 @routes.get('/api/kugou/song/{song_id}')
 async def get_song_from_kugou(request: web.Request):
-    return await get_song(kugou.KuGou(), request.match_info['song_id'])
+    return await get_song(kugou.KuGou(), request.match_info['song_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/kugou/artist/{artist_id}')
 async def get_artist_from_kugou(request: web.Request):
-    return await get_artist(kugou.KuGou(), request.match_info['artist_id'])
+    return await get_artist(kugou.KuGou(), request.match_info['artist_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/kugou/album/{album_id}')
 async def get_album_from_kugou(request: web.Request):
-    return await get_album(kugou.KuGou(), request.match_info['album_id'])
+    return await get_album(kugou.KuGou(), request.match_info['album_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/kugou/playlist/{playlist_id}')
 async def get_playlist_from_kugou(request: web.Request):
-    return await get_playlist(kugou.KuGou(), request.match_info['playlist_id'])
+    return await get_playlist(kugou.KuGou(), request.match_info['playlist_id'],
+                              _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/kuwo/search/{keyword}')
 async def search_songs_from_kuwo(request: web.Request):
-    return await search_songs(kuwo.KuWo(), request.match_info['keyword'])
+    return await search_songs(kuwo.KuWo(), request.match_info['keyword'], _with_raw(request))
 
 
 @routes.get('/api/kuwo/song/{song_id}')
 async def get_song_from_kuwo(request: web.Request):
-    return await get_song(kuwo.KuWo(), request.match_info['song_id'])
+    return await get_song(kuwo.KuWo(), request.match_info['song_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/kuwo/artist/{artist_id}')
 async def get_artist_from_kuwo(request: web.Request):
-    return await get_artist(kuwo.KuWo(), request.match_info['artist_id'])
+    return await get_artist(kuwo.KuWo(), request.match_info['artist_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/kuwo/album/{album_id}')
 async def get_album_from_kuwo(request: web.Request):
-    return await get_album(kuwo.KuWo(), request.match_info['album_id'])
+    return await get_album(kuwo.KuWo(), request.match_info['album_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/kuwo/playlist/{playlist_id}')
 async def get_playlist_from_kuwo(request: web.Request):
-    return await get_playlist(kuwo.KuWo(), request.match_info['playlist_id'])
+    return await get_playlist(kuwo.KuWo(), request.match_info['playlist_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/xiami/search/{keyword}')
 async def search_songs_from_xiami(request: web.Request):
-    return await search_songs(xiami.XiaMi(), request.match_info['keyword'])
+    return await search_songs(xiami.XiaMi(), request.match_info['keyword'], _with_raw(request))
 
 
 @routes.get('/api/xiami/song/{song_id}')
 async def get_song_from_xiami(request: web.Request):
-    return await get_song(xiami.XiaMi(), request.match_info['song_id'])
+    return await get_song(xiami.XiaMi(), request.match_info['song_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/xiami/artist/{artist_id}')
 async def get_artist_from_xiami(request: web.Request):
-    return await get_artist(xiami.XiaMi(), request.match_info['artist_id'])
+    return await get_artist(xiami.XiaMi(), request.match_info['artist_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/xiami/album/{album_id}')
 async def get_album_from_xiami(request: web.Request):
-    return await get_album(xiami.XiaMi(), request.match_info['album_id'])
+    return await get_album(xiami.XiaMi(), request.match_info['album_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/xiami/playlist/{playlist_id}')
 async def get_playlist_from_xiami(request: web.Request):
-    return await get_playlist(xiami.XiaMi(), request.match_info['playlist_id'])
+    return await get_playlist(xiami.XiaMi(), request.match_info['playlist_id'],
+                              _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/qianqian/search/{keyword}')
 async def search_songs_from_qianqian(request: web.Request):
-    return await search_songs(baidu.BaiDu(), request.match_info['keyword'])
+    return await search_songs(baidu.BaiDu(), request.match_info['keyword'], _with_raw(request))
 
 
 @routes.get('/api/qianqian/song/{song_id}')
 async def get_song_from_qianqian(request: web.Request):
-    return await get_song(baidu.BaiDu(), request.match_info['song_id'])
+    return await get_song(baidu.BaiDu(), request.match_info['song_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/qianqian/artist/{artist_id}')
 async def get_artist_from_qianqian(request: web.Request):
-    return await get_artist(baidu.BaiDu(), request.match_info['artist_id'])
+    return await get_artist(baidu.BaiDu(), request.match_info['artist_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/qianqian/album/{album_id}')
 async def get_album_from_qianqian(request: web.Request):
-    return await get_album(baidu.BaiDu(), request.match_info['album_id'])
+    return await get_album(baidu.BaiDu(), request.match_info['album_id'], _with_lyric(request), _with_raw(request))
 
 
 @routes.get('/api/qianqian/playlist/{playlist_id}')
 async def get_playlist_from_qianqian(request: web.Request):
-    return await get_playlist(baidu.BaiDu(), request.match_info['playlist_id'])
+    return await get_playlist(baidu.BaiDu(), request.match_info['playlist_id'],
+                              _with_lyric(request), _with_raw(request))
 
 
 async def init():
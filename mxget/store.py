@@ -0,0 +1,77 @@
+import os
+import pathlib
+import shutil
+
+OBJECTS_DIR = '.objects'
+
+HARDLINK = 'hardlink'
+SYMLINK = 'symlink'
+COPY = 'copy'
+
+
+def object_path(root: pathlib.Path, digest: str, suffix: str = '.mp3') -> pathlib.Path:
+    return root.joinpath(OBJECTS_DIR, digest[:2], digest + suffix)
+
+
+def _same(a: pathlib.Path, b: pathlib.Path) -> bool:
+    try:
+        return os.path.samefile(str(a), str(b))
+    except OSError:
+        return False
+
+
+def link(src: pathlib.Path, dst: pathlib.Path) -> str:
+    """
+    Make ``dst`` refer to the bytes of ``src``, trying a hardlink first, then a
+    relative symlink, then a plain copy. An existing ``dst`` is replaced atomically.
+    Returns the method used.
+    """
+    if _same(src, dst):
+        return SYMLINK if dst.is_symlink() else HARDLINK
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + '.link')
+    if tmp.is_symlink() or tmp.exists():
+        tmp.unlink()
+    try:
+        os.link(str(src), str(tmp))
+        method = HARDLINK
+    except OSError:
+        try:
+            os.symlink(os.path.relpath(str(src), str(dst.parent)), str(tmp))
+            method = SYMLINK
+        except (OSError, NotImplementedError):
+            shutil.copy2(str(src), str(tmp))
+            method = COPY
+    os.replace(str(tmp), str(dst))
+    return method
+
+
+def detach(file_path: pathlib.Path) -> None:
+    """Give ``file_path`` its own copy of the bytes before it is modified in place."""
+    if not file_path.is_symlink() and file_path.stat().st_nlink < 2:
+        return
+    tmp = file_path.with_name(file_path.name + '.detach')
+    shutil.copy2(str(file_path.resolve()), str(tmp))
+    os.replace(str(tmp), str(file_path))
+
+
+def ingest(root: pathlib.Path, file_path: pathlib.Path, digest: str) -> pathlib.Path:
+    """
+    Move ``file_path`` into the object store under ``digest`` and link it back.
+    Identical bytes that are already stored are reused and the new file is dropped.
+    Returns the path that holds the bytes, which is ``file_path`` itself when the
+    store can't be used.
+    """
+    obj = object_path(root, digest, file_path.suffix)
+    if _same(obj, file_path):
+        return obj
+
+    try:
+        obj.parent.mkdir(parents=True, exist_ok=True)
+        if not obj.exists():
+            os.replace(str(file_path), str(obj))
+    except OSError:
+        return file_path
+    link(obj, file_path)
+    return obj
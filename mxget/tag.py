@@ -0,0 +1,94 @@
+import asyncio
+import concurrent.futures
+import io
+import pathlib
+import typing
+
+import mutagen
+from mutagen import (
+    id3,
+)
+
+from mxget import (
+    api,
+    cover,
+)
+
+WORKERS = 4
+
+
+def song_frames(song: api.Song, pic: cover.Cover = None) -> typing.List[id3.Frame]:
+    frames = [
+        id3.TIT2(encoding=id3.Encoding.UTF8, text=song.name),
+        id3.TPE1(encoding=id3.Encoding.UTF8, text=song.artist),
+        id3.TALB(encoding=id3.Encoding.UTF8, text=song.album),
+    ]
+
+    if song.lyric:
+        frames.append(id3.ULT(
+            encoding=id3.Encoding.UTF8,
+            lang='eng',
+            desc=song.name,
+            text=song.lyric,
+        ))
+
+    if pic is not None:
+        frames.append(id3.APIC(
+            encoding=id3.Encoding.UTF8,
+            mime=pic.mime,
+            type=id3.PictureType.COVER_FRONT,
+            desc='Front cover',
+            data=pic.data,
+        ))
+    return frames
+
+
+def header(frames: typing.Iterable[id3.Frame], upstream: bytes = b'') -> bytes:
+    """
+    Serialize ``frames`` into an ID3v2 tag to write ahead of the audio, merged
+    over the ``upstream`` tag the file came with. Mutagen's default padding is
+    kept so later edits fit in place.
+    """
+    audio = id3.ID3()
+    if upstream:
+        try:
+            audio = id3.ID3(io.BytesIO(upstream))
+        except mutagen.MutagenError:
+            pass
+    for frame in frames:
+        audio.add(frame)
+    out = io.BytesIO()
+    audio.save(out)
+    return out.getvalue()
+
+
+def apply(file_path: pathlib.Path, frames: typing.Iterable[id3.Frame]) -> None:
+    try:
+        audio = id3.ID3(str(file_path))
+    except id3.ID3NoHeaderError:
+        audio = id3.ID3()
+    for frame in frames:
+        audio.add(frame)
+    audio.save(str(file_path))
+
+
+class Tagger:
+    """
+    Runs mutagen parsing and rewrites in a bounded thread pool, so tagging a
+    large file doesn't stall the downloads sharing the event loop.
+    """
+
+    def __init__(self, workers: int = WORKERS):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1))
+
+    async def apply(self, file_path: pathlib.Path, frames: typing.Iterable[id3.Frame]) -> None:
+        await asyncio.get_event_loop().run_in_executor(self._executor, apply, file_path, list(frames))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
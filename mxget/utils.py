@@ -5,3 +5,25 @@ regex = re.compile(r'[\\/:*?"<>|]')
 
 def trim_invalid_file_path_chars(path: str) -> str:
     return regex.sub(' ', path)
+
+
+def format_size(size: float) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(size) < 1024 or unit == 'GiB':
+            break
+        size /= 1024
+    return '{:.1f} {}'.format(size, unit) if unit != 'B' else '{:.0f} B'.format(size)
+
+
+size_regex = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?\s*$', re.IGNORECASE)
+
+_SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def parse_size(text: str) -> int:
+    """Parse a size such as ``512K``, ``1.5M`` or ``2MiB`` into bytes."""
+    match = size_regex.match(text)
+    if match is None:
+        raise ValueError('invalid size: "{}"'.format(text))
+    number, unit = match.groups()
+    return int(float(number) * _SIZE_UNITS[unit.lower()])
@@ -32,6 +32,10 @@ setuptools.setup(
         ],
     },
     install_requires=required,
+    extras_require={
+        'stream': ['ijson>=3.1'],
+        'cover': ['Pillow'],
+    },
     python_requires='>=3.5.3',
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -0,0 +1,41 @@
+import http.cookies
+import json
+import typing
+
+
+class Response:
+    """Stands in for an ``aiohttp.ClientResponse`` with a JSON body, or raw ``bytes`` as given."""
+
+    def __init__(self, data: typing.Any, encoding: str = 'utf-8', cookies: dict = None):
+        self._body = data if isinstance(data, bytes) else json.dumps(data).encode(encoding)
+        self._encoding = encoding
+        self.cookies = http.cookies.SimpleCookie(cookies)
+
+    async def read(self) -> bytes:
+        return self._body
+
+    def get_encoding(self) -> str:
+        return self._encoding
+
+    def release(self) -> None:
+        pass
+
+
+class LocalClient:
+    """
+    Mixin for a provider client whose requests are answered locally. Subclasses
+    implement ``answer``, which returns the JSON data for one request or a whole
+    ``Response``; every request is kept in ``requests``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = []
+
+    async def answer(self, method: str, url: str, **kwargs) -> typing.Any:
+        raise NotImplementedError
+
+    async def request(self, method: str, url: str, **kwargs) -> Response:
+        self.requests.append((method, url, kwargs))
+        data = await self.answer(method, url, **kwargs)
+        return data if isinstance(data, Response) else Response(data)
@@ -0,0 +1,210 @@
+import asyncio
+import unittest
+
+from mxget import (
+    api,
+    cache,
+    exceptions,
+    jsonstream,
+)
+
+import fakes
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(f(*args, **kwargs))
+
+    return wrapper
+
+
+class TestSong(unittest.TestCase):
+    @async_test
+    async def test_lazy_lyric(self):
+        calls = []
+
+        async def fetch(song_id):
+            calls.append(song_id)
+            await asyncio.sleep(0)
+            return 'lyric of {}'.format(song_id)
+
+        loader = api.lyric_loader(api.PlatformId.NetEase, 'test-lazy', fetch, 'test-lazy')
+        songs = [api.Song('test-lazy', 'name', 'artist', lyric_loader=loader) for _ in range(3)]
+        self.assertFalse(songs[0].lyric_loaded)
+        self.assertEqual(songs[0].serialize()['lyric'], '')
+
+        await api.load_lyrics(*songs)
+        self.assertEqual(calls, ['test-lazy'])
+        for song in songs:
+            self.assertTrue(song.lyric_loaded)
+            self.assertEqual(song.lyric, 'lyric of test-lazy')
+
+    @async_test
+    async def test_lazy_lyric_error(self):
+        async def fetch():
+            raise exceptions.RequestError('boom')
+
+        song = api.Song('test-error', 'name', 'artist', lyric_loader=api.lyric_loader(
+            api.PlatformId.QQ, 'test-error', fetch))
+        self.assertEqual(await song.load_lyric(), '')
+
+    def test_eager_lyric_ignores_loader(self):
+        song = api.Song('1', 'name', 'artist', lyric='eager', lyric_loader=lambda: None)
+        self.assertTrue(song.lyric_loaded)
+        self.assertIn('"lyric": "eager"', str(song))
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        c = cache.TTLCache(maxsize=2)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.get('a')
+        c.set('c', 3)
+        self.assertIn('a', c)
+        self.assertNotIn('b', c)
+
+    def test_expiry(self):
+        c = cache.TTLCache(ttl=60)
+        c.set('a', 1, ttl=-1)
+        c.set('b', 2)
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(c.get('b'), 2)
+
+    @async_test
+    async def test_single_flight(self):
+        c = cache.TTLCache()
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'v'
+
+        results = await asyncio.gather(*[c.get_or_load('k', load) for _ in range(5)])
+        self.assertEqual(results, ['v'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(c.misses, 1)
+        self.assertEqual(c.hits, 4)
+
+
+class TestReadJson(unittest.TestCase):
+    @async_test
+    async def test_keeps_body(self):
+        body = '{"code": 200, "name": "歌"}'.encode('utf-8')
+        data = await api.read_json(fakes.Response(body), keep_body=True)
+        self.assertEqual(data['name'], '歌')
+        self.assertIs(data.body, body)
+
+    @async_test
+    async def test_drops_body_by_default(self):
+        data = await api.read_json(fakes.Response(b'{"code": 200}'))
+        self.assertEqual(data, {'code': 200})
+        self.assertNotIsInstance(data, api.RawResponse)
+
+    @unittest.skipUnless(jsonstream.available(), 'needs a C-accelerated ijson')
+    @async_test
+    async def test_raw_body_parsed_on_lookup(self):
+        # the status comes first and the rest is never parsed, so a truncated tail goes unnoticed
+        body = b'{"code": 200, "msg": "ok", "data": {"songs": [{"id": 1'
+        data = await api.read_json(fakes.Response(body), keep_body=True)
+        self.assertEqual(dict(data), {})
+        self.assertEqual(data['code'], 200)
+        self.assertEqual(data.get('msg'), 'ok')
+        self.assertEqual(dict(data), {'code': 200, 'msg': 'ok'})
+        self.assertIs(data.body, body)
+
+        data = await api.read_json(fakes.Response(b'{"code": 200}'), keep_body=True)
+        self.assertIsNone(data.get('error'))
+        with self.assertRaises(KeyError):
+            data['error']
+
+    @async_test
+    async def test_reencodes_body(self):
+        data = await api.read_json(fakes.Response('{"name": "歌"}'.encode('gbk'), 'gbk'), keep_body=True)
+        self.assertEqual(data.body, '{"name": "歌"}'.encode('utf-8'))
+
+
+class _PagedAPI(api.API):
+    def __init__(self, total, report_total=True, dropped=0):
+        self.total = total
+        self.report_total = report_total
+        self.dropped = dropped
+        self.pages = []
+        self.inflight = 0
+        self.peak = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def platform_id(self):
+        return api.PlatformId.NetEase
+
+    async def search_songs(self, keyword):
+        pass
+
+    async def search_songs_page(self, keyword, page=1, page_size=10):
+        self.pages.append(page)
+        self.inflight += 1
+        self.peak = max(self.peak, self.inflight)
+        await asyncio.sleep(0.001)
+        self.inflight -= 1
+        start = (page - 1) * page_size
+        end = min(start + page_size, self.total)
+        songs = [api.SearchSongsData(i, 'name', 'artist', 'album') for i in range(start + self.dropped, end)]
+        return songs, str(self.total) if self.report_total else None
+
+    async def get_song(self, song_id):
+        pass
+
+    async def get_artist(self, artist_id):
+        return api.Artist(artist_id, 'artist', '', 1, [api.Song('1', 'name', 'artist')])
+
+    async def get_album(self, album_id):
+        pass
+
+    async def get_playlist(self, playlist_id):
+        pass
+
+    async def request(self, method, url, **kwargs):
+        pass
+
+    async def close(self):
+        pass
+
+
+class TestPagedIterators(unittest.TestCase):
+    @async_test
+    async def test_iter_search_stops_at_total(self):
+        client = _PagedAPI(95)
+        songs = [s async for s in client.iter_search('k', page_size=10, lookahead=3)]
+        self.assertEqual(len(songs), 95)
+        self.assertEqual(sorted(client.pages), list(range(1, 11)))
+        self.assertLessEqual(client.peak, 3)
+
+    @async_test
+    async def test_iter_search_short_pages(self):
+        # songs filtered out of each page must not shrink the page size the pager assumes
+        client = _PagedAPI(475, dropped=3)
+        songs = [s async for s in client.iter_search('k', lookahead=3)]
+        self.assertEqual(len(songs), 475 - 3 * 10)
+        self.assertEqual(sorted(client.pages), list(range(1, 11)))
+
+    @async_test
+    async def test_iter_search_unknown_total(self):
+        client = _PagedAPI(25, report_total=False)
+        songs = [s async for s in client.iter_search('k', page_size=10)]
+        self.assertEqual(len(songs), 25)
+
+    @async_test
+    async def test_iter_artist_songs_fallback(self):
+        songs = [s async for s in _PagedAPI(0).iter_artist_songs('1')]
+        self.assertEqual(len(songs), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,8 @@ import unittest
 
 from mxget.provider import baidu
 
+import fakes
+
 
 def async_test(f):
     def wrapper(*args, **kwargs):
@@ -44,5 +46,44 @@ class TestBaiDu(unittest.TestCase):
             self.assertIsNotNone(resp)
 
 
+class _FmlinkClient(fakes.LocalClient, baidu.BaiDu):
+    """Answers fmlink batches and single-song lookups, recording their sizes."""
+
+    def __init__(self, missing: tuple = ()):
+        super().__init__()
+        self.missing = missing
+        self.batches = []
+        self.singles = []
+
+    async def answer(self, method: str, url: str, **kwargs):
+        if url == baidu._API_GET_SONG:
+            self.singles.append(kwargs['params']['songid'])
+            return {
+                'error_code': 22000,
+                'songurl': {'url': [{'file_format': 'mp3', 'show_link': 'single'}]},
+                'songinfo': {'lrclink': ''},
+            }
+
+        song_ids = kwargs['params']['songIds'].split(',')
+        self.batches.append(len(song_ids))
+        return {'errorCode': 22000, 'data': {'songList': [
+            {'songId': int(song_id), 'songLink': 'batch', 'lrcLink': 'lrc'}
+            for song_id in song_ids if int(song_id) not in self.missing
+        ]}}
+
+
+class TestSongsUrl(unittest.TestCase):
+    @async_test
+    async def test_batches(self):
+        async with _FmlinkClient(missing=(7,)) as client:
+            songs = [{'song_id': i} for i in range(250)]
+            await client._patch_song_url(*songs)
+        self.assertEqual(client.batches, [100, 100, 50])
+        # only the song fmlink left out falls back to a single lookup
+        self.assertEqual(client.singles, [7])
+        self.assertEqual(songs[7]['url'], 'single')
+        self.assertEqual((songs[8]['url'], songs[8]['lrclink']), ('batch', 'lrc'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,85 @@
+import asyncio
+import io
+import pathlib
+import tempfile
+import unittest
+
+from mxget import cover
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(f(*args, **kwargs))
+
+    return wrapper
+
+
+class _Response:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    async def read(self) -> bytes:
+        await asyncio.sleep(0.01)
+        return self._data
+
+
+class _Client:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.requests = []
+
+    async def request(self, method: str, url: str, **kwargs) -> _Response:
+        self.requests.append(url)
+        return _Response(self.data)
+
+
+def _png(size: int) -> bytes:
+    out = io.BytesIO()
+    Image.new('RGB', (size, size), (200, 30, 30)).save(out, 'PNG')
+    return out.getvalue()
+
+
+class TestCoverCache(unittest.TestCase):
+    @async_test
+    async def test_single_flight(self):
+        client = _Client(b'\xff\xd8cover')
+        covers = cover.CoverCache(client)
+        results = await asyncio.gather(*[covers.get('http://a/{}.jpg'.format(i % 2)) for i in range(20)])
+        self.assertEqual(sorted(client.requests), ['http://a/0.jpg', 'http://a/1.jpg'])
+        self.assertEqual({pic.data for pic in results}, {b'\xff\xd8cover'})
+        self.assertEqual((covers.fetched, covers.reused), (2, 18))
+        self.assertIsNone(await covers.get(''))
+
+    @async_test
+    async def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            client = _Client(b'\x89PNGcover')
+            await cover.CoverCache(client, cache_dir=pathlib.Path(tmp)).get('http://a/1.png')
+            pic = await cover.CoverCache(client, cache_dir=pathlib.Path(tmp)).get('http://a/1.png')
+            self.assertEqual(client.requests, ['http://a/1.png'])
+            self.assertEqual((pic.data, pic.mime), (b'\x89PNGcover', 'image/png'))
+
+    @unittest.skipIf(Image is None, 'Pillow is not installed')
+    @async_test
+    async def test_shrink(self):
+        client = _Client(_png(2000))
+        pic = await cover.CoverCache(client, max_dimension=500).get('http://a/big.png')
+        self.assertEqual(pic.mime, 'image/jpeg')
+        self.assertEqual(Image.open(io.BytesIO(pic.data)).size, (500, 500))
+
+        client = _Client(_png(300))
+        pic = await cover.CoverCache(client, max_dimension=500).get('http://a/small.png')
+        self.assertEqual(pic.data, client.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import binascii
+import os
+import unittest
+
+from cryptography.hazmat import backends
+from cryptography.hazmat.primitives.ciphers import (
+    Cipher,
+    algorithms,
+    modes,
+)
+
+from mxget import crypto
+from mxget.provider import netease
+
+_KEY = b'0CoJUm6Qyw8W8jud'
+_IV = b'0102030405060708'
+
+
+def _reference_cbc(plain_text: bytes, key: bytes, iv: bytes) -> bytes:
+    padding = 16 - len(plain_text) % 16
+    plain_text = plain_text + bytearray([padding] * padding)
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv), backend=backends.default_backend()).encryptor()
+    return encryptor.update(plain_text) + encryptor.finalize()
+
+
+class TestCrypto(unittest.TestCase):
+    def test_pkcs7(self):
+        for n in range(40):
+            data = os.urandom(n)
+            padded = crypto.pkcs7_pad(data)
+            self.assertEqual(len(padded) % 16, 0)
+            self.assertGreater(len(padded), n)
+            self.assertEqual(crypto.pkcs7_unpad(padded), data)
+
+    def test_cbc_matches_reference(self):
+        for n in (0, 15, 16, 100):
+            data = os.urandom(n)
+            cipher_text = crypto.aes_cbc_encrypt(data, _KEY, _IV)
+            self.assertEqual(cipher_text, _reference_cbc(data, _KEY, _IV))
+            self.assertEqual(crypto.aes_cbc_decrypt(cipher_text, _KEY, _IV), data)
+
+    def test_ecb_roundtrip(self):
+        data = b'{"method": "POST"}'
+        self.assertEqual(crypto.aes_ecb_decrypt(crypto.aes_ecb_encrypt(data, _KEY), _KEY), data)
+
+    def test_encrypt_many(self):
+        payloads = [os.urandom(n) for n in (0, 1, 16, 33, 200)]
+        self.assertEqual(crypto.encrypt_many(payloads, _KEY),
+                         [crypto.aes_ecb_encrypt(p, _KEY) for p in payloads])
+        self.assertEqual(crypto.encrypt_many(payloads, _KEY, _IV),
+                         [crypto.aes_cbc_encrypt(p, _KEY, _IV) for p in payloads])
+
+    def test_rsa_matches_reference(self):
+        modulus = netease._DEFAULT_RSA_PUBLIC_KEY_MODULES
+        exponent = netease._DEFAULT_RSA_PUBLIC_KEY_EXPONENT
+        key = b'0123456789abcdef'
+        rs = pow(int(binascii.hexlify(key), 16), exponent, int(modulus, 16))
+        self.assertEqual(crypto.rsa_encrypt(key, modulus, exponent), format(rs, 'x').zfill(256))
+
+    def test_key_pool(self):
+        modulus = netease._DEFAULT_RSA_PUBLIC_KEY_MODULES
+        exponent = netease._DEFAULT_RSA_PUBLIC_KEY_EXPONENT
+        pool = crypto.RSAKeyPool(modulus, exponent, lambda: os.urandom(16), size=3, reverse=True)
+        self.assertEqual(len(pool), 3)
+        pairs = [pool.get() for _ in range(6)]
+        self.assertEqual(pairs[:3], pairs[3:])
+        for key, enc_sec_key in pairs:
+            self.assertEqual(enc_sec_key, crypto.rsa_encrypt(key[::-1], modulus, exponent))
+
+
+if __name__ == '__main__':
+    unittest.main()
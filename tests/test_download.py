@@ -0,0 +1,304 @@
+import asyncio
+import json
+import pathlib
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import aiohttp
+from aiohttp import web
+
+from mutagen import (
+    id3,
+)
+
+from mxget import (
+    download,
+    limiter,
+    tag,
+)
+
+_BODY = bytes(range(256)) * 1024
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(f(*args, **kwargs))
+
+    return wrapper
+
+
+_sleep = asyncio.sleep
+
+
+class _Client:
+    def __init__(self, session: aiohttp.ClientSession):
+        self._session = session
+
+    async def request(self, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
+        return await self._session.request(method, url, **kwargs)
+
+
+class _Server:
+    def __init__(self, body: bytes = _BODY):
+        self.body = body
+        self.etag = '"v1"'
+        self.cut = None
+        self.received = None
+        self.requests = []
+        self.inflight = 0
+        self.peak = 0
+
+    async def handle(self, request: web.Request):
+        self.requests.append(dict(request.headers, method=request.method))
+        headers = {'ETag': self.etag, 'Accept-Ranges': 'bytes'}
+        ranged = request.headers.get('Range')
+        if ranged and request.headers.get('If-Range', self.etag) == self.etag:
+            first, _, last = ranged[len('bytes='):].partition('-')
+            first, last = int(first), int(last or len(self.body) - 1)
+            if first >= len(self.body):
+                return web.Response(status=416, headers=headers)
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(first, last, len(self.body))
+            self.inflight += 1
+            self.peak = max(self.peak, self.inflight)
+            await asyncio.sleep(0.01)
+            self.inflight -= 1
+            return web.Response(status=206, body=self.body[first:last + 1], headers=headers)
+        if self.cut is not None:
+            # announce the whole body but drop the connection once the client has read ``cut`` bytes
+            resp = web.StreamResponse(headers=headers)
+            resp.content_length = len(self.body)
+            await resp.prepare(request)
+            await resp.write(self.body[:self.cut])
+            await self.received.wait()
+            request.transport.close()
+            return resp
+        return web.Response(body=self.body, headers=headers)
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get('/song.mp3', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = 'http://127.0.0.1:{}/song.mp3'.format(site._server.sockets[0].getsockname()[1])
+        return self
+
+    async def __aexit__(self, *args):
+        await self._runner.cleanup()
+
+
+class _Tracker:
+    """Sets ``event`` once ``count`` bytes of the body have been received."""
+
+    def __init__(self, count: int, event: asyncio.Event):
+        self.count = count
+        self.event = event
+        self.done = 0
+
+    def begin(self, total, offset=0):
+        self.done = offset
+
+    def advance(self, n):
+        self.done += n
+        if self.done >= self.count:
+            self.event.set()
+
+
+def _interrupt(file_path: pathlib.Path, url: str, size: int, etag: str) -> None:
+    download.part_path(file_path).write_bytes(_BODY[:size])
+    download.meta_path(file_path).write_text(json.dumps({
+        'url': url,
+        'length': len(_BODY),
+        'etag': etag,
+        'last_modified': None,
+    }))
+
+
+class TestFetch(unittest.TestCase):
+    @async_test
+    async def test_fresh(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = pathlib.Path(tmp, 'song.mp3')
+            async with _Server() as server, aiohttp.ClientSession() as session:
+                transfer = await download.fetch(_Client(session), server.url, file_path)
+            self.assertEqual(file_path.read_bytes(), _BODY)
+            self.assertEqual(transfer.size, len(_BODY))
+            self.assertFalse(download.part_path(file_path).exists())
+            self.assertFalse(download.meta_path(file_path).exists())
+
+    @async_test
+    async def test_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = pathlib.Path(tmp, 'song.mp3')
+            async with _Server() as server, aiohttp.ClientSession() as session:
+                _interrupt(file_path, server.url, 1000, server.etag)
+                transfer = await download.fetch(_Client(session), server.url, file_path)
+            self.assertEqual(server.requests[0]['Range'], 'bytes=1000-')
+            self.assertEqual(server.requests[0]['If-Range'], server.etag)
+            self.assertEqual(file_path.read_bytes(), _BODY)
+            self.assertEqual((transfer.offset, transfer.size), (1000, len(_BODY) - 1000))
+
+    @async_test
+    async def test_resume_after_broken_stream(self):
+        received = asyncio.Event()
+        tracker = _Tracker(100000, received)
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = pathlib.Path(tmp, 'song.mp3')
+            async with _Server() as server, aiohttp.ClientSession() as session:
+                server.cut, server.received = 100000, received
+                with self.assertRaises(aiohttp.ClientPayloadError):
+                    await download.fetch(_Client(session), server.url, file_path, tracker=tracker)
+                # what was still buffered in memory reaches the part file
+                self.assertEqual(download.part_path(file_path).stat().st_size, 100000)
+
+                server.cut = None
+                transfer = await download.fetch(_Client(session), server.url, file_path)
+            self.assertEqual(server.requests[1]['Range'], 'bytes=100000-')
+            self.assertEqual(file_path.read_bytes(), _BODY)
+            self.assertEqual(transfer.offset, 100000)
+
+    @async_test
+    async def test_restart_when_changed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = pathlib.Path(tmp, 'song.mp3')
+            async with _Server() as server, aiohttp.ClientSession() as session:
+                _interrupt(file_path, server.url, 1000, '"v0"')
+                transfer = await download.fetch(_Client(session), server.url, file_path)
+            self.assertEqual(file_path.read_bytes(), _BODY)
+            self.assertEqual((transfer.offset, transfer.size), (0, len(_BODY)))
+
+    @async_test
+    async def test_complete_part(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = pathlib.Path(tmp, 'song.mp3')
+            async with _Server() as server, aiohttp.ClientSession() as session:
+                _interrupt(file_path, server.url, len(_BODY), server.etag)
+                transfer = await download.fetch(_Client(session), server.url, file_path)
+            self.assertEqual(file_path.read_bytes(), _BODY)
+            self.assertEqual(transfer.size, 0)
+
+    @async_test
+    async def test_bandwidth(self):
+        # the first second's worth passes as a burst, the rest at the host's rate;
+        # the limiter's clock stands still, so its last wait is the throttled transfer time
+        clock = types.SimpleNamespace(monotonic=lambda: 0.0)
+        waits = []
+
+        async def sleep(delay):
+            waits.append(delay)
+            await _sleep(0)
+
+        with mock.patch.object(limiter, 'time', clock), mock.patch.object(asyncio, 'sleep', sleep):
+            limiter.configure({'127.0.0.1': {'bandwidth': len(_BODY) // 2}})
+            try:
+                with tempfile.TemporaryDirectory() as tmp:
+                    file_path = pathlib.Path(tmp, 'song.mp3')
+                    async with _Server() as server, aiohttp.ClientSession() as session:
+                        await download.fetch(_Client(session), server.url, file_path)
+                    self.assertEqual(file_path.read_bytes(), _BODY)
+            finally:
+                limiter.configure(None)
+        self.assertAlmostEqual(max(waits), 1.0, places=3)
+
+
+class TestSegmentedFetch(unittest.TestCase):
+    @async_test
+    async def test_respects_slots(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = pathlib.Path(tmp, 'song.mp3')
+            slots = asyncio.Semaphore(3)
+            await slots.acquire()
+            async with _Server() as server, aiohttp.ClientSession() as session:
+                transfer = await download.fetch(_Client(session), server.url, file_path, segments=8,
+                                                min_segment_size=16 * 1024, slots=slots)
+            self.assertEqual(file_path.read_bytes(), _BODY)
+            self.assertEqual((transfer.size, transfer.connections), (len(_BODY), 3))
+            self.assertEqual(server.peak, 3)
+            self.assertEqual(sum(1 for r in server.requests if 'Range' in r), 8)
+            self.assertFalse(slots.locked())
+
+    @async_test
+    async def test_resume_pending_segments(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = pathlib.Path(tmp, 'song.mp3')
+            half = len(_BODY) // 2
+            part = bytearray(len(_BODY))
+            part[:half] = _BODY[:half]
+            download.part_path(file_path).write_bytes(bytes(part))
+            async with _Server() as server, aiohttp.ClientSession() as session:
+                download.meta_path(file_path).write_text(json.dumps({
+                    'url': server.url,
+                    'length': len(_BODY),
+                    'etag': server.etag,
+                    'last_modified': None,
+                    'segments': [[half, len(_BODY) - 1]],
+                }))
+                transfer = await download.fetch(_Client(session), server.url, file_path, segments=4)
+            self.assertEqual(server.requests[0]['Range'], 'bytes={}-{}'.format(half, len(_BODY) - 1))
+            self.assertEqual(file_path.read_bytes(), _BODY)
+            self.assertEqual((transfer.offset, transfer.size), (half, len(_BODY) - half))
+
+    @async_test
+    async def test_small_file_streams(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = pathlib.Path(tmp, 'song.mp3')
+            async with _Server() as server, aiohttp.ClientSession() as session:
+                transfer = await download.fetch(_Client(session), server.url, file_path, segments=4)
+            self.assertEqual(file_path.read_bytes(), _BODY)
+            self.assertEqual(transfer.connections, 1)
+
+
+class TestPrefixedFetch(unittest.TestCase):
+    @async_test
+    async def test_replaces_upstream_tag(self):
+        upstream = tag.header([id3.TIT2(encoding=id3.Encoding.UTF8, text='upstream'),
+                               id3.TCON(encoding=id3.Encoding.UTF8, text='genre')])
+        frames = [id3.TIT2(encoding=id3.Encoding.UTF8, text='ours')]
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = pathlib.Path(tmp, 'song.mp3')
+            async with _Server(upstream + _BODY) as server, aiohttp.ClientSession() as session:
+                transfer = await download.fetch(_Client(session), server.url, file_path,
+                                                prefix=lambda up: tag.header(frames, up))
+            self.assertTrue(transfer.tagged)
+            self.assertEqual(transfer.size, len(upstream) + len(_BODY))
+            audio = id3.ID3(str(file_path))
+            self.assertEqual((str(audio['TIT2']), str(audio['TCON'])), ('ours', 'genre'))
+            self.assertTrue(file_path.read_bytes().endswith(_BODY))
+            self.assertEqual(file_path.stat().st_size, audio.size + len(_BODY))
+
+    @async_test
+    async def test_resume_after_prefix(self):
+        upstream = tag.header([id3.TIT2(encoding=id3.Encoding.UTF8, text='upstream')])
+        header = tag.header([id3.TIT2(encoding=id3.Encoding.UTF8, text='ours')], upstream)
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = pathlib.Path(tmp, 'song.mp3')
+            async with _Server(upstream + _BODY) as server, aiohttp.ClientSession() as session:
+                download.part_path(file_path).write_bytes(header + _BODY[:1000])
+                download.meta_path(file_path).write_text(json.dumps({
+                    'url': server.url,
+                    'length': len(upstream) + len(_BODY),
+                    'etag': server.etag,
+                    'last_modified': None,
+                    'prefix': len(header),
+                    'skip': len(upstream),
+                }))
+                transfer = await download.fetch(_Client(session), server.url, file_path, prefix=lambda up: b'')
+            self.assertEqual(server.requests[0]['Range'], 'bytes={}-'.format(len(upstream) + 1000))
+            self.assertEqual(file_path.read_bytes(), header + _BODY)
+            self.assertTrue(transfer.tagged)
+
+    @async_test
+    async def test_untagged_upstream(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = pathlib.Path(tmp, 'song.mp3')
+            async with _Server(b'\xff\xfb') as server, aiohttp.ClientSession() as session:
+                await download.fetch(_Client(session), server.url, file_path, prefix=lambda up: b'ID3:' + up)
+            self.assertEqual(file_path.read_bytes(), b'ID3:\xff\xfb')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+from mxget import jsonstream
+
+
+def _events(value):
+    if isinstance(value, dict):
+        yield 'start_map', None
+        for k, v in value.items():
+            yield 'map_key', k
+            yield from _events(v)
+        yield 'end_map', None
+    elif isinstance(value, list):
+        yield 'start_array', None
+        for v in value:
+            yield from _events(v)
+        yield 'end_array', None
+    else:
+        yield 'string', value
+
+
+def _prune(doc, paths):
+    pruner = jsonstream._Pruner(paths)
+    events = list(_events(doc))
+    pruner.feed(events[:5])
+    pruner.feed(events[5:])
+    return pruner.root
+
+
+class TestPruner(unittest.TestCase):
+    def test_keeps_only_paths(self):
+        doc = {
+            'code': 200,
+            'playlist': {
+                'id': 1,
+                'description': 'x' * 100,
+                'tracks': [
+                    {'id': 1, 'name': 'a', 'ar': [{'id': 9, 'name': 'b'}], 'al': {'name': 'c', 'picUrl': 'd'},
+                     'privilege': {'fee': 8, 'list': [1, 2, 3]}},
+                ],
+                'trackIds': [{'id': 1, 'v': 3}, {'id': 2, 'v': 4}],
+            },
+        }
+        paths = ('code', 'playlist.id', 'playlist.tracks.item.id', 'playlist.tracks.item.ar.item.name',
+                 'playlist.tracks.item.al', 'playlist.trackIds.item.id')
+        self.assertEqual(_prune(doc, paths), {
+            'code': 200,
+            'playlist': {
+                'id': 1,
+                'tracks': [{'id': 1, 'ar': [{'name': 'b'}], 'al': {'name': 'c', 'picUrl': 'd'}}],
+                'trackIds': [{'id': 1}, {'id': 2}],
+            },
+        })
+
+    def test_root_path(self):
+        doc = {'a': [1, {'b': 2}]}
+        self.assertEqual(_prune(doc, ('',)), doc)
+
+
+if __name__ == '__main__':
+    unittest.main()
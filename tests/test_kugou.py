@@ -56,5 +56,42 @@ class TestKuGou(unittest.TestCase):
             self.assertIsNotNone(resp)
 
 
+class _AlbumClient(kugou.KuGou):
+    """Answers album-info requests locally and records them."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    async def get_album_info_raw(self, album_id):
+        self.calls.append(album_id)
+        # let the other lookups of this album pile up behind the first
+        await asyncio.sleep(0.01)
+        return {'data': {'albumname': 'album {}'.format(album_id)}}
+
+
+class TestAlbumInfo(unittest.TestCase):
+    def setUp(self):
+        kugou._album_name_cache.clear()
+
+    def tearDown(self):
+        kugou._album_name_cache.clear()
+
+    @async_test
+    async def test_dedupe(self):
+        async with _AlbumClient() as client:
+            songs = [{'albumid': album_id} for album_id in (1, 1, 2, 0, 2, 3)]
+            saved = await client._patch_album_info(*songs)
+            self.assertEqual(sorted(client.calls), ['1', '2', '3'])
+            self.assertEqual(saved, 2)
+            self.assertEqual(songs[1]['album_name'], 'album 1')
+            self.assertNotIn('album_name', songs[3])
+
+            # a later page reuses the cached names
+            saved = await client._patch_album_info(*[{'albumid': album_id} for album_id in (1, 3)])
+        self.assertEqual(len(client.calls), 3)
+        self.assertEqual(saved, 2)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,212 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import aiohttp
+from aiohttp import web
+
+from mxget import limiter
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(f(*args, **kwargs))
+
+    return wrapper
+
+
+_sleep = asyncio.sleep
+
+
+class _FrozenClock:
+    """
+    Stands in for ``time`` and ``asyncio.sleep`` in the limiter. Time stands
+    still, so every sleep records the deadline its reservation was given.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.deadlines = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float) -> None:
+        self.deadlines.append(self.now + delay)
+        await _sleep(0)
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    @async_test
+    async def test_acquire_respects_limit(self):
+        lim = limiter.AdaptiveLimiter(initial_limit=2)
+        peak = 0
+
+        async def worker():
+            nonlocal peak
+            async with lim:
+                peak = max(peak, lim.inflight)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*[worker() for _ in range(10)])
+        self.assertEqual(peak, 2)
+        self.assertEqual(lim.inflight, 0)
+
+    @async_test
+    async def test_grows_while_latency_flat(self):
+        lim = limiter.AdaptiveLimiter(initial_limit=4, max_limit=8)
+        for _ in range(4):
+            await lim.acquire()
+        for _ in range(10):
+            lim.on_success(0.1)
+        self.assertEqual(lim.limit, 8)
+
+    @async_test
+    async def test_holds_when_latency_rises(self):
+        lim = limiter.AdaptiveLimiter(initial_limit=4)
+        for _ in range(4):
+            await lim.acquire()
+        lim.on_success(0.1)
+        limit = lim.limit
+        lim.on_success(1.0)
+        self.assertEqual(lim.limit, limit)
+
+    def test_backoff_on_drop(self):
+        lim = limiter.AdaptiveLimiter(initial_limit=10, min_limit=2)
+        lim.on_dropped()
+        self.assertEqual(lim.limit, 9)
+        for _ in range(100):
+            lim.on_dropped()
+        self.assertEqual(lim.limit, 2)
+
+    @async_test
+    async def test_cancelled_waiter_does_not_leak(self):
+        lim = limiter.AdaptiveLimiter(initial_limit=1)
+        await lim.acquire()
+        waiter = asyncio.ensure_future(lim.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        lim.release()
+        self.assertEqual(lim.inflight, 0)
+
+
+class TestHostBudget(unittest.TestCase):
+    def tearDown(self):
+        limiter.configure(None)
+
+    @async_test
+    async def test_token_bucket_rate(self):
+        clock = _FrozenClock()
+        with mock.patch.object(limiter, 'time', clock), mock.patch.object(asyncio, 'sleep', clock.sleep):
+            bucket = limiter.TokenBucket(rate=100, burst=1)
+            for _ in range(11):
+                await bucket.acquire()
+        # the burst passes at once, then one token every 10 ms
+        self.assertEqual(len(clock.deadlines), 10)
+        self.assertAlmostEqual(clock.deadlines[-1], 0.1)
+
+    def test_rules_match_subdomains(self):
+        limiter.configure({
+            'kugou.com': {'rate': 5, 'concurrency': 4},
+            '*': {'concurrency': 64},
+        })
+        budget = limiter.get_budget('mobilecdn.kugou.com')
+        self.assertIs(budget, limiter.get_budget('m.kugou.com'))
+        self.assertEqual(budget.slots.limit, 4)
+        self.assertEqual(limiter.get_budget('music.163.com').slots.limit, 64)
+        self.assertIsNone(limiter.get_budget('music.163.com').bucket)
+        # "*" hands out one budget per host rather than one for all of them
+        self.assertIs(limiter.get_budget('music.163.com'), limiter.get_budget('MUSIC.163.com'))
+        self.assertIsNot(limiter.get_budget('music.163.com'), limiter.get_budget('m10.music.126.net'))
+
+    def test_invalid_rule(self):
+        with self.assertRaises(ValueError):
+            limiter.configure({'music.163.com': {'rate': -1}})
+        with self.assertRaises(ValueError):
+            limiter.configure({'music.163.com': 10})
+
+    def test_no_rules(self):
+        limiter.configure({})
+        self.assertIsNone(limiter.get_budget('music.163.com'))
+
+
+class TestRequest(unittest.TestCase):
+    def tearDown(self):
+        limiter.configure(None)
+
+    @async_test
+    async def test_slot_held_until_body_is_done(self):
+        async def handle(request: web.Request):
+            resp = web.StreamResponse()
+            await resp.prepare(request)
+            for _ in range(3):
+                await resp.write(b'x' * 1024)
+                await asyncio.sleep(0.01)
+            return resp
+
+        app = web.Application()
+        app.router.add_get('/', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        url = 'http://127.0.0.1:{}/'.format(site._server.sockets[0].getsockname()[1])
+        limiter.configure({'127.0.0.1': {'concurrency': 2}})
+        adaptive = limiter.get_limiter('127.0.0.1')
+        budget = limiter.get_budget('127.0.0.1')
+        try:
+            async with aiohttp.ClientSession() as session:
+                resp = await limiter.request(session, 'GET', url)
+                self.assertEqual((adaptive.inflight, budget.slots.inflight), (1, 1))
+                self.assertEqual(len(await resp.read()), 3 * 1024)
+                self.assertEqual((adaptive.inflight, budget.slots.inflight), (0, 0))
+
+                resp = await limiter.request(session, 'GET', url)
+                resp.release()
+                self.assertEqual((adaptive.inflight, budget.slots.inflight), (0, 0))
+        finally:
+            await runner.cleanup()
+
+
+class TestBandwidth(unittest.TestCase):
+    def tearDown(self):
+        limiter.configure(None)
+        limiter.set_bandwidth(None)
+
+    def test_buckets(self):
+        self.assertEqual(limiter.bandwidth_buckets('music.163.com'), [])
+        limiter.set_bandwidth(1000)
+        limiter.configure({'qq.com': {'bandwidth': 500}})
+        self.assertEqual([b.rate for b in limiter.bandwidth_buckets('mobileoc.music.tc.qq.com')], [1000, 500])
+        self.assertEqual([b.rate for b in limiter.bandwidth_buckets('music.163.com')], [1000])
+        with self.assertRaises(ValueError):
+            limiter.set_bandwidth(-1)
+        with self.assertRaises(ValueError):
+            limiter.configure({'qq.com': {'bandwidth': '1M'}})
+
+    @async_test
+    async def test_transfers_take_turns(self):
+        clock = _FrozenClock()
+        current = [None]
+        finished = {}
+
+        async def sleep(delay):
+            # acquire_all reserves and sleeps without yielding, so current names the caller
+            finished[current[0]] = clock.now + delay
+            await _sleep(0)
+
+        async def transfer(name, chunks):
+            for _ in range(chunks):
+                current[0] = name
+                await limiter.acquire_all([bucket], 1000)
+
+        with mock.patch.object(limiter, 'time', clock), mock.patch.object(asyncio, 'sleep', sleep):
+            bucket = limiter.TokenBucket(rate=100000, burst=1)
+            await asyncio.gather(transfer('a', 20), transfer('b', 20))
+        # neither transfer runs ahead: both end together at the combined rate
+        self.assertAlmostEqual(finished['a'], 0.39, places=3)
+        self.assertAlmostEqual(finished['b'], 0.4, places=3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import pathlib
+import tempfile
+import unittest
+import os
+from unittest import mock
+
+from mxget import (
+    manifest,
+    store,
+)
+
+
+def _song(root: pathlib.Path, name: str, platform: str = None, song_id: str = None) -> pathlib.Path:
+    file_path = root.joinpath(name)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_bytes(b'\xff\xfb' + name.encode() * 100)
+    if platform is not None:
+        manifest.write_id(file_path, platform, song_id)
+    return file_path
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self._tmp.name)
+        self.book = manifest.Manifest(self.root)
+
+    def tearDown(self):
+        self.book.close()
+        self._tmp.cleanup()
+
+    def test_lookup(self):
+        entries = [self.book.entry_for('netease', i, _song(self.root, 'a/{}.mp3'.format(i))) for i in range(1200)]
+        self.book.record(*entries)
+        found = self.book.lookup('netease', [str(i) for i in range(0, 1500, 3)])
+        self.assertEqual(sorted(found), sorted(str(i) for i in range(0, 1200, 3)))
+        self.assertEqual(found['3'].path, 'a/3.mp3')
+        self.assertEqual(self.book.lookup('qq', ['3']), {})
+
+    def test_exists(self):
+        file_path = _song(self.root, 'b.mp3')
+        entry = self.book.entry_for('qq', '1', file_path)
+        self.assertTrue(self.book.exists(entry))
+        file_path.write_bytes(b'truncated')
+        self.assertFalse(self.book.exists(entry))
+        file_path.unlink()
+        self.assertFalse(self.book.exists(entry))
+
+    def test_rebuild(self):
+        _song(self.root, 'x/renamed.mp3', 'kugou', 'abc')
+        _song(self.root, 'y.mp3', 'netease', '42')
+        _song(self.root, 'untracked.mp3')
+        _song(self.root, '.objects/hidden.mp3', 'netease', '7')
+        self.book.record(self.book.entry_for('netease', '99', _song(self.root, 'stale.mp3')))
+
+        self.assertEqual(self.book.rebuild(), (2, 2))
+        self.assertEqual(self.book.lookup('kugou', ['abc'])['abc'].path, 'x/renamed.mp3')
+        self.assertIn('42', self.book.lookup('netease', ['42', '7', '99']))
+        self.assertEqual(len(self.book.lookup('netease', ['42', '7', '99'])), 1)
+        self.assertEqual(manifest.read_id(self.root.joinpath('y.mp3')), ('netease', '42'))
+
+    def test_rebuild_skips_unreadable(self):
+        _song(self.root, 'a.mp3', 'netease', '1')
+        _song(self.root, 'b.mp3', 'netease', '2')
+        real_hash = manifest.audio_hash
+
+        def audio_hash(file_path):
+            if file_path.name == 'b.mp3':
+                raise PermissionError(file_path)
+            return real_hash(file_path)
+
+        with mock.patch.object(manifest, 'audio_hash', audio_hash):
+            self.assertEqual(self.book.rebuild(), (1, 1))
+        self.assertEqual(list(self.book.lookup('netease', ['1', '2'])), ['1'])
+
+    def test_same_audio_shares_object(self):
+        # one track released under two ids: the tags differ, the audio doesn't
+        first = _song(self.root, 'netease/song.mp3')
+        second = _song(self.root, 'qq/song.mp3')
+        second.write_bytes(first.read_bytes() + b'TAG' + b'\x00' * 125)
+        manifest.write_id(first, 'netease', '1')
+        manifest.write_id(second, 'qq', '002')
+        self.assertNotEqual(first.read_bytes(), second.read_bytes())
+
+        entries = [self.book.entry_for('netease', '1', first), self.book.entry_for('qq', '002', second)]
+        self.assertEqual(entries[0].hash, entries[1].hash)
+        self.assertNotEqual(entries[0].hash, self.book.entry_for('kugou', 'x', _song(self.root, 'other.mp3')).hash)
+
+        objects = [store.ingest(self.root, file_path, entry.hash) for file_path, entry in zip((first, second), entries)]
+        self.assertEqual(objects[0], objects[1])
+        self.assertTrue(os.path.samefile(str(first), str(second)))
+
+
+if __name__ == '__main__':
+    unittest.main()
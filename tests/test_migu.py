@@ -1,6 +1,7 @@
 import asyncio
 import unittest
 
+from mxget import exceptions
 from mxget.provider import migu
 
 
@@ -44,5 +45,51 @@ class TestMiGu(unittest.TestCase):
             self.assertIsNotNone(resp)
 
 
+class _ArtistClient(migu.MiGu):
+    """Serves ``total`` artist songs and, like MiGu, answers pages past the end with an error code."""
+
+    def __init__(self, total: int, report_total: bool = False):
+        super().__init__()
+        self.total = total
+        self.report_total = report_total
+        self.pages = []
+
+    async def get_artist_songs_raw(self, singer_id, page=1, page_size=20):
+        self.pages.append(page)
+        start = (page - 1) * page_size
+        if start >= self.total:
+            raise exceptions.ResponseError('get artist songs: 无更多数据')
+        item_list = []
+        for i in range(start, min(start + page_size, self.total)):
+            song = {'songId': str(i), 'songName': 'song', 'singer': 'singer', 'contentId': str(i)}
+            item_list.extend([{'song': song}, {}])
+        data = {'contentItemList': [{'itemList': item_list}]}
+        if self.report_total:
+            data['totalCount'] = self.total
+        return {'code': '000000', 'data': data}
+
+
+class TestArtistSongs(unittest.TestCase):
+    @async_test
+    async def test_error_past_last_page_ends_iteration(self):
+        async with _ArtistClient(45) as client:
+            songs = [s async for s in client.iter_artist_songs('1', page_size=20, lookahead=1)]
+        self.assertEqual([s.id for s in songs], [str(i) for i in range(45)])
+        self.assertIn(4, client.pages)
+
+    @async_test
+    async def test_total_stops_paging(self):
+        async with _ArtistClient(45, report_total=True) as client:
+            songs = [s async for s in client.iter_artist_songs('1', page_size=20, lookahead=1)]
+        self.assertEqual(len(songs), 45)
+        self.assertEqual(sorted(client.pages), [1, 2, 3])
+
+    @async_test
+    async def test_first_page_error_is_raised(self):
+        async with _ArtistClient(0) as client:
+            with self.assertRaises(exceptions.ResponseError):
+                await client.get_artist_songs_page('1')
+
+
 if __name__ == '__main__':
     unittest.main()
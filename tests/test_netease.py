@@ -1,6 +1,7 @@
 import asyncio
 import unittest
 
+from mxget import exceptions
 from mxget.provider import netease
 
 
@@ -56,5 +57,95 @@ class TestNetEase(unittest.TestCase):
             self.assertIsNotNone(resp)
 
 
+def _track(song_id: int) -> dict:
+    return {
+        'id': song_id,
+        'name': 'song {}'.format(song_id),
+        'ar': [{'name': 'artist'}],
+        'al': {'name': 'album', 'picUrl': ''},
+    }
+
+
+class _Stub:
+    """Stands in for the NetEase endpoints and records request sizes and concurrency."""
+
+    def __init__(self, fail_urls: bool = False):
+        self.url_batches = []
+        self.song_batches = []
+        self.inflight = 0
+        self.peak = 0
+        self.fail_urls = fail_urls
+
+    async def _enter(self):
+        self.inflight += 1
+        self.peak = max(self.peak, self.inflight)
+        await asyncio.sleep(0.01)
+        self.inflight -= 1
+
+    async def get_songs_url_raw(self, *song_ids) -> dict:
+        self.url_batches.append(len(song_ids))
+        await self._enter()
+        if self.fail_urls:
+            raise exceptions.RequestError('get song url: stub')
+        return {'data': [{'id': i, 'code': 200, 'url': 'http://stub/{}.mp3'.format(i)} for i in song_ids]}
+
+    async def get_songs_raw(self, *song_ids) -> dict:
+        self.song_batches.append(len(song_ids))
+        await self._enter()
+        return {'songs': [_track(i) for i in song_ids]}
+
+    async def get_playlist_raw(self, playlist_id, paths=None) -> dict:
+        return {'playlist': {
+            'id': playlist_id,
+            'name': 'stub',
+            'coverImgUrl': '',
+            'trackCount': 2500,
+            'tracks': [_track(i) for i in range(netease._SONG_REQUEST_LIMIT)],
+            'trackIds': [{'id': i} for i in range(2500)],
+        }}
+
+
+def _stubbed(stub: _Stub, **kwargs) -> netease.NetEase:
+    client = netease.NetEase(**kwargs)
+    client.get_songs_url_raw = stub.get_songs_url_raw
+    client.get_songs_raw = stub.get_songs_raw
+    client.get_playlist_raw = stub.get_playlist_raw
+    return client
+
+
+class TestChunks(unittest.TestCase):
+    @async_test
+    async def test_url_batches(self):
+        stub = _Stub()
+        async with _stubbed(stub, url_batch_size=100, chunk_concurrency=2) as client:
+            songs = [_track(i) for i in range(250)]
+            await client._patch_song_url(*songs)
+        self.assertEqual(sorted(stub.url_batches), [50, 100, 100])
+        self.assertEqual(stub.peak, 2)
+        self.assertTrue(all(s['url'] for s in songs))
+
+    @async_test
+    async def test_playlist_shares_one_bound(self):
+        stub = _Stub()
+        async with _stubbed(stub, url_batch_size=200, chunk_concurrency=3) as client:
+            playlist = await client.get_playlist(1)
+        self.assertEqual(sorted(stub.song_batches), [500, 1000])
+        self.assertEqual(sum(stub.url_batches), 2500)
+        self.assertLessEqual(max(stub.url_batches), 200)
+        self.assertEqual(stub.peak, 3)
+        self.assertEqual(sum(1 for s in playlist.songs if s.playable), 2500)
+
+    @async_test
+    async def test_url_errors(self):
+        stub = _Stub(fail_urls=True)
+        async with _stubbed(stub) as client:
+            with self.assertRaises(exceptions.RequestError):
+                await client._patch_song_url(_track(1))
+            # a playlist keeps the songs of pages whose URL lookup failed
+            playlist = await client.get_playlist(1)
+        self.assertEqual(len(playlist.songs), 2500)
+        self.assertFalse(any(s.playable for s in playlist.songs))
+
+
 if __name__ == '__main__':
     unittest.main()
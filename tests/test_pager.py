@@ -0,0 +1,57 @@
+import asyncio
+import unittest
+
+from mxget import pager
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(f(*args, **kwargs))
+
+    return wrapper
+
+
+class TestIterPages(unittest.TestCase):
+    @async_test
+    async def test_order_and_lookahead(self):
+        inflight = 0
+        peak = 0
+
+        async def fetch(page):
+            nonlocal inflight, peak
+            inflight += 1
+            peak = max(peak, inflight)
+            await asyncio.sleep(0.01 * (5 - page % 5))
+            inflight -= 1
+            return page
+
+        results = [page async for page in pager.iter_pages(fetch, range(20), lookahead=3)]
+        self.assertEqual(results, list(range(20)))
+        self.assertEqual(peak, 3)
+
+    @async_test
+    async def test_early_stop_cancels(self):
+        started = []
+        cancelled = []
+
+        async def fetch(page):
+            started.append(page)
+            try:
+                await asyncio.sleep(0 if page == 0 else 1)
+            except asyncio.CancelledError:
+                cancelled.append(page)
+                raise
+            return page
+
+        pages = pager.iter_pages(fetch, range(100), lookahead=4)
+        async for _ in pages:
+            break
+        await pages.aclose()
+        await asyncio.sleep(0)
+        self.assertLessEqual(len(started), 5)
+        self.assertEqual(sorted(cancelled), started[1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
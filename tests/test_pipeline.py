@@ -0,0 +1,85 @@
+import asyncio
+import unittest
+
+from mxget import (
+    exceptions,
+    pipeline,
+)
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(f(*args, **kwargs))
+
+    return wrapper
+
+
+class TestPipeline(unittest.TestCase):
+    def test_invalid_graph(self):
+        async def noop(item):
+            pass
+
+        with self.assertRaises(ValueError):
+            pipeline.Pipeline(pipeline.Step('a', noop, requires=('b',)), pipeline.Step('b', noop))
+        with self.assertRaises(ValueError):
+            pipeline.Pipeline(pipeline.Step('a', noop), pipeline.Step('a', noop))
+
+    @async_test
+    async def test_items_advance_independently(self):
+        release = asyncio.Event()
+        done = []
+
+        async def first(item):
+            if item['id'] == 0:
+                await release.wait()
+            item['first'] = True
+
+        async def second(item):
+            self.assertTrue(item['first'])
+            done.append(item['id'])
+            if len(done) == 9:
+                release.set()
+
+        items = [{'id': i} for i in range(10)]
+        p = pipeline.Pipeline(
+            pipeline.Step('first', first),
+            pipeline.Step('second', second, requires=('first',)),
+        )
+        # item 0 only leaves its first step once the other nine are through the
+        # second one, which per-pass barriers would never allow
+        await asyncio.wait_for(p.run(*items), 5)
+        self.assertEqual(done[-1], 0)
+        self.assertEqual(sorted(done), list(range(10)))
+
+    @async_test
+    async def test_shared_budget_and_failure(self):
+        inflight = 0
+        peak = 0
+
+        async def step(item):
+            nonlocal inflight, peak
+            inflight += 1
+            peak = max(peak, inflight)
+            await asyncio.sleep(0.01)
+            inflight -= 1
+            if item['id'] % 2:
+                raise exceptions.ResponseError('odd')
+
+        async def after(item):
+            item['after'] = True
+
+        items = [{'id': i} for i in range(20)]
+        p = pipeline.Pipeline(
+            pipeline.Step('a', step),
+            pipeline.Step('b', step),
+            pipeline.Step('after', after, requires=('a', 'b')),
+            concurrency=3,
+        )
+        await p.run(*items)
+        self.assertEqual(peak, 3)
+        self.assertEqual([item['id'] for item in items if item.get('after')], list(range(0, 20, 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import asyncio
+import io
+import json
+import unittest
+
+from mxget import progress
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(f(*args, **kwargs))
+
+    return wrapper
+
+
+class TestProgress(unittest.TestCase):
+    def test_counts(self):
+        monitor = progress.Progress(queued=3)
+        events = []
+        monitor.add_listener(lambda event, data: events.append((event, data)))
+
+        first = monitor.open('a')
+        first.begin(1000)
+        first.advance(1000)
+        monitor.close(first)
+        second = monitor.open('b')
+        second.begin(1000, offset=400)
+        second.advance(100)
+
+        snapshot = monitor.snapshot()
+        self.assertEqual((snapshot['completed'], snapshot['active'], snapshot['queued']), (1, 1, 1))
+        self.assertEqual(snapshot['bytes'], 1100)
+        self.assertEqual(snapshot['files'][0]['done'], 500)
+        # 500 left on the active file plus one queued file of the average size
+        self.assertAlmostEqual(monitor.eta(rate=100.0), 15.0)
+
+        monitor.close(second, ok=False)
+        self.assertEqual((monitor.completed, monitor.failed), (1, 1))
+        self.assertEqual([event for event, _ in events], ['start', 'finish', 'start', 'finish'])
+        self.assertEqual(events[-1][1]['bytes'], 100)
+
+    def test_eta_unknown(self):
+        monitor = progress.Progress(queued=2)
+        self.assertIsNone(monitor.eta(rate=100.0))
+        handle = monitor.open('a')
+        handle.begin(None)
+        self.assertIsNone(monitor.eta(rate=100.0))
+
+    @async_test
+    async def test_json_lines(self):
+        out = io.StringIO()
+        monitor = progress.Progress(queued=1)
+        monitor.add_listener(progress.JSONLines(out))
+        ticker = asyncio.ensure_future(monitor.run(interval=0.01))
+        handle = monitor.open('a')
+        handle.begin(10)
+        handle.advance(10)
+        await asyncio.sleep(0.05)
+        monitor.close(handle)
+        ticker.cancel()
+        await asyncio.gather(ticker, return_exceptions=True)
+
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        events = [record['event'] for record in records]
+        self.assertEqual(events[0], 'start')
+        self.assertIn('progress', events)
+        self.assertEqual(events[-2:], ['finish', 'summary'])
+        self.assertEqual((records[-1]['completed'], records[-1]['bytes']), (1, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
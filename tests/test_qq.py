@@ -1,8 +1,11 @@
 import asyncio
+import json
 import unittest
 
 from mxget.provider import qq
 
+import fakes
+
 
 def async_test(f):
     def wrapper(*args, **kwargs):
@@ -56,5 +59,77 @@ class TestQQ(unittest.TestCase):
             self.assertIsNotNone(resp)
 
 
+class _VkeyClient(fakes.LocalClient, qq.QQ):
+    """Answers musicu vkey batches and single lookups, recording their sizes."""
+
+    def __init__(self, expiration: int = 80400, missing: tuple = ()):
+        super().__init__()
+        self.expiration = expiration
+        self.missing = missing
+        self.batches = []
+        self.singles = []
+
+    async def answer(self, method: str, url: str, **kwargs):
+        if url == qq._API_GET_SONG_URL:
+            self.singles.append(kwargs['params']['songmid'])
+            return {'code': 0, 'data': {'items': [{
+                'subcode': 0, 'filename': kwargs['params']['filename'], 'vkey': 'single',
+            }]}}
+
+        param = json.loads(kwargs['data'])['req_0']['param']
+        self.batches.append(len(param['songmid']))
+        return {'code': 0, 'req_0': {'code': 0, 'data': {
+            'expiration': self.expiration,
+            'midurlinfo': [{
+                'songmid': mid,
+                'filename': filename,
+                'purl': '' if mid in self.missing else filename + '?vkey=batch',
+                'vkey': '' if mid in self.missing else 'batch',
+            } for mid, filename in zip(param['songmid'], param['filename'])],
+        }}}
+
+
+def _songs(n: int) -> list:
+    return [{'mid': 'song{}'.format(i), 'file': {'media_mid': 'media{}'.format(i)}} for i in range(n)]
+
+
+class TestSongsUrl(unittest.TestCase):
+    def setUp(self):
+        qq._url_cache.clear()
+
+    def tearDown(self):
+        qq._url_cache.clear()
+
+    @async_test
+    async def test_batches(self):
+        async with _VkeyClient(missing=('song7',)) as client:
+            songs = _songs(250)
+            await client._patch_song_url(*songs)
+        self.assertEqual(client.batches, [100, 100, 50])
+        # only the song the batch couldn't resolve falls back to a single lookup
+        self.assertEqual(client.singles, ['song7'])
+        self.assertTrue(all(s['url'] for s in songs))
+        self.assertIn('vkey=single', songs[7]['url'])
+        self.assertIn('vkey=batch', songs[8]['url'])
+
+    @async_test
+    async def test_cache_hits(self):
+        async with _VkeyClient() as client:
+            await client._patch_song_url(*_songs(150))
+            songs = _songs(160)
+            await client._patch_song_url(*songs)
+        self.assertEqual(client.batches, [100, 50, 10])
+        self.assertTrue(all(s['url'] for s in songs))
+
+    @async_test
+    async def test_expiring_vkey_is_not_cached(self):
+        async with _VkeyClient(expiration=300) as client:
+            songs = _songs(5)
+            await client._patch_song_url(*songs)
+            self.assertTrue(all(s['url'] for s in songs))
+            await client._patch_song_url(*_songs(5))
+        self.assertEqual(client.batches, [5, 5])
+
+
 if __name__ == '__main__':
     unittest.main()
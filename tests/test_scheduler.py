@@ -0,0 +1,67 @@
+import asyncio
+import types
+import unittest
+from unittest import mock
+
+from mxget import (
+    limiter,
+    scheduler,
+)
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(f(*args, **kwargs))
+
+    return wrapper
+
+
+class TestScheduler(unittest.TestCase):
+    def tearDown(self):
+        limiter.configure(None)
+
+    @async_test
+    async def test_idle_slots_go_to_other_hosts(self):
+        sched = scheduler.Scheduler(limit=4, per_host=2)
+        inflight = {'a': 0, 'b': 0}
+        peak = {'a': 0, 'b': 0, 'total': 0}
+
+        async def download(host):
+            async with sched.slots(host):
+                inflight[host] += 1
+                peak[host] = max(peak[host], inflight[host])
+                peak['total'] = max(peak['total'], sum(inflight.values()))
+                await asyncio.sleep(0.01)
+                inflight[host] -= 1
+
+        # every download from "a" is queued ahead of the two from "b"
+        await asyncio.gather(*[download('a') for _ in range(6)] + [download('b') for _ in range(2)])
+        self.assertEqual((peak['a'], peak['b'], peak['total']), (2, 2, 4))
+
+    def test_host_rule(self):
+        limiter.configure({'qq.com': {'downloads': 1}})
+        sched = scheduler.Scheduler(limit=16, per_host=4, autotune=True)
+        slots = sched.slots('mobileoc.music.tc.qq.com')
+        self.assertIs(slots, sched.slots('dl.stream.qqmusic.qq.com'))
+        self.assertEqual(slots.limit, 1)
+        self.assertEqual(sched.slots('m10.music.126.net').limit, 4)
+        self.assertEqual(scheduler.Scheduler(limit=2, per_host=4).per_host, 2)
+
+    def test_autotune(self):
+        clock = types.SimpleNamespace(now=0.0)
+        clock.monotonic = lambda: clock.now
+        with mock.patch.object(scheduler, 'time', clock):
+            slots = scheduler.HostSlots(limiter.AdaptiveLimiter(64, 64, 64), 4, 64, autotune=True)
+            limits = []
+            for mb, saturated in ((2, True), (3, True), (1.5, True), (1, False)):
+                slots._saturated = saturated
+                clock.now += 2.0
+                slots.record(int(mb * 1024 * 1024))
+                limits.append(slots.limit)
+        # grows while throughput improves, steps back once it drops, holds when idle
+        self.assertEqual(limits, [5, 6, 5, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
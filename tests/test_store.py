@@ -0,0 +1,62 @@
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from mxget import store
+
+
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _file(self, name: str, data: bytes) -> pathlib.Path:
+        file_path = self.root.joinpath(name)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(data)
+        return file_path
+
+    def test_link_fallbacks(self):
+        src = self._file('a/src.mp3', b'audio')
+        self.assertEqual(store.link(src, self.root.joinpath('b/hard.mp3')), store.HARDLINK)
+        self.assertTrue(os.path.samefile(str(src), str(self.root.joinpath('b/hard.mp3'))))
+
+        with mock.patch('os.link', side_effect=OSError):
+            self.assertEqual(store.link(src, self.root.joinpath('c/soft.mp3')), store.SYMLINK)
+            self.assertEqual(os.readlink(str(self.root.joinpath('c/soft.mp3'))), '../a/src.mp3')
+            with mock.patch('os.symlink', side_effect=OSError):
+                self.assertEqual(store.link(src, self.root.joinpath('c/copy.mp3')), store.COPY)
+        self.assertEqual(self.root.joinpath('c/copy.mp3').read_bytes(), b'audio')
+
+    def test_link_replaces_existing(self):
+        src = self._file('src.mp3', b'new')
+        dst = self._file('dst.mp3', b'old')
+        store.link(src, dst)
+        self.assertEqual(dst.read_bytes(), b'new')
+        self.assertEqual(store.link(src, dst), store.HARDLINK)
+
+    def test_ingest_dedupes(self):
+        first = self._file('p1/song.mp3', b'same')
+        second = self._file('p2/song.mp3', b'same')
+        obj = store.ingest(self.root, first, 'ab12')
+        self.assertEqual(obj, self.root.joinpath('.objects', 'ab', 'ab12.mp3'))
+        self.assertEqual(store.ingest(self.root, second, 'ab12'), obj)
+        self.assertTrue(os.path.samefile(str(first), str(second)))
+        self.assertEqual(obj.stat().st_nlink, 3)
+
+    def test_detach(self):
+        src = self._file('src.mp3', b'shared')
+        dst = self.root.joinpath('dst.mp3')
+        store.link(src, dst)
+        store.detach(dst)
+        dst.write_bytes(b'changed')
+        self.assertEqual(src.read_bytes(), b'shared')
+
+
+if __name__ == '__main__':
+    unittest.main()
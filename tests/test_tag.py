@@ -0,0 +1,45 @@
+import asyncio
+import pathlib
+import tempfile
+import unittest
+
+from mutagen import (
+    id3,
+)
+
+from mxget import (
+    api,
+    cover,
+    tag,
+)
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(f(*args, **kwargs))
+
+    return wrapper
+
+
+class TestTagger(unittest.TestCase):
+    @async_test
+    async def test_apply(self):
+        song = api.Song(1, 'name', 'artist', 'album', lyric='[00:00.00] la')
+        pic = cover.Cover(b'\x89PNG....')
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [pathlib.Path(tmp, '{}.mp3'.format(i)) for i in range(8)]
+            for path in paths:
+                path.write_bytes(b'\xff\xfb\x90\x00' * 1024)
+            with tag.Tagger(2) as tagger:
+                await asyncio.gather(*[tagger.apply(path, tag.song_frames(song, pic)) for path in paths])
+
+            for path in paths:
+                audio = id3.ID3(str(path))
+                self.assertEqual(str(audio['TIT2']), 'name')
+                self.assertEqual(audio.getall('APIC')[0].mime, 'image/png')
+                self.assertTrue(path.read_bytes().endswith(b'\xff\xfb\x90\x00' * 1024))
+
+
+if __name__ == '__main__':
+    unittest.main()
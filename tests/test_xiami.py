@@ -1,8 +1,14 @@
 import asyncio
+import hashlib
+import json
+import time
 import unittest
 
+from mxget import exceptions
 from mxget.provider import xiami
 
+import fakes
+
 
 def async_test(f):
     def wrapper(*args, **kwargs):
@@ -50,5 +56,113 @@ class TestXiaMi(unittest.TestCase):
             self.assertIsNotNone(resp)
 
 
+class _MtopClient(fakes.LocalClient, xiami.XiaMi):
+    """Hands out tokens and answers signed mtop requests, recording the token each was signed with."""
+
+    def __init__(self, rejected: tuple = ()):
+        super().__init__()
+        self.rejected = set(rejected)
+        self.bootstraps = 0
+        self.signed_with = []
+
+    def _token_of(self, params: dict) -> str:
+        for i in range(1, self.bootstraps + 1):
+            token = 'tok{}'.format(i)
+            sign_str = '{}&{}&{}&{}'.format(token, params['t'], xiami._APP_KEY, params['data'])
+            if hashlib.md5(sign_str.encode('utf-8')).hexdigest() == params['sign']:
+                return token
+        return ''
+
+    async def answer(self, method: str, url: str, **kwargs):
+        if 'params' not in kwargs:
+            self.bootstraps += 1
+            token = 'tok{}'.format(self.bootstraps)
+            # let concurrent callers pile up behind the bootstrap
+            await asyncio.sleep(0.01)
+            expiry = int((time.time() + 3600) * 1000)
+            return fakes.Response({'ret': ['FAIL_SYS_TOKEN_EMPTY::令牌为空']},
+                                  cookies={xiami._TOKEN_COOKIE: '{}_{}'.format(token, expiry)})
+
+        token = self._token_of(kwargs['params'])
+        self.signed_with.append(token)
+        if token in self.rejected:
+            return {'ret': ['FAIL_SYS_TOKEN_EXOIRED::令牌过期']}
+        model = json.loads(json.loads(kwargs['params']['data'])['requestStr'])['model']
+        return {'ret': ['SUCCESS::调用成功'], 'data': self.serve(url, model, token)}
+
+    def serve(self, url: str, model: dict, token: str) -> dict:
+        return {'token': token}
+
+
+def _tracks(song_ids) -> list:
+    return [{'songId': i, 'songName': 'song {}'.format(i), 'singers': 'singer', 'listenFiles': []} for i in song_ids]
+
+
+class _PlaylistClient(_MtopClient):
+    """Serves a playlist of ``total`` songs; the first token expires once the first page is in."""
+
+    def __init__(self, total: int):
+        super().__init__()
+        self.total = total
+
+    def serve(self, url: str, model: dict, token: str) -> dict:
+        if url == xiami._API_GET_PLAYLIST_DETAIL:
+            self.rejected.add('tok1')
+            return {'data': {'collectDetail': {
+                'listId': model['listid'],
+                'collectName': 'playlist',
+                'songCount': self.total,
+                'allSongs': list(range(self.total)),
+                'songs': _tracks(range(min(self.total, xiami._SONG_REQUEST_LIMIT))),
+            }}}
+        return {'data': {'songs': _tracks(model['songIds'])}}
+
+
+class TestMtop(unittest.TestCase):
+    @async_test
+    async def test_concurrent_callers_share_bootstrap(self):
+        async with _MtopClient() as client:
+            results = await asyncio.gather(*[
+                client._mtop(xiami._API_GET_SONG_DETAIL, {'songId': i}, 'get song') for i in range(5)
+            ])
+        self.assertEqual(client.bootstraps, 1)
+        self.assertEqual(client.signed_with, ['tok1'] * 5)
+        self.assertEqual([r['data']['token'] for r in results], ['tok1'] * 5)
+
+    @async_test
+    async def test_rejected_token_is_refreshed_once(self):
+        async with _MtopClient(rejected=('tok1',)) as client:
+            resp = await client._mtop(xiami._API_GET_SONG_DETAIL, {'songId': 1}, 'get song')
+        self.assertEqual(resp['data']['token'], 'tok2')
+        self.assertEqual(client.bootstraps, 2)
+        self.assertEqual(client.signed_with, ['tok1', 'tok2'])
+
+    @async_test
+    async def test_rejected_retry_gives_up(self):
+        async with _MtopClient(rejected=('tok1', 'tok2', 'tok3')) as client:
+            with self.assertRaises(exceptions.ResponseError):
+                await client._mtop(xiami._API_GET_SONG_DETAIL, {'songId': 1}, 'get song')
+        self.assertEqual(client.bootstraps, 2)
+        self.assertEqual(client.signed_with, ['tok1', 'tok2'])
+
+
+class TestPlaylist(unittest.TestCase):
+    @async_test
+    async def test_iter_playlist_songs_refreshes_token(self):
+        async with _PlaylistClient(total=450) as client:
+            songs = [song async for song in client.iter_playlist_songs('1')]
+        self.assertEqual([song.id for song in songs], list(range(450)))
+        # the expired token is refreshed once and the rejected page retried with the new one
+        self.assertEqual(client.bootstraps, 2)
+        self.assertEqual(client.signed_with, ['tok1', 'tok1', 'tok2', 'tok2'])
+
+    @async_test
+    async def test_get_playlist(self):
+        async with _PlaylistClient(total=450) as client:
+            playlist = await client.get_playlist('1')
+        self.assertEqual((playlist.name, playlist.count), ('playlist', 450))
+        self.assertEqual([song.id for song in playlist.songs], list(range(450)))
+
+
 if __name__ == '__main__':
     unittest.main()